@@ -0,0 +1,129 @@
+import ipaddress
+import json
+import logging
+from datetime import datetime
+
+from django.conf import settings
+from django.db import InterfaceError, OperationalError
+from django.utils import timezone
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+from .models import UserLoginActivity
+
+LOGIN_ACTIVITY = getattr(settings, 'LOGIN_ACTIVITY', {})
+
+logger = logging.getLogger('login_activity')
+
+
+class LoginActivityBuffer:
+    """
+    Buffered writer of UserLoginActivity rows.
+
+    Login events are appended to a Redis list and written by flush() with bulk_create, either as soon as
+    BATCH_SIZE events are queued or on the celery beat interval. A batch is moved to the processing list before
+    it is written and removed from there only after the insert; a batch left over by a crashed flush is written
+    by the next one, so every event is stored at least once. A batch that fails for other reasons than a lost
+    database connection is written event by event, and the failing events are moved to the dead letter list,
+    so a bad event can't stall the queue. Events queued in Redis survive restarts of web and celery workers.
+    If Redis is unavailable, the event is saved directly.
+    """
+    key = 'login_activity:queue'
+    processing_key = 'login_activity:processing'
+    dead_key = 'login_activity:dead'
+    lock_key = 'login_activity:flush'
+    batch_size = LOGIN_ACTIVITY.get('BATCH_SIZE', 500)
+    lock_timeout = LOGIN_ACTIVITY.get('LOCK_TIMEOUT', 60)
+
+    @classmethod
+    def get_connection(cls):
+        return get_redis_connection('default')
+
+    @staticmethod
+    def clean(fields):
+        """Makes sure a single malformed event can't fail the whole batch insert."""
+
+        try:
+            fields['login_IP'] = str(ipaddress.ip_address(fields.get('login_IP', '').strip()))
+        except (AttributeError, ValueError):
+            fields['login_IP'] = None
+        for name in ('login_email', 'user_agent_info'):
+            if fields.get(name) is not None:
+                fields[name] = fields[name][:UserLoginActivity._meta.get_field(name).max_length]
+        fields.setdefault('login_datetime', timezone.now())
+        return fields
+
+    @classmethod
+    def record(cls, **fields):
+        """Queues a login event with the UserLoginActivity fields given."""
+
+        fields = cls.clean(fields)
+        event = dict(fields, login_datetime=fields['login_datetime'].isoformat())
+        try:
+            queued = cls.get_connection().rpush(cls.key, json.dumps(event))
+        except RedisError as e:
+            logger.error(f"Login activity buffer is unavailable: {e}")
+            UserLoginActivity.objects.create(**fields)
+            return
+        if queued % cls.batch_size == 0:
+            from .tasks import flush_login_activity
+            flush_login_activity.delay()
+
+    @staticmethod
+    def _to_activity(event):
+        event = json.loads(event)
+        event['login_datetime'] = datetime.fromisoformat(event['login_datetime'])
+        return UserLoginActivity(**event)
+
+    @classmethod
+    def _write(cls, events):
+        UserLoginActivity.objects.bulk_create([cls._to_activity(event) for event in events])
+        return len(events)
+
+    @classmethod
+    def write_batch(cls, connection, events):
+        """Writes the events of the batch, moving the events that can't be written to the dead letters."""
+
+        try:
+            written = cls._write(events)
+        except (OperationalError, InterfaceError):
+            raise
+        except Exception as e:
+            logger.error(f"Login activity batch can't be written, writing its events one by one: {e}")
+            written = None
+        if written is None:
+            written = 0
+            for event in events:
+                try:
+                    written += cls._write([event])
+                except (OperationalError, InterfaceError):
+                    raise
+                except Exception as e:
+                    logger.error(f"Login activity event is moved to {cls.dead_key}: {e}")
+                    connection.rpush(cls.dead_key, event)
+        connection.delete(cls.processing_key)
+        return written
+
+    @classmethod
+    def flush(cls):
+        """Writes all queued events. Returns the number of written events (None if another flush is running)."""
+
+        connection = cls.get_connection()
+        lock = connection.lock(cls.lock_key, timeout=cls.lock_timeout)
+        if not lock.acquire(blocking=False):
+            return None
+        written = 0
+        try:
+            events = connection.lrange(cls.processing_key, 0, -1)
+            while True:
+                if events:
+                    written += cls.write_batch(connection, events)
+                    lock.extend(cls.lock_timeout, replace_ttl=True)
+                pipe = connection.pipeline(transaction=False)
+                for _ in range(cls.batch_size):
+                    pipe.lmove(cls.key, cls.processing_key, 'LEFT', 'RIGHT')
+                events = [event for event in pipe.execute() if event is not None]
+                if not events:
+                    return written
+        finally:
+            lock.release()
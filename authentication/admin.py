@@ -45,6 +45,9 @@ admin.site.register(CompanyAndUserRelation, CompanyAndUserRelationAdmin)
 
 class UserLoginActivityAdmin(admin.ModelAdmin):
     list_display = ["login_email", "status", "login_datetime"]
+    ordering = ["-login_datetime"]
+    # counting all rows of the table would scan every partition
+    show_full_result_count = False
 
 
 admin.site.register(UserLoginActivity, UserLoginActivityAdmin)
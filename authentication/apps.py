@@ -6,5 +6,4 @@ class AuthenticationConfig(AppConfig):
     name = "authentication"
 
     def ready(self):
-        from .signals import (log_user_logged_in_failed,
-                              log_user_logged_in_success)
+        from . import signals  # pylint: disable=unused-import
@@ -3,13 +3,16 @@ from typing import Optional, Tuple
 from rest_framework.exceptions import NotAuthenticated
 from rest_framework.request import Request
 from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import TokenError
 from rest_framework_simplejwt.settings import api_settings
 from rest_framework_simplejwt.tokens import Token
 from rest_framework_simplejwt.utils import get_md5_hash_password
 
 from forum.errors import Error
 
+from .cache import PrincipalCache, VerifiedTokenCache
 from .models import CompanyAndUserRelation, CustomUser
+from .principals import CompanySnapshot, TokenPrincipal
 
 
 class UserAuthentication(JWTAuthentication):
@@ -19,6 +22,8 @@ class UserAuthentication(JWTAuthentication):
     related company.
     This authentification always returns AuthUser instance (request.user). If no user found or other error occures
     the empty AuthUser instance is returned with error written in related AuthUser field. 
+    Tokens with embedded company claims of the current relation version are resolved to a TokenPrincipal
+    without touching the database. Verified tokens are taken from the VerifiedTokenCache.
     
     """
     
@@ -39,32 +44,41 @@ class UserAuthentication(JWTAuthentication):
         validated_token = self.get_validated_token(raw_token) 
         return self.get_user(validated_token), validated_token 
 
+    def get_validated_token(self, raw_token: bytes) -> Token:
+        """
+        Returns the validated token from the verified token cache, verifying it on a miss.
+        Invalid tokens fall through to the default validation that builds the error response.
+        """
+        for token_class in api_settings.AUTH_TOKEN_CLASSES:
+            try:
+                return VerifiedTokenCache.get_token(raw_token, token_class)
+            except TokenError:
+                continue
+        return super().get_validated_token(raw_token)
+
     def get_user(self, validated_token: Token) -> CustomUser:
         """
-        This method retrieves the user from the database. If company credentials are present in token,
-        company information is added. 
+        This method retrieves the user from the principal cache or, on a miss, from the database. If company
+        credentials are present in token, company information is added. 
 
         """
-        if not 'company_id' in validated_token:
-            try:
-                user_id = validated_token[api_settings.USER_ID_CLAIM] 
-                user = CustomUser.get_user(user_id=user_id)
-            except KeyError: 
-                raise NotAuthenticated(detail=Error.NO_USER_ID.msg, status_code=Error.NO_USER_ID.status)
-            except CustomUser.DoesNotExist: 
-                raise NotAuthenticated(detail=Error.USER_NOT_FOUND.msg, status_code=Error.USER_NOT_FOUND.status)
-        else:
-            try:
-                user_id = validated_token[api_settings.USER_ID_CLAIM] 
-                company_id = validated_token['company_id'] 
-                user = CustomUser.get_user(user_id=user_id)
-                relation = CompanyAndUserRelation.get_relation(user_id=user_id, company_id=company_id)
-                user.company = relation.company_id.__dict__
-                user.position = relation.position
-                user.relation_id = relation.relation_id
-            except KeyError:
-                raise NotAuthenticated(detail=Error.NO_USER_OR_COMPANY_ID.msg)
-            
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM] 
+        except KeyError: 
+            raise NotAuthenticated(detail=Error.NO_USER_ID.msg, status_code=Error.NO_USER_ID.status)
+        company_id = validated_token.get('company_id')
+
+        user = None
+        if company_id is not None:
+            user = TokenPrincipal.from_token(validated_token, user_id, company_id)
+        if user is None:
+            user = PrincipalCache.get(user_id, company_id)
+        if user is None:
+            if company_id is None:
+                user = self.get_user_from_db(user_id)
+            else:
+                user = self.get_company_user_from_db(user_id, company_id)
+            PrincipalCache.set(user, user_id, company_id)
 
         if api_settings.CHECK_REVOKE_TOKEN:
             if validated_token.get(
@@ -75,3 +89,19 @@ class UserAuthentication(JWTAuthentication):
         user.is_authenticated = True
         return user
 
+    def get_user_from_db(self, user_id) -> CustomUser:
+        try:
+            return CustomUser.get_user(user_id=user_id)
+        except CustomUser.DoesNotExist: 
+            raise NotAuthenticated(detail=Error.USER_NOT_FOUND.msg, status_code=Error.USER_NOT_FOUND.status)
+
+    def get_company_user_from_db(self, user_id, company_id) -> CustomUser:
+        try:
+            relation = CompanyAndUserRelation.get_relation_with_user_and_company(user_id, company_id)
+        except CompanyAndUserRelation.DoesNotExist:
+            raise NotAuthenticated(detail=Error.NO_RELATED_TO_COMPANY.msg)
+        user = relation.user_id
+        user.company = CompanySnapshot.from_company(relation.company_id)
+        user.position = relation.position
+        user.relation_id = relation.relation_id
+        return user
@@ -0,0 +1,207 @@
+import copy
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.utils import aware_utcnow, datetime_to_epoch
+
+PRINCIPAL_CACHE = getattr(settings, 'PRINCIPAL_CACHE', {})
+VERIFIED_TOKEN_CACHE = getattr(settings, 'VERIFIED_TOKEN_CACHE', {})
+
+
+class LRUCache:
+    """
+    Thread-safe bounded mapping with optional per-entry expiry.
+    The least recently used entry is evicted once maxsize is exceeded.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires_at = self._data[key]
+            except KeyError:
+                return default
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class PrincipalCache:
+    """
+    Two-level cache of resolved request principals (CustomUser with company credentials attached),
+    keyed by (user_id, company_id). A per-process LRU sits in front of the shared cache (Redis).
+
+    Entries are dropped by post_save/post_delete signals of CustomUser, Company and CompanyAndUserRelation
+    (see authentication.signals). Signals only reach the local LRU of the process that made the change,
+    so other processes may serve a local entry for at most LOCAL_TTL seconds after an update.
+    """
+    key_prefix = 'principal'
+    timeout = PRINCIPAL_CACHE.get('TIMEOUT', 300)
+    local = LRUCache(maxsize=PRINCIPAL_CACHE.get('LOCAL_MAXSIZE', 1024), ttl=PRINCIPAL_CACHE.get('LOCAL_TTL', 5))
+    counters = {'local_hits': 0, 'shared_hits': 0, 'misses': 0}
+
+    @classmethod
+    def make_key(cls, user_id, company_id=None):
+        return f"{cls.key_prefix}:{user_id}:{company_id if company_id is not None else '-'}"
+
+    @classmethod
+    def get(cls, user_id, company_id=None):
+        """Returns a copy of the cached principal or None. The copy may be freely changed by the request."""
+
+        key = cls.make_key(user_id, company_id)
+        principal = cls.local.get(key)
+        if principal is not None:
+            cls.counters['local_hits'] += 1
+            return copy.copy(principal)
+        principal = cache.get(key)
+        if principal is None:
+            cls.counters['misses'] += 1
+            return None
+        cls.counters['shared_hits'] += 1
+        cls.local.set(key, principal)
+        return copy.copy(principal)
+
+    @classmethod
+    def set(cls, principal, user_id, company_id=None):
+        key = cls.make_key(user_id, company_id)
+        principal = copy.copy(principal)
+        cls.local.set(key, principal)
+        cache.set(key, principal, cls.timeout)
+
+    @classmethod
+    def invalidate(cls, pairs):
+        """Drops principals for the given iterable of (user_id, company_id) pairs."""
+
+        keys = [cls.make_key(user_id, company_id) for user_id, company_id in pairs]
+        for key in keys:
+            cls.local.delete(key)
+        if keys:
+            cache.delete_many(keys)
+
+    @classmethod
+    def get_stats(cls):
+        """Returns hit/miss counters of the current process together with the overall hit ratio."""
+
+        stats = dict(cls.counters)
+        total = sum(stats.values())
+        stats['hit_ratio'] = (stats['local_hits'] + stats['shared_hits']) / total if total else 0.0
+        return stats
+
+    @classmethod
+    def reset_stats(cls):
+        for name in cls.counters:
+            cls.counters[name] = 0
+
+
+class RelationVersions:
+    """
+    Version counters of user-company relations kept in the shared cache (Redis).
+    Tokens with embedded company claims carry the version of their relation; the claims are trusted only while
+    it matches the current one. A missing counter (eviction, cache outage) never matches, so the request falls
+    back to the database. New counters start at a time-based value, so a recreated counter can't repeat
+    an old version.
+    """
+    key_prefix = 'relation_version'
+
+    @classmethod
+    def make_key(cls, relation_id):
+        return f'{cls.key_prefix}:{relation_id}'
+
+    @classmethod
+    def get(cls, relation_id):
+        return cache.get(cls.make_key(relation_id))
+
+    @classmethod
+    def current(cls, relation_id):
+        """Returns the current version of the relation, creating the counter if needed."""
+
+        key = cls.make_key(relation_id)
+        cache.add(key, time.time_ns(), timeout=None)
+        return cache.get(key)
+
+    @classmethod
+    def bump(cls, relation_ids):
+        for relation_id in relation_ids:
+            try:
+                cache.incr(cls.make_key(relation_id))
+            except ValueError:
+                # no counter means no token relies on it
+                pass
+
+
+class VerifiedTokenCache:
+    """
+    Per-process LRU of verified tokens keyed by a digest of the raw token and the token class.
+
+    A hit skips base64 decoding, signature verification and JSON parsing: the cached payload is copied into
+    a new token instance, so callers may change it. Entries live until the token expires (TTL seconds at most)
+    and the expiry is checked again on every hit. Only the verification result is cached: the user, company
+    and revoke claim checks of UserAuthentication still run on every request, so revocation is not delayed.
+    Token classes that consult the blacklist on verification must not be cached.
+    """
+    local = LRUCache(maxsize=VERIFIED_TOKEN_CACHE.get('MAXSIZE', 10000), ttl=VERIFIED_TOKEN_CACHE.get('TTL', 300))
+    counters = {'hits': 0, 'misses': 0}
+
+    @staticmethod
+    def make_key(raw_token, token_class):
+        if isinstance(raw_token, str):
+            raw_token = raw_token.encode()
+        return f'{token_class.__name__}:{hashlib.blake2b(raw_token, digest_size=32).hexdigest()}'
+
+    @classmethod
+    def get_token(cls, raw_token, token_class):
+        """Returns a verified token_class instance of raw_token. Raises TokenError if the token is invalid."""
+
+        key = cls.make_key(raw_token, token_class)
+        payload = cls.local.get(key)
+        if payload is None:
+            cls.counters['misses'] += 1
+            token = token_class(raw_token)
+            ttl = token.payload.get('exp', 0) - datetime_to_epoch(token.current_time)
+            if ttl > 0:
+                cls.local.set(key, copy.deepcopy(token.payload), ttl=min(cls.local.ttl, ttl))
+            return token
+
+        cls.counters['hits'] += 1
+        token = token_class.__new__(token_class)
+        token.token = raw_token
+        token.current_time = aware_utcnow()
+        token.payload = copy.deepcopy(payload)
+        try:
+            token.check_exp()
+        except TokenError:
+            cls.local.delete(key)
+            raise
+        return token
@@ -0,0 +1,95 @@
+import logging
+import random
+
+from django.conf import settings
+from django.db import transaction
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+COMPANY_COUNTERS = getattr(settings, 'COMPANY_COUNTERS', {})
+
+logger = logging.getLogger('company_counters')
+
+
+class CompanyCounters:
+    """
+    Follower, newsletter subscriber and article counters of companies, kept in Redis.
+
+    Every company has SHARDS hashes of counters. An increment goes to a random shard, so concurrent writes for
+    a hot company don't contend on a single key, and a read sums all shards in one round trip.
+    Subscription changes are counted after commit, so rolled back writes never change the counters.
+    Counts lost to a Redis outage or changed by writes that aren't counted (e.g. toggled newsletters) are
+    corrected by the periodic reconciliation against the source tables (see companies.tasks).
+    """
+    key_prefix = 'company_counters'
+    fields = ('followers', 'newsletter_subscribers', 'articles')
+    shards = COMPANY_COUNTERS.get('SHARDS', 8)
+
+    @classmethod
+    def get_connection(cls):
+        return get_redis_connection('default')
+
+    @classmethod
+    def make_key(cls, company_id, shard):
+        return f'{cls.key_prefix}:{company_id}:{shard}'
+
+    @classmethod
+    def make_keys(cls, company_id):
+        return [cls.make_key(company_id, shard) for shard in range(cls.shards)]
+
+    @classmethod
+    def add(cls, changes):
+        """Applies {company_id: {field: delta}} in a single MULTI."""
+
+        try:
+            pipe = cls.get_connection().pipeline()
+            for company_id, deltas in changes.items():
+                key = cls.make_key(company_id, random.randrange(cls.shards))
+                for field, delta in deltas.items():
+                    if delta:
+                        pipe.hincrby(key, field, delta)
+            pipe.execute()
+        except RedisError as e:
+            logger.error(f"Company counters can't be updated, they are fixed by the next reconciliation: {e}")
+
+    @classmethod
+    def add_on_commit(cls, changes):
+        if changes:
+            transaction.on_commit(lambda: cls.add(changes))
+
+    @classmethod
+    def get(cls, company_id):
+        """Returns {field: count} of the company, or None if the counters are unavailable."""
+
+        try:
+            pipe = cls.get_connection().pipeline(transaction=False)
+            for key in cls.make_keys(company_id):
+                pipe.hgetall(key)
+            shards = pipe.execute()
+        except RedisError as e:
+            logger.error(f"Company counters can't be read: {e}")
+            return None
+        counters = dict.fromkeys(cls.fields, 0)
+        for shard in shards:
+            for field, value in shard.items():
+                field = field.decode()
+                if field in counters:
+                    counters[field] += int(value)
+        return counters
+
+    @classmethod
+    def replace(cls, counts):
+        """Replaces the counters of the companies with {company_id: {field: count}} in a single MULTI."""
+
+        pipe = cls.get_connection().pipeline()
+        for company_id, values in counts.items():
+            pipe.delete(*cls.make_keys(company_id))
+            pipe.hset(cls.make_key(company_id, 0), mapping=values)
+        pipe.execute()
+
+    @classmethod
+    def delete(cls, company_id):
+        try:
+            cls.get_connection().delete(*cls.make_keys(company_id))
+        except RedisError as e:
+            logger.error(f"Company counters can't be deleted: {e}")
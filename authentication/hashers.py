@@ -0,0 +1,113 @@
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import django
+from django.conf import settings
+from django.contrib.auth import hashers
+from rest_framework.exceptions import APIException
+
+from forum.errors import Error
+
+PASSWORD_HASHING = getattr(settings, 'PASSWORD_HASHING', {})
+
+logger = logging.getLogger('password_hashing')
+
+
+class HashingServiceUnavailable(APIException):
+    status_code = Error.HASHING_SERVICE_UNAVAILABLE.status
+    default_detail = Error.HASHING_SERVICE_UNAVAILABLE.msg
+    default_code = 'hashing_service_unavailable'
+
+
+def _init_worker():
+    django.setup()
+
+
+def _verify_password(password, encoded):
+    return hashers.verify_password(password, encoded)
+
+
+def _make_password(password):
+    return hashers.make_password(password)
+
+
+class PasswordHashingService:
+    """
+    Runs password hashing (PBKDF2 by default) in a bounded process pool instead of the request worker.
+    At most MAX_PENDING hashes may be queued or running at a time, including the ones that timed out; beyond that
+    requests fail fast with 503 instead of piling up behind each other. With WORKERS = 0 hashing runs inline, still bounded by MAX_PENDING.
+    """
+    workers = PASSWORD_HASHING.get('WORKERS', 0)
+    max_pending = PASSWORD_HASHING.get('MAX_PENDING', 32)
+    timeout = PASSWORD_HASHING.get('TIMEOUT', 10)
+    _executor = None
+    _executor_lock = threading.Lock()
+    _slots = threading.BoundedSemaphore(max_pending)
+
+    @staticmethod
+    def make_executor(workers):
+        """Returns a new pool of hashing processes, to be shut down by the caller."""
+        return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+
+    @classmethod
+    def get_executor(cls):
+        if cls._executor is None:
+            with cls._executor_lock:
+                if cls._executor is None:
+                    cls._executor = cls.make_executor(cls.workers)
+        return cls._executor
+
+    @classmethod
+    def run(cls, func, *args):
+        if not cls._slots.acquire(blocking=False):
+            logger.warning("Password hashing queue is full")
+            raise HashingServiceUnavailable()
+        if not cls.workers:
+            try:
+                return func(*args)
+            finally:
+                cls._slots.release()
+        try:
+            future = cls.get_executor().submit(func, *args)
+        except BaseException:
+            cls._slots.release()
+            raise
+        # the slot is held until the hash is done, even if the request stops waiting for it
+        future.add_done_callback(lambda _: cls._slots.release())
+        try:
+            return future.result(timeout=cls.timeout)
+        except FutureTimeoutError:
+            raise HashingServiceUnavailable()
+
+    @classmethod
+    def check_password(cls, password, encoded) -> tuple[bool, bool]:
+        """Returns whether the password is correct and whether its hash must be updated to the current hasher."""
+
+        if password is None or not encoded:
+            return False, False
+        return cls.run(_verify_password, password, encoded)
+
+    @classmethod
+    def make_password(cls, password) -> str:
+        if password is None:
+            return hashers.make_password(None)
+        return cls.run(_make_password, password)
+
+    @staticmethod
+    def hash_many(passwords, executor=None, chunksize=64):
+        """
+        Returns an iterator of the hashes of the passwords, in order, computed in the executor (see make_executor)
+        or inline. Meant for batch jobs, so it isn't bounded by MAX_PENDING.
+        """
+        if executor is None:
+            return map(_make_password, passwords)
+        return executor.map(_make_password, passwords, chunksize=chunksize)
+
+    @classmethod
+    def set_password(cls, user, raw_password):
+        """Same as user.set_password, but hashes in the pool."""
+
+        user.password = cls.make_password(raw_password)
+        user._password = raw_password
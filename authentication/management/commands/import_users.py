@@ -0,0 +1,196 @@
+import csv
+import json
+import os
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+
+from authentication.hashers import PasswordHashingService
+from authentication.models import Company, CompanyAndUserRelation, CustomUser
+from validation.serializers import CustomValidationSerializer
+
+USER_FIELDS = ('email', 'first_name', 'surname', 'phone_number')
+POSITIONS = {CompanyAndUserRelation.FOUNDER, CompanyAndUserRelation.REPRESENTATIVE}
+POSITION_DEFAULT = CompanyAndUserRelation.REPRESENTATIVE
+TRUE_VALUES = {True, 'true', 'True', '1', 'yes'}
+
+
+class Command(BaseCommand):
+    help = """
+        Imports users and their company relations from a CSV or NDJSON file.
+
+        Every record is a user: email, password, first_name, surname, phone_number and optionally the company
+        the user belongs to: company_brand, company_edrpou, company_is_startup and position (F or R).
+        Companies are matched by EDRPOU (or by brand when there is none) and created when missing.
+
+        Records are imported in batches, one transaction each: uniqueness of emails and phone numbers is checked
+        with one query per batch, passwords are hashed in a process pool and rows are inserted with bulk_create.
+        After every batch the number of processed records is stored in the checkpoint file, so an interrupted
+        import continues where it stopped when run again.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV (with header) or NDJSON file")
+        parser.add_argument('--format', choices=('csv', 'ndjson'), help="defaults to the file extension")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help="password hashing processes, 0 hashes in the command process")
+        parser.add_argument('--checkpoint', help="defaults to <path>.checkpoint")
+        parser.add_argument('--verified', action='store_true', help="mark imported users as verified")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv')
+        checkpoint_path = options['checkpoint'] or f'{path}.checkpoint'
+        batch_size = options['batch_size']
+        self.verified = options['verified']
+        self.verbosity = options['verbosity']
+        self.stats = {'users': 0, 'companies': 0, 'relations': 0, 'skipped': 0}
+
+        position = self.read_checkpoint(checkpoint_path)
+        if position:
+            self.stdout.write(f"Resuming after record {position}")
+
+        executor = PasswordHashingService.make_executor(options['workers']) if options['workers'] else None
+        try:
+            with open(path, newline='', encoding='utf-8') as source:
+                records = islice(self.read_records(source, file_format), position, None)
+                while batch := list(islice(records, batch_size)):
+                    self.import_batch(batch, executor)
+                    position += len(batch)
+                    self.write_checkpoint(checkpoint_path, position)
+                    self.stdout.write(f"Processed {position} records", ending='\r')
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"\nImported {self.stats['users']} users, {self.stats['companies']} companies and "
+            f"{self.stats['relations']} relations, skipped {self.stats['skipped']} records"))
+
+    @staticmethod
+    def read_records(source, file_format):
+        if file_format == 'csv':
+            yield from csv.DictReader(source)
+            return
+        for line in source:
+            if line.strip():
+                yield json.loads(line)
+
+    @staticmethod
+    def read_checkpoint(checkpoint_path):
+        try:
+            with open(checkpoint_path) as checkpoint:
+                return json.load(checkpoint)['position']
+        except FileNotFoundError:
+            return 0
+        except (ValueError, KeyError) as e:
+            raise CommandError(f"Checkpoint {checkpoint_path} is corrupted: {e}")
+
+    @staticmethod
+    def write_checkpoint(checkpoint_path, position):
+        tmp_path = f'{checkpoint_path}.tmp'
+        with open(tmp_path, 'w') as checkpoint:
+            json.dump({'position': position}, checkpoint)
+        os.replace(tmp_path, checkpoint_path)
+
+    def skip(self, record, reason):
+        self.stats['skipped'] += 1
+        if self.verbosity > 1:
+            self.stderr.write(f"Skipped {record.get('email')}: {reason}")
+
+    def clean_batch(self, batch):
+        """Returns valid records of the batch whose email and phone number are not taken yet."""
+
+        records = []
+        for record in batch:
+            record['email'] = CustomUser.objects.normalize_email((record.get('email') or '').strip())
+            phone_number = (record.get('phone_number') or '').strip()
+            record['phone_number'] = phone_number or '-'
+            try:
+                CustomValidationSerializer.validate_contact_email(record['email'])
+                if phone_number:
+                    CustomValidationSerializer.validate_contact_phone(phone_number)
+            except ValidationError as e:
+                self.skip(record, e.detail[0])
+                continue
+            if record.get('position') and record['position'] not in POSITIONS:
+                self.skip(record, f"unknown position {record['position']}")
+                continue
+            try:
+                self.company_key(record)
+            except (TypeError, ValueError):
+                self.skip(record, f"invalid EDRPOU {record['company_edrpou']}")
+                continue
+            records.append(record)
+
+        emails = {record['email'] for record in records}
+        phones = {record['phone_number'] for record in records} - {'-'}
+        taken_emails = set(CustomUser.objects.filter(email__in=emails).values_list('email', flat=True))
+        taken_phones = set(CustomUser.objects.filter(phone_number__in=phones).values_list('phone_number', flat=True))
+        unique = []
+        for record in records:
+            if record['email'] in taken_emails:
+                self.skip(record, "email is taken")
+                continue
+            if record['phone_number'] in taken_phones:
+                self.skip(record, "phone number is taken")
+                continue
+            taken_emails.add(record['email'])
+            if record['phone_number'] != '-':
+                taken_phones.add(record['phone_number'])
+            unique.append(record)
+        return unique
+
+    @staticmethod
+    def company_key(record):
+        edrpou = record.get('company_edrpou')
+        if edrpou not in (None, ''):
+            return 'edrpou', int(edrpou)
+        brand = (record.get('company_brand') or '').strip()
+        return ('brand', brand) if brand else None
+
+    def get_companies(self, records):
+        """Returns {company key: company_id} for all companies of the records, creating the missing ones."""
+
+        keys = {key for key in map(self.company_key, records) if key}
+        edrpous = [value for kind, value in keys if kind == 'edrpou']
+        brands = [value for kind, value in keys if kind == 'brand']
+        companies = {('edrpou', edrpou): company_id for edrpou, company_id
+                     in Company.objects.filter(edrpou__in=edrpous).values_list('edrpou', 'company_id')}
+        companies.update({('brand', brand): company_id for brand, company_id
+                          in Company.objects.filter(brand__in=brands).values_list('brand', 'company_id')})
+
+        new_companies = {}
+        for record in records:
+            key = self.company_key(record)
+            if key and key not in companies and key not in new_companies:
+                new_companies[key] = Company(brand=(record.get('company_brand') or '').strip(),
+                                             edrpou=key[1] if key[0] == 'edrpou' else None,
+                                             is_startup=record.get('company_is_startup') in TRUE_VALUES)
+        created = Company.objects.bulk_create(new_companies.values())
+        self.stats['companies'] += len(created)
+        companies.update({key: company.company_id for key, company in zip(new_companies, created)})
+        return companies
+
+    def import_batch(self, batch, executor):
+        records = self.clean_batch(batch)
+        if not records:
+            return
+        passwords = [record.get('password') or None for record in records]
+        hashed = PasswordHashingService.hash_many(passwords, executor)
+        users = [CustomUser(**{field: (record.get(field) or '').strip() for field in USER_FIELDS},
+                            password=password, is_verified=self.verified)
+                 for record, password in zip(records, hashed)]
+
+        with transaction.atomic():
+            users = CustomUser.objects.bulk_create(users)
+            companies = self.get_companies(records)
+            relations = [CompanyAndUserRelation(user_id=user, company_id_id=companies[key],
+                                                position=record.get('position') or POSITION_DEFAULT)
+                         for user, record in zip(users, records) if (key := self.company_key(record))]
+            CompanyAndUserRelation.objects.bulk_create(relations)
+        self.stats['users'] += len(users)
+        self.stats['relations'] += len(relations)
@@ -0,0 +1,17 @@
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0004_alter_companyanduserrelation_company_id_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='userloginactivity',
+            name='login_datetime',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
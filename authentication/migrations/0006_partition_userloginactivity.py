@@ -0,0 +1,92 @@
+from django.db import migrations, models
+
+TABLE = 'authentication_userloginactivity'
+
+# Moves login activity into a table range-partitioned by month of login_datetime. The primary key has to include
+# the partition key, so it becomes (id, login_datetime); ids still come from the same sequence.
+PARTITION_SQL = f"""
+ALTER TABLE {TABLE} RENAME TO {TABLE}_old;
+ALTER SEQUENCE IF EXISTS {TABLE}_id_seq RENAME TO {TABLE}_old_id_seq;
+CREATE SEQUENCE {TABLE}_id_seq;
+CREATE TABLE {TABLE} (
+    id bigint NOT NULL DEFAULT nextval('{TABLE}_id_seq'),
+    "login_IP" inet NULL,
+    login_datetime timestamp with time zone NOT NULL,
+    login_email varchar(40) NULL,
+    status varchar(1) NULL,
+    user_agent_info varchar(255) NOT NULL,
+    PRIMARY KEY (id, login_datetime)
+) PARTITION BY RANGE (login_datetime);
+ALTER SEQUENCE {TABLE}_id_seq OWNED BY {TABLE}.id;
+CREATE TABLE {TABLE}_default PARTITION OF {TABLE} DEFAULT;
+
+DO $$
+DECLARE
+    month date := date_trunc('month', LEAST(COALESCE((SELECT min(login_datetime) FROM {TABLE}_old), now()), now()));
+BEGIN
+    WHILE month <= date_trunc('month', now()) + interval '2 months' LOOP
+        EXECUTE format('CREATE TABLE %I PARTITION OF {TABLE} FOR VALUES FROM (%L) TO (%L)',
+                       '{TABLE}_y' || to_char(month, 'YYYY') || 'm' || to_char(month, 'MM'),
+                       month, month + interval '1 month');
+        month := month + interval '1 month';
+    END LOOP;
+END $$;
+
+INSERT INTO {TABLE} (id, "login_IP", login_datetime, login_email, status, user_agent_info)
+    SELECT id, "login_IP", login_datetime, login_email, status, user_agent_info FROM {TABLE}_old;
+SELECT setval('{TABLE}_id_seq', COALESCE((SELECT max(id) FROM {TABLE}), 0) + 1, false);
+DROP TABLE {TABLE}_old;
+"""
+
+INDEX_SQL = f"""
+CREATE INDEX login_datetime_idx ON {TABLE} (login_datetime);
+CREATE INDEX login_failed_email_idx ON {TABLE} (login_email, login_datetime) WHERE status = 'F';
+CREATE INDEX login_failed_ip_idx ON {TABLE} ("login_IP", login_datetime) WHERE status = 'F';
+"""
+
+DROP_INDEX_SQL = """
+DROP INDEX login_datetime_idx;
+DROP INDEX login_failed_email_idx;
+DROP INDEX login_failed_ip_idx;
+"""
+
+UNPARTITION_SQL = f"""
+ALTER SEQUENCE {TABLE}_id_seq OWNED BY NONE;
+CREATE TABLE {TABLE}_old (LIKE {TABLE});
+INSERT INTO {TABLE}_old SELECT * FROM {TABLE};
+DROP TABLE {TABLE};
+ALTER TABLE {TABLE}_old RENAME TO {TABLE};
+ALTER TABLE {TABLE} ADD PRIMARY KEY (id);
+ALTER SEQUENCE {TABLE}_id_seq OWNED BY {TABLE}.id;
+ALTER TABLE {TABLE} ALTER COLUMN id SET DEFAULT nextval('{TABLE}_id_seq');
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0005_alter_userloginactivity_login_datetime'),
+    ]
+
+    operations = [
+        migrations.RunSQL(PARTITION_SQL, UNPARTITION_SQL),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[migrations.RunSQL(INDEX_SQL, DROP_INDEX_SQL)],
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='userloginactivity',
+                    index=models.Index(fields=['login_datetime'], name='login_datetime_idx'),
+                ),
+                migrations.AddIndex(
+                    model_name='userloginactivity',
+                    index=models.Index(condition=models.Q(('status', 'F')), fields=['login_email', 'login_datetime'],
+                                       name='login_failed_email_idx'),
+                ),
+                migrations.AddIndex(
+                    model_name='userloginactivity',
+                    index=models.Index(condition=models.Q(('status', 'F')), fields=['login_IP', 'login_datetime'],
+                                       name='login_failed_ip_idx'),
+                ),
+            ],
+        ),
+    ]
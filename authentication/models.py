@@ -1,18 +1,29 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 
 from django.contrib.auth.base_user import AbstractBaseUser, BaseUserManager
 from django.contrib.auth.models import AbstractUser, PermissionsMixin
 from django.db import models
+from django.utils import timezone
 from rest_framework.exceptions import NotAuthenticated
 from rest_framework_simplejwt.exceptions import TokenError
 from rest_framework_simplejwt.tokens import AccessToken
 from reversion import register
 
 from forum.errors import Error
+from forum.identity_map import IdentityMap
+from forum.pagination import KeysetPaginator
+
+from .counters import CompanyCounters
+from .hashers import PasswordHashingService
 
 STARTUP = 'startup'
 INVESTMENT = 'investment'
 
+# columns loaded by the single-query company-scoped authentication path
+USER_AUTH_FIELDS = ('user_id', 'password', 'email', 'first_name', 'surname', 'phone_number', 'registration_date',
+                    'is_verified', 'is_superuser', 'is_active', 'is_staff')
+COMPANY_AUTH_FIELDS = ('company_id', 'brand', 'is_startup')
+
 
 class CustomUserManager(BaseUserManager):
 
@@ -21,7 +32,7 @@ class CustomUserManager(BaseUserManager):
             raise ValueError("The email must be set")
         email = self.normalize_email(email)
         user: CustomUser = self.model(email=email, **extra_fields)
-        user.set_password(password)
+        PasswordHashingService.set_password(user, password)
         user.registration_date = datetime.now()
         user.save()
         return user
@@ -60,7 +71,7 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
 
     @classmethod
     def get_user(cls, *args, **kwargs):
-        return cls.objects.get(**kwargs)
+        return IdentityMap.get(cls, **kwargs)
 
     def get_company_type(self):
         if self.company is None:
@@ -97,9 +108,16 @@ class Company(models.Model):
     startup_idea = models.TextField(blank=True)
     tags = models.CharField(max_length=255, blank=True)
 
+    paginator = KeysetPaginator(('company_id',))
+    INFO_FIELDS = ('brand', 'common_info', 'contact_phone', 'contact_email')
+    STARTUP_INFO_FIELDS = ('product_info', 'startup_idea')
+    # every column but the large text ones, which only the detail view needs
+    SUMMARY_FIELDS = ('company_id', 'brand', 'is_startup', 'contact_phone', 'contact_email', 'registration_date',
+                      'edrpou', 'address', 'tags')
+
     @classmethod
     def get_company(cls, *args, **kwargs):
-        return cls.objects.get(**kwargs)
+        return IdentityMap.get(cls, **kwargs)
 
     @classmethod
     def get_companies(cls, *args, **kwargs):
@@ -110,18 +128,34 @@ class Company(models.Model):
         return cls.objects.all()
 
     @classmethod
-    def get_all_companies_info(cls, company_type=None):
-        res = []
+    def get_companies_by_type(cls, company_type=None):
         if company_type:
             query = {'is_startup': True} if company_type.strip('/') == STARTUP else {'is_startup': False}
-            companies = cls.get_companies(**query)
-        else:
-            companies = cls.get_all_companies()
+            return cls.get_companies(**query)
+        return cls.get_all_companies()
 
-        for company in companies:
-            res.append(company.get_info())
+    @classmethod
+    def get_companies_summary(cls, *args, **kwargs):
+        """Returns companies with only SUMMARY_FIELDS loaded."""
+        return cls.objects.filter(**kwargs).only(*cls.SUMMARY_FIELDS)
+
+    @classmethod
+    def get_all_companies_info(cls, company_type=None, cursor=None, limit=None):
+        """Returns a page of companies summaries, see forum.pagination.KeysetPaginator."""
+        companies = cls.get_companies_by_type(company_type).values(*cls.SUMMARY_FIELDS)
+        page = cls.paginator.paginate_queryset(companies, cursor, limit)
+        page['results'] = [cls.make_summary(values) for values in page['results']]
+        return page
 
-        return res
+    @classmethod
+    def iter_all_companies_info(cls, company_type=None, chunk_size=2000):
+        """
+        Yields summaries of all companies, reading them in chunks of chunk_size rows through a server-side
+        cursor, so memory use doesn't depend on the number of companies.
+        """
+        companies = cls.get_companies_by_type(company_type).order_by('company_id').values(*cls.SUMMARY_FIELDS)
+        for values in companies.iterator(chunk_size=chunk_size):
+            yield cls.make_summary(values)
 
     def get_company_type(self):
         if self.is_startup == True:
@@ -137,17 +171,34 @@ class Company(models.Model):
             pass
         return v
 
-    def get_info(self):
-        fields = ('brand', 'common_info', 'contact_phone', 'contact_email')
-        startup_fields = ('product_info', 'startup_idea')
+    @classmethod
+    def make_info(cls, values):
+        """Builds company info from a dict with is_startup and the info fields (e.g. a row of .values())."""
         data = {}
-        company_type = self.get_company_type()
+        company_type = STARTUP if values['is_startup'] else INVESTMENT
         data['company_type'] = company_type
         if company_type == STARTUP:
-            for k in startup_fields:
-                data[k] = self.get_attribute(k)
-        for k in fields:
-            data[k] = self.get_attribute(k)
+            for k in cls.STARTUP_INFO_FIELDS:
+                data[k] = values[k]
+        for k in cls.INFO_FIELDS:
+            data[k] = values[k]
+        return data
+
+    @staticmethod
+    def make_summary(values):
+        """Builds the company summary shown in lists from a dict with is_startup and the summary fields."""
+        return {'company_id': values['company_id'],
+                'brand': values['brand'],
+                'company_type': STARTUP if values['is_startup'] else INVESTMENT,
+                'contact_phone': values['contact_phone'],
+                'contact_email': values['contact_email']}
+
+    def get_info(self, counters=True):
+        """Company info with its follower, newsletter subscriber and article counters (one Redis round trip)."""
+        fields = ('is_startup', *self.INFO_FIELDS, *self.STARTUP_INFO_FIELDS)
+        data = self.make_info({k: self.get_attribute(k) for k in fields})
+        if counters:
+            data['counters'] = CompanyCounters.get(self.company_id)
         return data
 
 
@@ -171,12 +222,24 @@ class CompanyAndUserRelation(models.Model):
 
     @classmethod
     def get_relation(cls, *args, **kwargs):
-        return cls.objects.get(**kwargs)
+        return IdentityMap.get(cls, **kwargs)
 
     @classmethod
     def get_relations(cls, *args, **kwargs):
         return cls.objects.filter(**kwargs)
 
+    @classmethod
+    def get_relation_with_user_and_company(cls, user_id, company_id):
+        """
+        Loads the relation together with its user and company in a single joined query.
+        Only the columns required for request authentication are selected.
+        """
+        user_fields = [f'user_id__{field}' for field in USER_AUTH_FIELDS]
+        company_fields = [f'company_id__{field}' for field in COMPANY_AUTH_FIELDS]
+        return (cls.objects.select_related('user_id', 'company_id')
+                .only('relation_id', 'position', 'user_id', 'company_id', *user_fields, *company_fields)
+                .get(user_id=user_id, company_id=company_id))
+
 
 
 class UserLoginActivity(models.Model):
@@ -188,7 +251,7 @@ class UserLoginActivity(models.Model):
                     (FAILED, 'Failed'))
 
     login_IP = models.GenericIPAddressField(null=True, blank=True)
-    login_datetime = models.DateTimeField(auto_now=True)
+    login_datetime = models.DateTimeField(default=timezone.now)
     login_email = models.CharField(max_length=40, null=True, blank=True)
     status = models.CharField(max_length=1, default=SUCCESS, choices=LOGIN_STATUS, null=True, blank=True)
     user_agent_info = models.CharField(max_length=255)
@@ -196,3 +259,26 @@ class UserLoginActivity(models.Model):
     class Meta:
         verbose_name = 'user_login_activity'
         verbose_name_plural = 'user_login_activities'
+        # the table is partitioned by month of login_datetime (see migration 0006 and LoginActivityPartitions)
+        indexes = [
+            models.Index(fields=['login_datetime'], name='login_datetime_idx'),
+            models.Index(fields=['login_email', 'login_datetime'], condition=models.Q(status='F'),
+                         name='login_failed_email_idx'),
+            models.Index(fields=['login_IP', 'login_datetime'], condition=models.Q(status='F'),
+                         name='login_failed_ip_idx'),
+        ]
+
+    @classmethod
+    def get_recent_failures_count(cls, email=None, ip=None, window=timedelta(minutes=15)):
+        """
+        Returns the number of failed logins within the window for the email, the IP or both.
+        Served by the partial indexes on failed logins, and only the partitions of the window are scanned.
+        """
+        if email is None and ip is None:
+            raise ValueError("Either email or ip must be given")
+        failures = cls.objects.filter(status=cls.FAILED, login_datetime__gte=timezone.now() - window)
+        if email is not None:
+            failures = failures.filter(login_email=email)
+        if ip is not None:
+            failures = failures.filter(login_IP=ip)
+        return failures.count()
@@ -0,0 +1,105 @@
+import logging
+from datetime import date
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import UserLoginActivity
+
+LOGIN_ACTIVITY = getattr(settings, 'LOGIN_ACTIVITY', {})
+
+logger = logging.getLogger('login_activity')
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+class LoginActivityPartitions:
+    """
+    Monthly range partitions of the UserLoginActivity table (PostgreSQL, see migration 0006).
+    Partitions are created PARTITIONS_AHEAD months in advance; rows outside of them land in the default
+    partition. A partition is created as a separate table, filled with the rows of its month moved out of the default
+    partition (e.g. after the scheduler was down past a month boundary) and then attached. Retention drops whole
+    partitions older than RETENTION_MONTHS instead of deleting rows, and deletes the expired rows of the default
+    partition.
+    """
+    table = UserLoginActivity._meta.db_table
+    default_partition = f'{table}_default'
+    months_ahead = LOGIN_ACTIVITY.get('PARTITIONS_AHEAD', 2)
+    retention_months = LOGIN_ACTIVITY.get('RETENTION_MONTHS', 12)
+
+    @classmethod
+    def get_partition_name(cls, month: date):
+        return f'{cls.table}_y{month.year}m{month.month:02d}'
+
+    @classmethod
+    def get_partitions(cls):
+        """Returns {first day of month: partition name} of the existing monthly partitions."""
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT child.relname FROM pg_inherits "
+                           "JOIN pg_class parent ON pg_inherits.inhparent = parent.oid "
+                           "JOIN pg_class child ON pg_inherits.inhrelid = child.oid "
+                           "WHERE parent.relname = %s", [cls.table])
+            names = [row[0] for row in cursor.fetchall()]
+        partitions = {}
+        prefix = f'{cls.table}_y'
+        for name in names:
+            if name.startswith(prefix):
+                year, month = name[len(prefix):].split('m')
+                partitions[date(int(year), int(month), 1)] = name
+        return partitions
+
+    @classmethod
+    def create(cls, months_ahead=None):
+        """Creates the partitions of the current month and months_ahead following ones. Returns created names."""
+
+        months_ahead = cls.months_ahead if months_ahead is None else months_ahead
+        current = timezone.now().date().replace(day=1)
+        existing = cls.get_partitions()
+        created = []
+        with connection.cursor() as cursor:
+            for offset in range(months_ahead + 1):
+                month = add_months(current, offset)
+                if month in existing:
+                    continue
+                name = cls.get_partition_name(month)
+                start, end = month.isoformat(), add_months(month, 1).isoformat()
+                with transaction.atomic():
+                    # no rows of the month may reach the default partition until the new one is attached
+                    cursor.execute(f'LOCK TABLE "{cls.default_partition}" IN EXCLUSIVE MODE')
+                    cursor.execute(f'CREATE TABLE "{name}" (LIKE "{cls.table}" INCLUDING DEFAULTS)')
+                    cursor.execute(f'WITH moved AS (DELETE FROM "{cls.default_partition}" '
+                                   f'WHERE login_datetime >= %s AND login_datetime < %s RETURNING *) '
+                                   f'INSERT INTO "{name}" SELECT * FROM moved', [start, end])
+                    cursor.execute(f'ALTER TABLE "{cls.table}" ATTACH PARTITION "{name}" '
+                                   f"FOR VALUES FROM ('{start}') TO ('{end}')")
+                created.append(name)
+        if created:
+            logger.info(f"Created login activity partitions: {created}")
+        return created
+
+    @classmethod
+    def drop_expired(cls, retention_months=None):
+        """Drops partitions that hold only rows older than retention_months. Returns dropped names."""
+
+        retention_months = cls.retention_months if retention_months is None else retention_months
+        oldest_kept = add_months(timezone.now().date().replace(day=1), -retention_months)
+        dropped = []
+        with connection.cursor() as cursor:
+            for month, name in sorted(cls.get_partitions().items()):
+                if month >= oldest_kept:
+                    break
+                cursor.execute(f'DROP TABLE IF EXISTS "{name}"')
+                dropped.append(name)
+            cursor.execute(f'DELETE FROM "{cls.default_partition}" WHERE login_datetime < %s',
+                           [oldest_kept.isoformat()])
+            deleted = cursor.rowcount
+        if dropped:
+            logger.info(f"Dropped login activity partitions: {dropped}")
+        if deleted:
+            logger.info(f"Deleted {deleted} expired rows of the default login activity partition")
+        return dropped
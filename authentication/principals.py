@@ -0,0 +1,123 @@
+from collections.abc import Mapping
+
+from django.conf import settings
+
+from .cache import PrincipalCache, RelationVersions
+from .models import COMPANY_AUTH_FIELDS, CustomUser
+
+COMPANY_CLAIMS_CLAIM = settings.SIMPLE_JWT.get('COMPANY_CLAIMS_CLAIM', 'company')
+
+
+class CompanySnapshot(Mapping):
+    """
+    Compact read-only view of the company the request is bound to (request.user.company).
+    It keeps only the columns needed for authorization, supports item access and .get() like the dict it
+    replaces and is picklable, so it can be stored in the principal cache.
+    """
+    __slots__ = ('_data',)
+    fields = COMPANY_AUTH_FIELDS
+
+    def __init__(self, **data):
+        object.__setattr__(self, '_data', {field: data.get(field) for field in self.fields})
+
+    @classmethod
+    def from_company(cls, company):
+        return cls(**{field: getattr(company, field) for field in cls.fields})
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    def __getstate__(self):
+        return self._data
+
+    def __setstate__(self, state):
+        object.__setattr__(self, '_data', state)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self._data!r})"
+
+
+class TokenPrincipal:
+    """
+    Lightweight request.user built straight from the signed company claims of the token, so company
+    permissions (IsFounder, IsInvestor, IsStartup, ...) need no database access.
+    Any other attribute (email, first_name, ...) is read from the full CustomUser, which is loaded
+    on first access.
+    """
+    __slots__ = ('user_id', 'company', 'position', 'relation_id', 'is_authenticated', '_user')
+
+    def __init__(self, user_id, company, position, relation_id):
+        self.user_id = user_id
+        self.company = company
+        self.position = position
+        self.relation_id = relation_id
+        self.is_authenticated = True
+        self._user = None
+
+    @classmethod
+    def make_claims(cls, relation):
+        """Returns compact company claims for the token bound to the given relation."""
+
+        return {'rid': relation.relation_id,
+                'pos': relation.position,
+                'st': relation.company_id.is_startup,
+                'v': RelationVersions.current(relation.relation_id)}
+
+    @classmethod
+    def from_token(cls, validated_token, user_id, company_id):
+        """Returns the principal if the token has company claims of the current relation version, else None."""
+
+        claims = validated_token.get(COMPANY_CLAIMS_CLAIM)
+        if not isinstance(claims, dict):
+            return None
+        try:
+            relation_id, position, is_startup, version = claims['rid'], claims['pos'], claims['st'], claims['v']
+        except KeyError:
+            return None
+        if version is None or RelationVersions.get(relation_id) != version:
+            return None
+        company = CompanySnapshot(company_id=company_id, is_startup=is_startup)
+        return cls(user_id, company, position, relation_id)
+
+    @property
+    def pk(self):
+        return self.user_id
+
+    def get_user(self) -> CustomUser:
+        """Returns the full CustomUser behind the principal."""
+
+        if self._user is None:
+            user = PrincipalCache.get(self.user_id)
+            if user is None:
+                user = CustomUser.get_user(user_id=self.user_id)
+                PrincipalCache.set(user, self.user_id)
+            self._user = user
+        return self._user
+
+    def get_company_type(self):
+        return CustomUser.get_company_type(self)
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.get_user(), name)
+
+    def __eq__(self, other):
+        if isinstance(other, (TokenPrincipal, CustomUser)):
+            return self.pk == other.pk
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.user_id)
+
+    def __str__(self):
+        return str(self.get_user())
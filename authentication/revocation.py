@@ -0,0 +1,129 @@
+import hashlib
+import logging
+import math
+
+from django.conf import settings
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import (BlacklistedToken,
+                                                             OutstandingToken)
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.utils import aware_utcnow
+
+REVOCATION_FILTER = getattr(settings, 'REVOCATION_FILTER', {})
+
+logger = logging.getLogger('token_revocation')
+
+
+class RevocationFilter:
+    """
+    Bloom filter of revoked (blacklisted) refresh token JTIs kept in Redis.
+
+    A negative answer means the token is certainly not blacklisted, so the token_blacklist tables are queried only
+    for filter positives. The filter is fed by BlacklistedToken post_save signal and synced incrementally from the
+    table; since bits can't be removed, it is rebuilt after expired tokens are purged.
+    The filter is marked as built by a bit past the hashed ones, kept in the same key, so a filter evicted by
+    Redis (or recreated by add() afterwards) reads as unbuilt. Until the filter is built, or whenever Redis is
+    unavailable, every token falls through to the SQL lookup.
+    """
+    key = 'token_revocation:filter'
+    checkpoint_key = 'token_revocation:checkpoint'
+    capacity = REVOCATION_FILTER.get('CAPACITY', 10_000_000)
+    error_rate = REVOCATION_FILTER.get('ERROR_RATE', 0.001)
+    batch_size = REVOCATION_FILTER.get('BATCH_SIZE', 10_000)
+    size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+    hashes = max(1, round(size / capacity * math.log(2)))
+
+    @classmethod
+    def get_connection(cls):
+        return get_redis_connection('default')
+
+    @classmethod
+    def get_offsets(cls, jti):
+        """Returns bit offsets of the jti (double hashing over a single blake2b digest)."""
+
+        digest = hashlib.blake2b(jti.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:], 'big') | 1
+        return [(h1 + i * h2) % cls.size for i in range(cls.hashes)]
+
+    @classmethod
+    def might_contain(cls, jti) -> bool:
+        """Returns False only if the jti is certainly not revoked."""
+
+        try:
+            pipe = cls.get_connection().pipeline(transaction=False)
+            pipe.getbit(cls.key, cls.size)
+            for offset in cls.get_offsets(jti):
+                pipe.getbit(cls.key, offset)
+            ready, *bits = pipe.execute()
+        except RedisError as e:
+            logger.error(f"Revocation filter is unavailable: {e}")
+            return True
+        return not ready or all(bits)
+
+    @classmethod
+    def add(cls, jtis, key=None):
+        pipe = cls.get_connection().pipeline(transaction=False)
+        for jti in jtis:
+            for offset in cls.get_offsets(jti):
+                pipe.setbit(key or cls.key, offset, 1)
+        pipe.execute()
+
+    @classmethod
+    def _load(cls, after_id=0, key=None):
+        """Adds blacklisted JTIs with ids greater than after_id to the filter. Returns the last added id."""
+
+        last_id = after_id
+        while True:
+            batch = list(BlacklistedToken.objects.filter(id__gt=last_id).order_by('id')
+                         .values_list('id', 'token__jti')[:cls.batch_size])
+            if not batch:
+                return last_id
+            cls.add((jti for _, jti in batch), key=key)
+            last_id = batch[-1][0]
+
+    @classmethod
+    def sync(cls):
+        """Incrementally adds tokens blacklisted since the last sync, building the filter if it doesn't exist."""
+
+        connection = cls.get_connection()
+        if not connection.getbit(cls.key, cls.size):
+            return cls.rebuild()
+        last_id = cls._load(int(connection.get(cls.checkpoint_key) or 0))
+        connection.set(cls.checkpoint_key, last_id)
+        return last_id
+
+    @classmethod
+    def rebuild(cls):
+        """Builds the filter from scratch into a temporary key and atomically swaps it in."""
+
+        connection = cls.get_connection()
+        tmp_key = f'{cls.key}:rebuild'
+        connection.delete(tmp_key)
+        # the ready bit, also allocating the whole filter at once
+        connection.setbit(tmp_key, cls.size, 1)
+        last_id = cls._load(key=tmp_key)
+        pipe = connection.pipeline()
+        pipe.rename(tmp_key, cls.key)
+        pipe.set(cls.checkpoint_key, last_id)
+        pipe.execute()
+        # tokens blacklisted while the filter was being built went to the replaced key
+        return cls.sync()
+
+    @classmethod
+    def purge_expired_tokens(cls):
+        """Deletes expired outstanding tokens (and their blacklist entries), then rebuilds the filter."""
+
+        deleted, _ = OutstandingToken.objects.filter(expires_at__lte=aware_utcnow()).delete()
+        cls.rebuild()
+        return deleted
+
+
+class FilteredRefreshToken(RefreshToken):
+    """Refresh token that consults the revocation filter before querying the token blacklist."""
+
+    def check_blacklist(self) -> None:
+        if RevocationFilter.might_contain(self.payload[api_settings.JTI_CLAIM]):
+            super().check_blacklist()
@@ -3,13 +3,16 @@ from datetime import datetime
 
 from django.contrib.auth.hashers import check_password
 from django.contrib.sites.shortcuts import get_current_site
+from django.db import transaction
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 from rest_framework.validators import UniqueValidator
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
 from rest_framework_simplejwt.tokens import RefreshToken
 
 from authentication.models import CustomUser
-from authentication.utils import Utils
+from authentication.revocation import FilteredRefreshToken
+from notifications.tasks import send_verification_email
 from validation.serializers import CustomValidationSerializer
 
 
@@ -81,7 +84,8 @@ class UserUpdateSerializer(serializers.ModelSerializer, CustomValidationSerializ
             tokens = RefreshToken.for_user(instance)
             access_token = str(tokens.access_token)
             instance = super().update(instance, validated_data)
-            Utils.send_verification_email(get_current_site(self.context['request']).domain, instance, access_token)
+            domain = get_current_site(self.context['request']).domain
+            transaction.on_commit(lambda: send_verification_email.delay(instance.user_id, domain, access_token))
             logger.info(
                 f"User {instance.email} {instance.first_name} {instance.surname} updated his\
                      account information:{validated_data} (Email in process of verification)")
@@ -112,3 +116,8 @@ class PasswordRecoverySerializer(serializers.ModelSerializer, CustomValidationSe
         except ValidationError as e:
             raise ValidationError(detail=e.detail)
         return attrs
+
+
+class FilteredTokenRefreshSerializer(TokenRefreshSerializer):
+    """Token refresh serializer that checks revocation through the revocation filter."""
+    token_class = FilteredRefreshToken
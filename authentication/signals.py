@@ -2,9 +2,18 @@ import logging
 
 # for logging - define "error" named logging handler and logger in settings.py
 from django.contrib.auth import user_logged_in, user_login_failed
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
+from redis.exceptions import RedisError
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
 
-from .models import UserLoginActivity
+from forum.identity_map import IdentityMap
+
+from .activity import LoginActivityBuffer
+from .cache import PrincipalCache, RelationVersions
+from .models import (Company, CompanyAndUserRelation, CustomUser,
+                     UserLoginActivity)
+from .revocation import RevocationFilter
 
 error_log = logging.getLogger('error')
 
@@ -21,11 +30,10 @@ def get_client_ip(request):
 def log_user_logged_in_success(sender, user, request, **kwargs):
     try:
         user_agent_info = request.META.get('HTTP_USER_AGENT', '<unknown>')[:255]
-        user_login_activity_log = UserLoginActivity(login_IP=get_client_ip(request),
-                                                    login_email=user.email,
-                                                    user_agent_info=user_agent_info,
-                                                    status=UserLoginActivity.SUCCESS)
-        user_login_activity_log.save()
+        LoginActivityBuffer.record(login_IP=get_client_ip(request),
+                                   login_email=user.email,
+                                   user_agent_info=user_agent_info,
+                                   status=UserLoginActivity.SUCCESS)
     except Exception as e:
         # log the error
         error_log.error("log_user_logged_in request: %s, error: %s" % (request, e))
@@ -39,12 +47,56 @@ def log_user_logged_in_failed(sender,  credentials, request, **kwargs):
             login_email = credentials['email']
         else:
             login_email = '<unknown>'
-        user_login_activity_log = UserLoginActivity(login_IP=get_client_ip(request),
-                                                    login_email=login_email,
-                                                    user_agent_info=user_agent_info,
-                                                    status=UserLoginActivity.FAILED)
-        user_login_activity_log.save()
+        LoginActivityBuffer.record(login_IP=get_client_ip(request),
+                                   login_email=login_email,
+                                   user_agent_info=user_agent_info,
+                                   status=UserLoginActivity.FAILED)
     except Exception as e:
         # log the error
         error_log.exception('Error')
         error_log.error("log_user_logged_in_failed request: %s, error: %s" % (request, e))
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def invalidate_user_principals(sender, instance, **kwargs):
+    company_ids = CompanyAndUserRelation.get_relations(user_id=instance.user_id).values_list('company_id', flat=True)
+    pairs = [(instance.user_id, None)] + [(instance.user_id, company_id) for company_id in company_ids]
+    PrincipalCache.invalidate(pairs)
+
+
+@receiver(post_save, sender=Company)
+@receiver(post_delete, sender=Company)
+def invalidate_company_principals(sender, instance, **kwargs):
+    relations = CompanyAndUserRelation.get_relations(company_id=instance.company_id).values_list('relation_id',
+                                                                                                  'user_id')
+    PrincipalCache.invalidate((user_id, instance.company_id) for _, user_id in relations)
+    RelationVersions.bump(relation_id for relation_id, _ in relations)
+
+
+@receiver(post_save, sender=CompanyAndUserRelation)
+@receiver(post_delete, sender=CompanyAndUserRelation)
+def invalidate_relation_principal(sender, instance, **kwargs):
+    PrincipalCache.invalidate([(instance.user_id_id, instance.company_id_id)])
+    RelationVersions.bump([instance.relation_id])
+
+
+@receiver(post_save, sender=BlacklistedToken)
+def add_token_to_revocation_filter(sender, instance, created, **kwargs):
+    if not created:
+        return
+    try:
+        RevocationFilter.add([instance.token.jti])
+    except RedisError as e:
+        # the token will be picked up by the next incremental sync
+        error_log.error("add_token_to_revocation_filter token: %s, error: %s" % (instance.token_id, e))
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+@receiver(post_save, sender=Company)
+@receiver(post_delete, sender=Company)
+@receiver(post_save, sender=CompanyAndUserRelation)
+@receiver(post_delete, sender=CompanyAndUserRelation)
+def discard_identity_map_instances(sender, instance, **kwargs):
+    IdentityMap.discard(sender)
@@ -0,0 +1,26 @@
+from celery import shared_task
+
+from .activity import LoginActivityBuffer
+from .partitions import LoginActivityPartitions
+from .revocation import RevocationFilter
+
+
+@shared_task
+def sync_revocation_filter():
+    RevocationFilter.sync()
+
+
+@shared_task
+def purge_expired_tokens():
+    RevocationFilter.purge_expired_tokens()
+
+
+@shared_task
+def flush_login_activity():
+    LoginActivityBuffer.flush()
+
+
+@shared_task
+def maintain_login_activity_partitions():
+    LoginActivityPartitions.create()
+    LoginActivityPartitions.drop_expired()
@@ -1,20 +1,63 @@
-from unittest import mock
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+from unittest import mock, skipUnless
 from unittest.mock import patch
 
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.core import mail
+from django.core.management import call_command
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+from django.utils import timezone
+import fakeredis
 from faker import Faker
+from redis.exceptions import RedisError
 from rest_framework import status
+from rest_framework.exceptions import ValidationError
 from rest_framework.reverse import reverse
-from rest_framework.test import APIClient, APITestCase
+from rest_framework.test import APIClient, APIRequestFactory, APITestCase
+
+from rest_framework_simplejwt.backends import TokenBackend
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
 
 from forum import settings
 from forum.managers import TokenManager
+from notifications.manager import EmailManager, EmailNotificationManager
+from notifications.tasks import send_verification_email
+from validation.serializers import CustomValidationSerializer, PasswordStrength, PasswordStrengthUnavailable
+
+from .activity import LoginActivityBuffer
+from .authentications import UserAuthentication
+from .cache import PrincipalCache, VerifiedTokenCache
+from .hashers import HashingServiceUnavailable, PasswordHashingService
+from .models import Company, CompanyAndUserRelation, CustomUser, UserLoginActivity
+from .partitions import LoginActivityPartitions, add_months
+from .principals import CompanySnapshot, TokenPrincipal
+from .revocation import FilteredRefreshToken, RevocationFilter
+from .throttling import AUTH_THROTTLE, SlidingWindowThrottle
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
 
-from .models import Company, CompanyAndUserRelation, CustomUser
+def use_fake_throttle_redis(test_case):
+    """Gives the test its own throttle counters, so login attempts of other tests and runs don't add up."""
+
+    patcher = patch.object(SlidingWindowThrottle, 'get_connection', return_value=fakeredis.FakeRedis())
+    patcher.start()
+    test_case.addCleanup(patcher.stop)
 
 
 class AuthenticationUserApiTest(APITestCase):
 
     def setUp(self):
+        use_fake_throttle_redis(self)
         self.client = APIClient()
         self.user = CustomUser.objects.create_user(email='test2@gmail.com', password='password123')
         self.user2 = CustomUser.objects.create_user(email='test3@gmail.com', password='password123')
@@ -26,7 +69,7 @@ class AuthenticationUserApiTest(APITestCase):
         jwt_token = f'Bearer {refresh_token.access_token}'
         self.client.credentials(HTTP_AUTHORIZATION=jwt_token)
 
-    @patch('authentication.utils.Utils.send_verification_email')
+    @patch('notifications.tasks.send_verification_email.delay')
     def test_register_user(self, mock_send_verification_email):
         email = self.fake.email()
         password = self.fake.password()
@@ -40,7 +83,8 @@ class AuthenticationUserApiTest(APITestCase):
                         'first_name': first_name,
                         'surname': surname,
                         'phone_number': phone}
-        returned_response = self.client.post(reverse('auth_register'), data_to_send, format='json')
+        with self.captureOnCommitCallbacks(execute=True):
+            returned_response = self.client.post(reverse('auth_register'), data_to_send, format='json')
 
         response_to_expect = {
             "email": email,
@@ -190,7 +234,7 @@ class AuthenticationUserApiTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
         self.assertEqual(response.data['error'], 'You have no access to this company.')
 
-    @patch('authentication.utils.Utils.send_verification_email')
+    @patch('notifications.tasks.send_verification_email.delay')
     def test_user_update_success(self, mock_send_verification_email: mock.MagicMock):
         url = reverse('user_details', args=(self.user.user_id,))
         email = self.fake.email()
@@ -206,7 +250,8 @@ class AuthenticationUserApiTest(APITestCase):
         refresh_token = TokenManager.generate_refresh_token_for_user(self.user)
         self._authenticate_user(refresh_token=refresh_token)
 
-        response = self.client.patch(url, data, format='json')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(url, data, format='json')
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.user.refresh_from_db()
@@ -231,3 +276,653 @@ class AuthenticationUserApiTest(APITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertEqual(response.data['email'], ['Enter a valid email address.'])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class PrincipalCacheTest(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        PrincipalCache.local.clear()
+        self.user = CustomUser.objects.create_user(email='cached@gmail.com', password='password123')
+        self.company = Company.objects.create(brand='Cached', is_startup=True)
+        self.relation = CompanyAndUserRelation.objects.create(user_id=self.user, company_id=self.company,
+                                                              position=CompanyAndUserRelation.FOUNDER)
+        access_token = TokenManager.generate_access_token_for_user(self.user)
+        company_token = TokenManager.generate_company_related_token(self.company.company_id, str(access_token))
+        self.token = UserAuthentication().get_validated_token(company_token)
+
+    def test_warm_cache_makes_no_queries(self):
+        UserAuthentication().get_user(self.token)
+        with self.assertNumQueries(0):
+            user = UserAuthentication().get_user(self.token)
+        self.assertEqual(user.relation_id, self.relation.relation_id)
+        self.assertEqual(user.get_company_type(), 'startup')
+
+    def test_shared_cache_serves_other_processes(self):
+        UserAuthentication().get_user(self.token)
+        PrincipalCache.local.clear()
+        with self.assertNumQueries(0):
+            UserAuthentication().get_user(self.token)
+
+    def test_relation_change_invalidates_principal(self):
+        UserAuthentication().get_user(self.token)
+        self.relation.position = CompanyAndUserRelation.REPRESENTATIVE
+        self.relation.save()
+        user = UserAuthentication().get_user(self.token)
+        self.assertEqual(user.position, CompanyAndUserRelation.REPRESENTATIVE)
+
+    def test_company_change_invalidates_principal(self):
+        UserAuthentication().get_user(self.token)
+        self.company.is_startup = False
+        self.company.save()
+        user = UserAuthentication().get_user(self.token)
+        self.assertEqual(user.get_company_type(), 'investment')
+
+    def test_cached_principal_is_not_shared_between_requests(self):
+        first = UserAuthentication().get_user(self.token)
+        first.first_name = 'changed'
+        second = UserAuthentication().get_user(self.token)
+        self.assertNotEqual(second.first_name, 'changed')
+
+    def test_company_scoped_authentication_makes_single_query(self):
+        access_token = TokenManager.generate_access_token_for_user(self.user)
+        company_token = TokenManager.generate_company_related_token(self.company.company_id, str(access_token))
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {company_token}')
+        with self.assertNumQueries(1):
+            user, _ = UserAuthentication().authenticate(request)
+        self.assertIsInstance(user.company, CompanySnapshot)
+        self.assertEqual(user.company['company_id'], self.company.company_id)
+        self.assertEqual(user.email, self.user.email)
+
+    def test_company_snapshot_is_read_only(self):
+        user = UserAuthentication().get_user(self.token)
+        with self.assertRaises(TypeError):
+            user.company['is_startup'] = False
+        self.assertNotIn('_state', user.company)
+
+    def _get_token_with_claims(self):
+        access_token = TokenManager.generate_access_token_for_user(self.user)
+        relation = CompanyAndUserRelation.get_relation_with_user_and_company(self.user.user_id,
+                                                                             self.company.company_id)
+        claims = TokenPrincipal.make_claims(relation)
+        company_token = TokenManager.generate_company_related_token(self.company.company_id, str(access_token),
+                                                                    claims=claims)
+        return UserAuthentication().get_validated_token(company_token)
+
+    def test_company_claims_resolve_without_queries(self):
+        token = self._get_token_with_claims()
+        with self.assertNumQueries(0):
+            user = UserAuthentication().get_user(token)
+        self.assertIsInstance(user, TokenPrincipal)
+        self.assertEqual(user.relation_id, self.relation.relation_id)
+        self.assertEqual(user.position, CompanyAndUserRelation.FOUNDER)
+        self.assertEqual(user.get_company_type(), 'startup')
+        self.assertEqual(user.email, self.user.email)
+
+    def test_company_claims_are_ignored_after_relation_change(self):
+        token = self._get_token_with_claims()
+        self.relation.position = CompanyAndUserRelation.REPRESENTATIVE
+        self.relation.save()
+        user = UserAuthentication().get_user(token)
+        self.assertNotIsInstance(user, TokenPrincipal)
+        self.assertEqual(user.position, CompanyAndUserRelation.REPRESENTATIVE)
+
+
+class VerifiedTokenCacheTest(APITestCase):
+
+    def setUp(self):
+        VerifiedTokenCache.local.clear()
+        self.user = CustomUser.objects.create_user(email='verified@gmail.com', password='password123')
+        self.raw_token = str(TokenManager.generate_access_token_for_user(self.user)).encode()
+
+    def test_hit_skips_verification(self):
+        UserAuthentication().get_validated_token(self.raw_token)
+        with patch('rest_framework_simplejwt.backends.TokenBackend.decode') as decode:
+            token = UserAuthentication().get_validated_token(self.raw_token)
+        decode.assert_not_called()
+        self.assertEqual(token['user_id'], self.user.user_id)
+        self.assertEqual(token.token, self.raw_token)
+
+    def test_token_manager_shares_the_cache(self):
+        UserAuthentication().get_validated_token(self.raw_token)
+        with patch('rest_framework_simplejwt.backends.TokenBackend.decode') as decode:
+            payload = TokenManager.get_access_payload(self.raw_token.decode())
+        decode.assert_not_called()
+        self.assertEqual(payload['user_id'], self.user.user_id)
+
+    def test_cached_payload_is_not_shared(self):
+        token = UserAuthentication().get_validated_token(self.raw_token)
+        token['company_id'] = 1
+        TokenManager.generate_company_related_token(2, self.raw_token.decode())
+        self.assertNotIn('company_id', UserAuthentication().get_validated_token(self.raw_token).payload)
+
+    def test_expired_token_is_rejected(self):
+        token = UserAuthentication().get_validated_token(self.raw_token)
+        expired = timezone.now() + timedelta(seconds=token['exp'] - time.time() + 1)
+        with patch('authentication.cache.aware_utcnow', return_value=expired), \
+                patch('rest_framework_simplejwt.tokens.aware_utcnow', return_value=expired):
+            with self.assertRaises(InvalidToken):
+                UserAuthentication().get_validated_token(self.raw_token)
+        self.assertEqual(len(VerifiedTokenCache.local), 0)
+
+    def test_invalid_token_is_not_cached(self):
+        with self.assertRaises(InvalidToken):
+            UserAuthentication().get_validated_token(self.raw_token + b'x')
+        self.assertEqual(len(VerifiedTokenCache.local), 0)
+
+    def test_repeated_validation_verifies_once(self):
+        authentication = UserAuthentication()
+        with patch.object(TokenBackend, 'decode', autospec=True, side_effect=TokenBackend.decode) as decode:
+            for _ in range(100):
+                authentication.get_validated_token(self.raw_token)
+        self.assertEqual(decode.call_count, 1)
+
+
+class RevocationFilterTest(APITestCase):
+
+    def setUp(self):
+        connection_patcher = patch.object(RevocationFilter, 'get_connection', return_value=fakeredis.FakeRedis())
+        connection_patcher.start()
+        self.addCleanup(connection_patcher.stop)
+        size_patcher = patch.multiple(RevocationFilter, size=1 << 16, hashes=7)
+        size_patcher.start()
+        self.addCleanup(size_patcher.stop)
+        self.user = CustomUser.objects.create_user(email='revoked@gmail.com', password='password123')
+
+    def test_unbuilt_filter_falls_through_to_blacklist(self):
+        refresh_token = TokenManager.generate_refresh_token_for_user(self.user)
+        with self.assertNumQueries(1):
+            FilteredRefreshToken(str(refresh_token))
+
+    def test_not_revoked_token_skips_blacklist_query(self):
+        refresh_token = TokenManager.generate_refresh_token_for_user(self.user)
+        RevocationFilter.rebuild()
+        with self.assertNumQueries(0):
+            FilteredRefreshToken(str(refresh_token))
+
+    def test_blacklisted_token_is_rejected(self):
+        RevocationFilter.rebuild()
+        refresh_token = TokenManager.generate_refresh_token_for_user(self.user)
+        refresh_token.blacklist()
+        self.assertTrue(RevocationFilter.might_contain(refresh_token['jti']))
+        with self.assertRaises(TokenError):
+            FilteredRefreshToken(str(refresh_token))
+
+    def test_rebuild_restores_blacklisted_tokens(self):
+        refresh_token = TokenManager.generate_refresh_token_for_user(self.user)
+        refresh_token.blacklist()
+        RevocationFilter.get_connection().flushall()
+        RevocationFilter.rebuild()
+        self.assertTrue(RevocationFilter.might_contain(refresh_token['jti']))
+
+
+    def test_evicted_filter_falls_through_to_blacklist(self):
+        RevocationFilter.rebuild()
+        refresh_token = TokenManager.generate_refresh_token_for_user(self.user)
+        RevocationFilter.get_connection().delete(RevocationFilter.key)
+        # the blacklisting signal recreates the key with this token only
+        refresh_token.blacklist()
+        other_token = TokenManager.generate_refresh_token_for_user(self.user)
+        self.assertTrue(RevocationFilter.might_contain(other_token['jti']))
+
+        RevocationFilter.sync()
+        self.assertFalse(RevocationFilter.might_contain(other_token['jti']))
+        self.assertTrue(RevocationFilter.might_contain(refresh_token['jti']))
+
+class PasswordHashingServiceTest(APITestCase):
+
+    def setUp(self):
+        use_fake_throttle_redis(self)
+        self.user = CustomUser.objects.create_user(email='hashing@gmail.com', password='password123')
+
+    def test_pool_checks_password(self):
+        self.assertEqual(PasswordHashingService.check_password('password123', self.user.password), (True, False))
+        self.assertEqual(PasswordHashingService.check_password('wrong', self.user.password), (False, False))
+
+    def test_saturated_pool_fails_fast(self):
+        slots = PasswordHashingService._slots
+        acquired = 0
+        while slots.acquire(blocking=False):
+            acquired += 1
+        try:
+            data = {'email': 'hashing@gmail.com', 'password': 'password123'}
+            response = self.client.post(reverse('login'), data, format='json')
+        finally:
+            for _ in range(acquired):
+                slots.release()
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    @patch.object(PasswordHashingService, 'workers', 1)
+    @patch.object(PasswordHashingService, 'timeout', 0.01)
+    @patch.object(PasswordHashingService, '_slots', threading.BoundedSemaphore(1))
+    def test_timed_out_hash_holds_its_slot_until_done(self):
+        slots = PasswordHashingService._slots
+        done = threading.Event()
+        with ThreadPoolExecutor(max_workers=1) as executor, \
+                patch.object(PasswordHashingService, 'get_executor', return_value=executor):
+            try:
+                with self.assertRaises(HashingServiceUnavailable):
+                    PasswordHashingService.run(done.wait)
+                # the hash is still running, so there is no free slot for another one
+                self.assertFalse(slots.acquire(blocking=False))
+            finally:
+                done.set()
+        self.assertTrue(slots.acquire(blocking=False))
+        slots.release()
+
+    @override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher',
+                                         'django.contrib.auth.hashers.UnsaltedMD5PasswordHasher'])
+    @patch.object(PasswordHashingService, 'workers', 0)
+    def test_login_rehashes_outdated_password(self):
+        self.user.password = make_password('password123', hasher='unsalted_md5')
+        self.user.save()
+
+        data = {'email': 'hashing@gmail.com', 'password': 'password123'}
+        response = self.client.post(reverse('login'), data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertEqual(identify_hasher(self.user.password).algorithm, 'md5')
+        self.assertTrue(self.user.check_password('password123'))
+
+
+class PasswordStrengthTest(APITestCase):
+    # adversarial inputs for zxcvbn: long repeats, sequences and keyboard patterns
+    WORST_CASE_PASSWORDS = ('aA1!' * 2500, 'Qwerty1!' * 1000, ''.join(chr(33 + i % 90) for i in range(10000)))
+
+    def setUp(self):
+        PasswordStrength.scores.clear()
+
+    def test_score_is_cached_without_raw_password(self):
+        with patch.object(PasswordStrength, 'evaluate', wraps=PasswordStrength.evaluate) as evaluate:
+            first = PasswordStrength.get_score('Tr0ub4dor&3horse', ['test@gmail.com'])
+            second = PasswordStrength.get_score('Tr0ub4dor&3horse', ['test@gmail.com'])
+        self.assertEqual(first, second)
+        self.assertEqual(evaluate.call_count, 1)
+        self.assertNotIn('Tr0ub4dor&3horse', PasswordStrength.make_key('Tr0ub4dor&3horse', []))
+
+    def test_exceeded_time_budget_is_retryable(self):
+        with patch.object(PasswordStrength, 'time_budget', 0.01), \
+                patch.object(PasswordStrength, 'evaluate', side_effect=lambda *args: time.sleep(0.1) or 4) as evaluate:
+            with self.assertRaises(PasswordStrengthUnavailable) as raised:
+                CustomValidationSerializer.validate_password('Very$trongPassw0rd!')
+            self.assertEqual(raised.exception.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            # the late score is cached for the retry
+            key = PasswordStrength.make_key('Very$trongPassw0rd!', [])
+            deadline = time.monotonic() + 5
+            while PasswordStrength.scores.get(key) is None and time.monotonic() < deadline:
+                time.sleep(0.01)
+            CustomValidationSerializer.validate_password('Very$trongPassw0rd!')
+        self.assertEqual(evaluate.call_count, 1)
+
+    def test_worst_case_inputs_are_bounded(self):
+        for password in self.WORST_CASE_PASSWORDS:
+            started = time.perf_counter()
+            try:
+                PasswordStrength.get_score(password)
+            except PasswordStrengthUnavailable:
+                pass
+            self.assertLess(time.perf_counter() - started, PasswordStrength.time_budget + 0.05)
+
+
+class ContactValidationTest(APITestCase):
+    # inputs that backtrack catastrophically under nested quantifiers
+    HOSTILE_EMAILS = ('a' * 5000 + '!', 'a.' * 2500 + '!', 'a' * 5000 + '@' + 'b' * 5000,
+                      'a@' + 'b.cc' * 60 + '.' + 'c' * 1000 + '1', 'a-' * 120 + '@b' + '.cc' * 40 + '!')
+    HOSTILE_PHONES = ('+' + '1' * 5000, '1' * 5000 + 'a')
+    TIME_PER_INPUT = 0.01
+
+    def assertRejectedInTime(self, validator, value):
+        started = time.perf_counter()
+        with self.assertRaises(ValidationError):
+            validator(value)
+        self.assertLess(time.perf_counter() - started, self.TIME_PER_INPUT)
+
+    def test_valid_contacts(self):
+        for email in ('test@gmail.com', 'first.last-name_1@mail.example.com', 'a@b-c.ua'):
+            self.assertEqual(CustomValidationSerializer.validate_contact_email(email), email)
+        for phone in ('+380974562325', '0974562'):
+            self.assertEqual(CustomValidationSerializer.validate_contact_phone(phone), phone)
+
+    def test_invalid_contacts(self):
+        for email in ('test@gmail.com trailing', '.test@gmail.com', 'test..a@gmail.com', 'test@gmail', 'test@gmail.c',
+                      None):
+            with self.assertRaises(ValidationError):
+                CustomValidationSerializer.validate_contact_email(email)
+        for phone in ('+38097456232512', '097 456 23', '+٣٨٠٩٧٤٥٦٢٣٢٥', None):
+            with self.assertRaises(ValidationError):
+                CustomValidationSerializer.validate_contact_phone(phone)
+
+    def test_hostile_inputs_are_rejected_in_bounded_time(self):
+        for email in self.HOSTILE_EMAILS:
+            self.assertRejectedInTime(CustomValidationSerializer.validate_contact_email, email)
+        for phone in self.HOSTILE_PHONES:
+            self.assertRejectedInTime(CustomValidationSerializer.validate_contact_phone, phone)
+
+    def test_fuzzed_emails_are_checked_in_linear_time(self):
+        fake = Faker()
+        fake.seed_instance(1131)
+        alphabet = 'aZ0.-_@'
+        for length in (16, 64, 254):
+            for _ in range(200):
+                candidate = ''.join(fake.random_element(alphabet) for _ in range(length))
+                started = time.perf_counter()
+                try:
+                    CustomValidationSerializer.validate_contact_email(candidate)
+                except ValidationError:
+                    pass
+                self.assertLess(time.perf_counter() - started, self.TIME_PER_INPUT)
+
+
+class AuthEmailTest(APITestCase):
+
+    def setUp(self):
+        EmailManager.close_connection()
+        self.addCleanup(EmailManager.close_connection)
+        self.user = CustomUser.objects.create_user(email='mailer@gmail.com', password='password123',
+                                                   first_name='Taras', surname='Shevchenko')
+
+    def test_registration_sends_email_after_response(self):
+        password = 'Very$trongPassw0rd!'
+        data = {'email': 'new.user@gmail.com', 'password': password, 'password2': password,
+                'first_name': 'Lesia', 'surname': 'Ukrainka', 'phone_number': '+380974562325'}
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(reverse('auth_register'), data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(mail.outbox), 0)
+        # the task runs in place of a worker
+        with patch('notifications.tasks.send_verification_email.delay',
+                   side_effect=send_verification_email) as delay:
+            for callback in callbacks:
+                callback()
+        delay.assert_called_once()
+        self.assertEqual(delay.call_args.args[0], CustomUser.objects.get(email='new.user@gmail.com').user_id)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['new.user@gmail.com'])
+        self.assertIn('Hello Lesia Ukrainka', mail.outbox[0].body)
+        self.assertIn('/auth/email_verify/', mail.outbox[0].body)
+
+    @patch('notifications.tasks.send_password_update_notification.delay')
+    def test_password_update_task_takes_user_id(self, mock_delay):
+        password = 'new_password123!ABC'
+        refresh_token = TokenManager.generate_refresh_token_for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {refresh_token.access_token}')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('password_update'), {'password': password, 'password2': password},
+                                        format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        mock_delay.assert_called_once_with(self.user.user_id)
+
+    def test_emails_reuse_connection(self):
+        with patch('notifications.manager.get_connection', wraps=mail.get_connection) as get_connection:
+            EmailNotificationManager.send_subscribe_notification(['a@gmail.com', 'b@gmail.com', 'c@gmail.com'])
+            EmailNotificationManager.send_message_notification('d@gmail.com')
+        self.assertEqual(len(mail.outbox), 4)
+        self.assertEqual(get_connection.call_count, 1)
+
+
+class LoginActivityBufferTest(APITestCase):
+
+    def setUp(self):
+        use_fake_throttle_redis(self)
+        connection_patcher = patch.object(LoginActivityBuffer, 'get_connection', return_value=fakeredis.FakeRedis())
+        connection_patcher.start()
+        self.addCleanup(connection_patcher.stop)
+        self.user = CustomUser.objects.create_user(email='activity@gmail.com', password='password123')
+
+    def test_login_events_are_queued_without_queries(self):
+        with self.assertNumQueries(0):
+            for _ in range(100):
+                LoginActivityBuffer.record(login_IP='127.0.0.1', login_email='activity@gmail.com',
+                                           user_agent_info='test', status=UserLoginActivity.FAILED)
+        self.assertEqual(LoginActivityBuffer.get_connection().llen(LoginActivityBuffer.key), 100)
+        self.assertFalse(UserLoginActivity.objects.exists())
+
+    @patch.object(LoginActivityBuffer, 'batch_size', 40)
+    @patch('authentication.tasks.flush_login_activity.delay')
+    def test_flush_writes_events_in_batches(self, mock_flush):
+        for _ in range(100):
+            LoginActivityBuffer.record(login_IP='127.0.0.1', login_email='activity@gmail.com',
+                                       user_agent_info='test', status=UserLoginActivity.FAILED)
+        # a flush is requested each time a full batch is queued
+        self.assertEqual(mock_flush.call_count, 2)
+        # one INSERT per batch instead of one per event
+        with self.assertNumQueries(3):
+            self.assertEqual(LoginActivityBuffer.flush(), 100)
+        self.assertEqual(UserLoginActivity.objects.count(), 100)
+        self.assertEqual(LoginActivityBuffer.get_connection().llen(LoginActivityBuffer.key), 0)
+
+    def test_login_records_success_and_failure(self):
+        self.client.post(reverse('login'), {'email': 'activity@gmail.com', 'password': 'password123'}, format='json')
+        self.client.post(reverse('login'), {'email': 'activity@gmail.com', 'password': 'wrong'}, format='json')
+        LoginActivityBuffer.flush()
+
+        statuses = UserLoginActivity.objects.order_by('login_datetime').values_list('status', flat=True)
+        self.assertEqual(list(statuses), [UserLoginActivity.SUCCESS, UserLoginActivity.FAILED])
+
+    def test_unfinished_batch_is_written_by_next_flush(self):
+        LoginActivityBuffer.record(login_IP='not an ip', login_email='a' * 100, user_agent_info='test')
+        connection = LoginActivityBuffer.get_connection()
+        connection.lmove(LoginActivityBuffer.key, LoginActivityBuffer.processing_key, 'LEFT', 'RIGHT')
+
+        self.assertEqual(LoginActivityBuffer.flush(), 1)
+        activity = UserLoginActivity.objects.get()
+        self.assertIsNone(activity.login_IP)
+        self.assertEqual(len(activity.login_email), 40)
+        self.assertEqual(connection.llen(LoginActivityBuffer.processing_key), 0)
+
+    def test_bad_event_is_moved_to_dead_letters(self):
+        connection = LoginActivityBuffer.get_connection()
+        LoginActivityBuffer.record(login_IP='127.0.0.1', login_email='activity@gmail.com', user_agent_info='test')
+        bad = json.dumps({'login_email': 'activity@gmail.com', 'login_datetime': 'yesterday'})
+        connection.rpush(LoginActivityBuffer.key, bad)
+        LoginActivityBuffer.record(login_IP='127.0.0.1', login_email='activity@gmail.com', user_agent_info='test')
+
+        self.assertEqual(LoginActivityBuffer.flush(), 2)
+        self.assertEqual(UserLoginActivity.objects.count(), 2)
+        self.assertEqual(connection.lrange(LoginActivityBuffer.dead_key, 0, -1), [bad.encode()])
+        self.assertEqual(connection.llen(LoginActivityBuffer.processing_key), 0)
+
+    def test_unavailable_buffer_saves_directly(self):
+        with patch.object(LoginActivityBuffer, 'get_connection', side_effect=RedisError):
+            LoginActivityBuffer.record(login_IP='127.0.0.1', login_email='activity@gmail.com',
+                                       user_agent_info='test')
+        self.assertEqual(UserLoginActivity.objects.count(), 1)
+
+
+class LoginActivityStorageTest(APITestCase):
+
+    def setUp(self):
+        now = timezone.now()
+        UserLoginActivity.objects.bulk_create([
+            UserLoginActivity(login_IP='10.0.0.1', login_email='victim@gmail.com', status=UserLoginActivity.FAILED,
+                              user_agent_info='test', login_datetime=now - timedelta(minutes=minutes))
+            for minutes in (1, 5, 10, 60)
+        ] + [
+            UserLoginActivity(login_IP='10.0.0.2', login_email='victim@gmail.com', status=UserLoginActivity.FAILED,
+                              user_agent_info='test', login_datetime=now),
+            UserLoginActivity(login_IP='10.0.0.1', login_email='victim@gmail.com', status=UserLoginActivity.SUCCESS,
+                              user_agent_info='test', login_datetime=now),
+        ])
+
+    def test_recent_failures_count(self):
+        self.assertEqual(UserLoginActivity.get_recent_failures_count(email='victim@gmail.com'), 4)
+        self.assertEqual(UserLoginActivity.get_recent_failures_count(ip='10.0.0.1'), 3)
+        self.assertEqual(UserLoginActivity.get_recent_failures_count(email='victim@gmail.com', ip='10.0.0.2'), 1)
+        self.assertEqual(UserLoginActivity.get_recent_failures_count(ip='10.0.0.1', window=timedelta(hours=2)), 4)
+        with self.assertRaises(ValueError):
+            UserLoginActivity.get_recent_failures_count()
+
+    @skipUnless(connection.vendor == 'postgresql', 'login activity is partitioned on PostgreSQL only')
+    def test_partitions_are_created_and_dropped(self):
+        created = LoginActivityPartitions.create(months_ahead=LoginActivityPartitions.months_ahead + 1)
+        partitions = LoginActivityPartitions.get_partitions()
+        self.assertTrue(set(created) <= set(partitions.values()))
+        self.assertEqual(len(partitions), len(set(partitions.values())))
+
+        LoginActivityPartitions.drop_expired(retention_months=0)
+        current = timezone.now().date().replace(day=1)
+        self.assertTrue(all(month >= current for month in LoginActivityPartitions.get_partitions()))
+        self.assertEqual(UserLoginActivity.objects.count(), 6)
+
+    @skipUnless(connection.vendor == 'postgresql', 'login activity is partitioned on PostgreSQL only')
+    def test_rows_of_default_partition_are_moved_and_expired(self):
+        months_ahead = LoginActivityPartitions.months_ahead + 3
+        month = add_months(timezone.now().date().replace(day=1), months_ahead)
+        for login_datetime in (timezone.now() - timedelta(days=365 * 5),
+                               datetime(month.year, month.month, 15, tzinfo=dt_timezone.utc)):
+            UserLoginActivity.objects.create(login_IP='10.0.0.3', login_email='late@gmail.com', user_agent_info='test',
+                                             status=UserLoginActivity.SUCCESS, login_datetime=login_datetime)
+
+        def count(table):
+            with connection.cursor() as cursor:
+                cursor.execute(f'SELECT count(*) FROM "{table}"')
+                return cursor.fetchone()[0]
+
+        self.assertEqual(count(LoginActivityPartitions.default_partition), 2)
+        LoginActivityPartitions.create(months_ahead=months_ahead)
+        self.assertEqual(count(LoginActivityPartitions.get_partition_name(month)), 1)
+        self.assertEqual(count(LoginActivityPartitions.default_partition), 1)
+        LoginActivityPartitions.drop_expired()
+        self.assertEqual(count(LoginActivityPartitions.default_partition), 0)
+        self.assertEqual(UserLoginActivity.objects.count(), 7)
+
+
+class LoginThrottleTest(APITestCase):
+
+    def setUp(self):
+        use_fake_throttle_redis(self)
+        self.user = CustomUser.objects.create_user(email='throttled@gmail.com', password='password123')
+        self.limits = AUTH_THROTTLE['login']
+
+    def _login(self, email='throttled@gmail.com', password='wrong', ip='10.0.0.1'):
+        return self.client.post(reverse('login'), {'email': email, 'password': password}, format='json',
+                                REMOTE_ADDR=ip)
+
+    def test_pair_limit_rejects_before_hashing(self):
+        for _ in range(self.limits['PAIR_LIMIT']):
+            self.assertEqual(self._login().status_code, status.HTTP_401_UNAUTHORIZED)
+
+        with patch.object(PasswordHashingService, 'check_password') as check_password, self.assertNumQueries(0):
+            response = self._login(password='password123')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertGreater(int(response['Retry-After']), 0)
+        check_password.assert_not_called()
+
+    def test_email_limit_spans_ips(self):
+        for i in range(self.limits['EMAIL_LIMIT']):
+            self._login(ip=f'10.0.1.{i}')
+        self.assertEqual(self._login(ip='10.0.2.1').status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(self._login(email='other@gmail.com', ip='10.0.2.1').status_code,
+                         status.HTTP_404_NOT_FOUND)
+
+    def test_ip_limit_spans_emails(self):
+        with patch.dict(AUTH_THROTTLE['login'], IP_LIMIT=3):
+            for i in range(3):
+                self._login(email=f'user{i}@gmail.com')
+            self.assertEqual(self._login(email='user9@gmail.com').status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertEqual(self._login(email='user9@gmail.com', ip='10.0.0.2').status_code,
+                             status.HTTP_404_NOT_FOUND)
+
+    def test_forwarded_for_does_not_change_the_ip(self):
+        with patch.dict(AUTH_THROTTLE['login'], IP_LIMIT=3):
+            for i in range(3):
+                self.client.post(reverse('login'), {'email': f'user{i}@gmail.com', 'password': 'wrong'},
+                                 format='json', REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR=f'192.168.0.{i}')
+            response = self.client.post(reverse('login'), {'email': 'user9@gmail.com', 'password': 'wrong'},
+                                        format='json', REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR='192.168.1.1')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_successful_logins_do_not_count(self):
+        for _ in range(self.limits['PAIR_LIMIT'] + 1):
+            self.assertEqual(self._login(password='password123').status_code, status.HTTP_200_OK)
+        for _ in range(self.limits['PAIR_LIMIT']):
+            self.assertEqual(self._login().status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self._login(password='password123').status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_window_slides(self):
+        with patch('authentication.throttling.time.time', return_value=1_000_000):
+            for _ in range(self.limits['PAIR_LIMIT']):
+                self._login()
+            self.assertEqual(self._login().status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        with patch('authentication.throttling.time.time', return_value=1_000_000 + self.limits['WINDOW'] + 1):
+            self.assertEqual(self._login().status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_unavailable_redis_lets_attempts_through(self):
+        with patch.object(SlidingWindowThrottle, 'get_connection', side_effect=RedisError):
+            for _ in range(self.limits['PAIR_LIMIT'] + 1):
+                self.assertEqual(self._login().status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_password_recovery_is_throttled(self):
+        with patch('notifications.tasks.send_password_reset_notification.delay'):
+            for _ in range(AUTH_THROTTLE['password_recovery']['PAIR_LIMIT']):
+                response = self.client.post(reverse('password_recovery'), {'email': 'throttled@gmail.com'},
+                                            format='json')
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+            response = self.client.post(reverse('password_recovery'), {'email': 'throttled@gmail.com'},
+                                        format='json')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+
+class ImportUsersCommandTest(APITestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        CustomUser.objects.create_user(email='taken@gmail.com', password='password123', phone_number='+380000000001')
+        Company.objects.create(brand='Existing', edrpou=12345678)
+
+    def _write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w') as file:
+            file.write(content)
+        return path
+
+    def _import(self, path, **options):
+        call_command('import_users', path, workers=0, stdout=open(os.devnull, 'w'), **options)
+
+    def test_csv_import(self):
+        path = self._write('users.csv', '\n'.join([
+            'email,password,first_name,surname,phone_number,company_brand,company_edrpou,company_is_startup,position',
+            'one@gmail.com,Secret123!,One,First,+380000000002,Existing,12345678,,F',
+            'two@gmail.com,Secret123!,Two,Second,,New Startup,,true,',
+            'three@gmail.com,Secret123!,Three,Third,,New Startup,,true,R',
+            'taken@gmail.com,Secret123!,Dup,Email,,,,,',
+            'four@gmail.com,Secret123!,Dup,Phone,+380000000001,,,,',
+            'one@gmail.com,Secret123!,Dup,In Batch,,,,,',
+            'not an email,Secret123!,Bad,Email,,,,,',
+        ]))
+        with self.assertNumQueries(9):
+            self._import(path)
+
+        self.assertEqual(CustomUser.objects.count(), 4)
+        one = CustomUser.objects.get(email='one@gmail.com')
+        self.assertTrue(one.check_password('Secret123!'))
+        self.assertEqual(one.phone_number, '+380000000002')
+        relation = CompanyAndUserRelation.objects.get(user_id=one)
+        self.assertEqual((relation.company_id.brand, relation.position), ('Existing', CompanyAndUserRelation.FOUNDER))
+        startup = Company.objects.get(brand='New Startup')
+        self.assertTrue(startup.is_startup)
+        self.assertEqual(CompanyAndUserRelation.objects.filter(company_id=startup).count(), 2)
+
+    def test_ndjson_import_resumes_from_checkpoint(self):
+        records = [{'email': f'user{i}@gmail.com', 'password': 'Secret123!', 'first_name': 'User', 'surname': str(i)}
+                   for i in range(10)]
+        path = self._write('users.ndjson', '\n'.join(map(json.dumps, records)))
+        with open(f'{path}.checkpoint', 'w') as checkpoint:
+            json.dump({'position': 6}, checkpoint)
+
+        self._import(path, batch_size=3)
+
+        emails = set(CustomUser.objects.filter(surname__in=[str(i) for i in range(10)]).values_list('email', flat=True))
+        self.assertEqual(emails, {f'user{i}@gmail.com' for i in range(6, 10)})
+        with open(f'{path}.checkpoint') as checkpoint:
+            self.assertEqual(json.load(checkpoint), {'position': 10})
+
+    def test_passwords_are_hashed_in_pool(self):
+        path = self._write('users.ndjson', json.dumps({'email': 'pooled@gmail.com', 'password': 'Secret123!'}))
+        call_command('import_users', path, workers=2, stdout=open(os.devnull, 'w'))
+        self.assertTrue(CustomUser.objects.get(email='pooled@gmail.com').check_password('Secret123!'))
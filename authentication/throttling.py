@@ -0,0 +1,132 @@
+import hashlib
+import logging
+import time
+import uuid
+
+from django.conf import settings
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+AUTH_THROTTLE = getattr(settings, 'AUTH_THROTTLE', {})
+
+logger = logging.getLogger('auth_throttle')
+
+# Sliding window log over one sorted set per key. An attempt is recorded under every key only if none of them is
+# over its limit; otherwise the script returns milliseconds until the oldest attempt leaves the fullest window.
+SLIDING_WINDOW_SCRIPT = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local retry = 0
+for i, key in ipairs(KEYS) do
+    redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window)
+    if redis.call('ZCARD', key) >= tonumber(ARGV[3 + i]) then
+        local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+        retry = math.max(retry, tonumber(oldest[2]) + window - now)
+    end
+end
+if retry > 0 then
+    return retry
+end
+for i, key in ipairs(KEYS) do
+    redis.call('ZADD', key, now, ARGV[3])
+    redis.call('PEXPIRE', key, window)
+end
+return 0
+"""
+
+
+class SlidingWindowThrottle(BaseThrottle):
+    """
+    Limits attempts per client IP, per email and per (IP, email) pair within a sliding window shared by all
+    workers through Redis. The decision takes a single round trip (one Lua script) and is made before the view
+    looks the user up or hashes the password. Limits and window are configured per scope in AUTH_THROTTLE.
+    The client IP is REMOTE_ADDR unless REST_FRAMEWORK sets NUM_PROXIES, so a client can't pick a fresh IP key
+    with every X-Forwarded-For header. A view can discard a successful attempt from the email and pair windows
+    with discard_attempt(), so only failures count against them. If Redis is unavailable, requests are let through.
+    """
+    scope = None
+    key_prefix = 'auth_throttle'
+    script = None
+
+    def __init__(self):
+        rates = AUTH_THROTTLE.get(self.scope, {})
+        self.window = rates.get('WINDOW', 900)
+        self.limits = {'ip': rates.get('IP_LIMIT', 100),
+                       'email': rates.get('EMAIL_LIMIT', 10),
+                       'pair': rates.get('PAIR_LIMIT', 5)}
+        self.retry_after = None
+
+    @classmethod
+    def get_connection(cls):
+        return get_redis_connection('default')
+
+    @classmethod
+    def get_script(cls, connection):
+        if SlidingWindowThrottle.script is None:
+            SlidingWindowThrottle.script = connection.register_script(SLIDING_WINDOW_SCRIPT)
+        return SlidingWindowThrottle.script
+
+    def get_ident(self, request):
+        if api_settings.NUM_PROXIES is None:
+            # X-Forwarded-For is only trusted behind the configured number of proxies
+            return request.META.get('REMOTE_ADDR')
+        return super().get_ident(request)
+
+    def get_keys(self, request):
+        """Returns {key: limit} for the attempt."""
+
+        ident = self.get_ident(request)
+        keys = {f'{self.key_prefix}:{self.scope}:ip:{ident}': self.limits['ip']}
+        email = request.data.get('email') if hasattr(request.data, 'get') else None
+        if isinstance(email, str) and email.strip():
+            digest = hashlib.blake2b(email.strip().lower().encode(), digest_size=16).hexdigest()
+            keys[f'{self.key_prefix}:{self.scope}:email:{digest}'] = self.limits['email']
+            keys[f'{self.key_prefix}:{self.scope}:pair:{ident}:{digest}'] = self.limits['pair']
+        return keys
+
+    def allow_request(self, request, view):
+        keys = self.get_keys(request)
+        now = int(time.time() * 1000)
+        attempt = f'{now}:{uuid.uuid4().hex}'
+        try:
+            connection = self.get_connection()
+            retry_after = self.get_script(connection)(
+                keys=list(keys), args=[now, self.window * 1000, attempt, *keys.values()], client=connection)
+        except RedisError as e:
+            logger.error(f"Authentication throttle is unavailable: {e}")
+            return True
+        if retry_after:
+            self.retry_after = int(retry_after) / 1000
+            logger.warning(f"Throttled {self.scope} attempt from {self.get_ident(request)}")
+            return False
+        # the IP key comes first, the rest are the email and pair keys
+        request.throttled_attempt = (attempt, list(keys)[1:])
+        return True
+
+    def wait(self):
+        return self.retry_after
+
+    @classmethod
+    def discard_attempt(cls, request):
+        """Removes the recorded attempt of the request from its email and pair windows."""
+
+        attempt, keys = getattr(request, 'throttled_attempt', (None, None))
+        if not keys:
+            return
+        try:
+            pipe = cls.get_connection().pipeline(transaction=False)
+            for key in keys:
+                pipe.zrem(key, attempt)
+            pipe.execute()
+        except RedisError as e:
+            logger.error(f"Authentication throttle attempt can't be discarded: {e}")
+
+
+class LoginThrottle(SlidingWindowThrottle):
+    scope = 'login'
+
+
+class PasswordRecoveryThrottle(SlidingWindowThrottle):
+    scope = 'password_recovery'
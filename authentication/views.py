@@ -1,28 +1,32 @@
 import logging
 
 from django.conf import settings
-from django.contrib.auth.hashers import make_password
+from django.contrib.auth import user_logged_in, user_login_failed
 from django.contrib.sites.shortcuts import get_current_site
 from django.core.exceptions import ValidationError
 from django.core.validators import validate_email
+from django.db import transaction
 from rest_framework import generics, status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from authentication.authentications import UserAuthentication
+from authentication.hashers import PasswordHashingService
 from authentication.models import CompanyAndUserRelation, CustomUser
 from authentication.permissions import (CustomUserUpdatePermission,
                                         IsAuthenticated)
+from authentication.principals import TokenPrincipal
 from authentication.serializers import (PasswordRecoverySerializer,
                                         UserRegistrationSerializer,
                                         UserUpdateSerializer)
-from authentication.utils import Utils
+from authentication.throttling import LoginThrottle, PasswordRecoveryThrottle
 from forum import settings
 from forum.errors import Error
 from forum.managers import TokenManager
 from notifications.decorators import extract_notifications_for_user
 from notifications.tasks import (send_password_reset_notification,
-                                 send_password_update_notification)
+                                 send_password_update_notification,
+                                 send_verification_email)
 
 
 class UserRegistrationView(APIView):
@@ -42,6 +46,7 @@ class UserRegistrationView(APIView):
             - Response:
                 - 201 Created: User registered successfully, verification email sent
                 - 400 Bad Request: Invalid data provided for user registration
+                - 503 Service Unavailable: Password strength can't be checked now
     """
     authentication_classes = ()
     permission_classes = ()
@@ -54,9 +59,9 @@ class UserRegistrationView(APIView):
         if serializer.is_valid():
             user = CustomUser.objects.create_user(**serializer.validated_data)
             refresh_token = TokenManager.generate_refresh_token_for_user(user)
-
-            # TO DO: rewrite with EmailManager
-            Utils.send_verification_email(get_current_site(request), user, str(refresh_token.access_token))
+            domain = get_current_site(request).domain
+            access_token = str(refresh_token.access_token)
+            transaction.on_commit(lambda: send_verification_email.delay(user.user_id, domain, access_token))
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
         else:
@@ -120,9 +125,12 @@ class LoginView(APIView):
             - 200 OK: Login successful
             - 404 Not Found: User not found
             - 401 Unauthorized: Invalid credentials
+            - 429 Too Many Requests: Too many failed attempts for this email or too many attempts from this IP
+            - 503 Service Unavailable: Too many logins are being processed
     """
     authentication_classes = ()
     permission_classes = ()
+    throttle_classes = (LoginThrottle,)
 
     @extract_notifications_for_user(related=False)
     def post(self, request):
@@ -133,11 +141,20 @@ class LoginView(APIView):
         try:
             user = CustomUser.get_user(email=email)
         except CustomUser.DoesNotExist:
+            user_login_failed.send(sender=CustomUser, credentials={'email': email}, request=request)
             return Response({'error': Error.USER_NOT_FOUND.msg}, status=Error.USER_NOT_FOUND.status)
 
-        check = user.check_password(password)
+        check, must_update = PasswordHashingService.check_password(password, user.password)
         if not check:
+            user_login_failed.send(sender=CustomUser, credentials={'email': email}, request=request)
             return Response({'error': Error.INVALID_CREDENTIALS.msg}, status=Error.NOT_AUTHENTICATED.status)
+        if must_update:
+            # rehash with the current hasher parameters while the raw password is at hand
+            PasswordHashingService.set_password(user, password)
+            user.save(update_fields=['password'])
+        # only failed attempts count against the email and pair limits
+        LoginThrottle.discard_attempt(request)
+        user_logged_in.send(sender=CustomUser, request=request, user=user)
 
         refresh = TokenManager.generate_refresh_token_for_user(user)
         return Response({
@@ -172,12 +189,14 @@ class RelateUserToCompany(APIView):
         user_id = request.user.user_id
         company_id = pk
         try:
-            relation = CompanyAndUserRelation.get_relation(user_id=user_id, company_id=company_id)
+            relation = CompanyAndUserRelation.get_relation_with_user_and_company(user_id=user_id, company_id=company_id)
         except CompanyAndUserRelation.DoesNotExist:
             return Response({'error': 'You have no access to this company.'}, status=status.HTTP_403_FORBIDDEN)
 
+        claims = TokenPrincipal.make_claims(relation) if settings.SIMPLE_JWT.get('EMBED_COMPANY_CLAIMS') else None
         user_token = request.auth.token
-        access_token = TokenManager.generate_company_related_token(company_id=company_id, token=user_token)
+        access_token = TokenManager.generate_company_related_token(company_id=company_id, token=user_token,
+                                                                   claims=claims)
         return Response({'access': f"Bearer {access_token}", 'relation_id': relation.relation_id})
 
 
@@ -253,10 +272,12 @@ class PasswordRecoveryAPIView(APIView):
                - 200 OK: Password reset email sent successfully
                - 400 Bad Request: Invalid email format
                - 404 Not Found: User does not exist
+               - 429 Too Many Requests: Too many attempts for this email or from this IP
    """
 
     authentication_classes = ()
     permission_classes = ()
+    throttle_classes = (PasswordRecoveryThrottle,)
 
     def post(self, request):
         """Handle POST requests for password recovery"""
@@ -272,9 +293,7 @@ class PasswordRecoveryAPIView(APIView):
             return Response({'error': Error.USER_NOT_FOUND.msg}, status=Error.USER_NOT_FOUND.status)
 
         access_token = TokenManager.generate_access_token_for_user(user)
-        reset_link = f"{settings.FRONTEND_URL}/auth/password-reset/{access_token}/"
-
-        send_password_reset_notification.delay(email, reset_link)
+        send_password_reset_notification.delay(user.user_id, str(access_token))
         return Response({'message': 'Password reset email sent successfully'}, status=status.HTTP_200_OK)
 
 
@@ -298,6 +317,7 @@ class PasswordResetView(APIView):
                 - 200 OK: Password reset successfully
                 - 400 Bad Request: Invalid token or password format
                 - 404 Not found: User not found
+                - 503 Service Unavailable: Password strength can't be checked now
     """
     authentication_classes = (UserAuthentication,)
     permission_classes = ()
@@ -325,10 +345,10 @@ class PasswordResetView(APIView):
         serializer = self.serializer_class(data=request.data)
         if serializer.is_valid():
             new_password = serializer.validated_data.get("password")
-            user.password = make_password(new_password)
+            user.password = PasswordHashingService.make_password(new_password)
             user.save()
 
-            send_password_update_notification(user)
+            transaction.on_commit(lambda: send_password_update_notification.delay(user.user_id))
             return Response({'message': 'Password reset successfully'}, status=status.HTTP_200_OK)
 
         else:
@@ -2,6 +2,7 @@ from bson import ObjectId
 from pydantic import BaseModel, ValidationError
 
 from forum.managers import MongoManager
+from forum.pagination import KeysetPaginator
 from forum.settings import DB
 
 
@@ -30,18 +31,23 @@ class Message(BaseModel):
 
 class MessagesManager(MongoManager):
     db = DB['long_term_messages']
+    paginator = KeysetPaginator(('-_id',))
 
-    @classmethod
-    def get_messages_to_company(cls, company_id):
-        cursor = cls.db.find({"$or": [
+    @staticmethod
+    def get_company_messages_query(company_id):
+        return {"$or": [
             {"sender_company_id": company_id},
-            {"receiver_company_id": company_id}]},
-            {"visible_for_receiver": 0, "visible_for_sender": 0}
-        )
-        if not cursor:
-            raise MessageGroupNotFound("No massage with this company")
-        existing_messages = cls.to_list(cursor)
-        return existing_messages
+            {"receiver_company_id": company_id}]}
+
+    @classmethod
+    def get_messages_to_company(cls, company_id, cursor=None, limit=None):
+        return cls.paginate(cls.get_company_messages_query(company_id), cls.paginator, cursor, limit,
+                            projection={"visible_for_receiver": 0, "visible_for_sender": 0})
+
+    @classmethod
+    def iter_messages_to_company(cls, company_id):
+        return cls.iter_documents(cls.get_company_messages_query(company_id), sort=cls.paginator.get_mongo_sort(),
+                                  projection={"visible_for_receiver": 0, "visible_for_sender": 0})
 
     @classmethod
     def get_message(cls, message_id):
@@ -75,17 +81,15 @@ class MessagesManager(MongoManager):
         return new_message
 
     @classmethod
-    def company_inbox_messages(cls, company_id):
-        cursor = cls.db.find({"$and":
-                                  [{"receiver_company_id": company_id},
-                                   {"visible_for_receiver": True}]},
-                             {"visible_for_receiver": 0, "visible_for_sender": 0})
-        return cls.to_list(cursor)
+    def company_inbox_messages(cls, company_id, cursor=None, limit=None):
+        query = {"$and": [{"receiver_company_id": company_id},
+                          {"visible_for_receiver": True}]}
+        return cls.paginate(query, cls.paginator, cursor, limit,
+                            projection={"visible_for_receiver": 0, "visible_for_sender": 0})
 
     @classmethod
-    def company_outbox_messages(cls, company_id):
-        cursor = cls.db.find({"$and":
-                                  [{"sender_company_id": company_id},
-                                   {"visible_for_sender": True}]},
-                             {"visible_for_receiver": 0, "visible_for_sender": 0})
-        return cls.to_list(cursor)
+    def company_outbox_messages(cls, company_id, cursor=None, limit=None):
+        query = {"$and": [{"sender_company_id": company_id},
+                          {"visible_for_sender": True}]}
+        return cls.paginate(query, cls.paginator, cursor, limit,
+                            projection={"visible_for_receiver": 0, "visible_for_sender": 0})
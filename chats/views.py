@@ -8,6 +8,7 @@ from rest_framework.views import APIView
 from authentication.models import Company, CompanyAndUserRelation
 from authentication.permissions import IsAuthenticated
 from forum.errors import Error
+from forum.streaming import JSONStreamingResponse, is_streaming_requested
 
 from .manager import Message, MessageNotFound
 from .manager import MessagesManager as mm
@@ -66,11 +67,11 @@ class SendMessageView(APIView):
         sender_company_id = request.user.company.get("company_id")
         receiver_data = data.get("receiver_id")
         receiver = CompanyAndUserRelation.get_relation(relation_id=receiver_data)
-        receiver_company_id = receiver.company_id.company_id
-        receiver_user_id = receiver.user_id.user_id
+        receiver_company_id = receiver.company_id_id
+        receiver_user_id = receiver.user_id_id
         if not sender_company_id == receiver_company_id:
-            sender = Company.objects.get(pk=sender_company_id)
-            receiver = Company.objects.get(pk=receiver_company_id)
+            sender = Company.get_company(company_id=sender_company_id)
+            receiver = Company.get_company(company_id=receiver_company_id)
             message = {
                 "sender_company_id": sender_company_id,
                 "sender_data": sender.brand,
@@ -113,7 +114,8 @@ class OutboxView(APIView):
     def get(self, request):
         try:
             company_id = request.user.company.get("company_id")
-            messages = mm.company_outbox_messages(company_id)
+            messages = mm.company_outbox_messages(company_id, cursor=request.query_params.get("cursor"),
+                                                  limit=request.query_params.get("limit"))
             return Response(messages, status=status.HTTP_200_OK)
         except AttributeError:
             raise NotAuthenticated(detail=Error.NO_USER_OR_COMPANY_ID.msg)
@@ -125,19 +127,27 @@ class InboxView(APIView):
     def get(self, request):
         try:
             company_id = request.user.company.get("company_id")
-            messages = mm.company_inbox_messages(company_id)
+            messages = mm.company_inbox_messages(company_id, cursor=request.query_params.get("cursor"),
+                                                 limit=request.query_params.get("limit"))
             return Response(messages, status=status.HTTP_200_OK)
         except AttributeError:
             raise NotAuthenticated(detail=Error.NO_USER_OR_COMPANY_ID.msg)
 
 
 class ListMessagesView(APIView):
+    """
+    Lists messages of the user's company page by page. With ?stream=true all messages are sent as a single
+    JSON array, streamed from the database cursor.
+    """
     permission_classes = (IsAuthenticated,)
 
     def get(self, request):
         try:
             company_id = request.user.company.get("company_id")
-            messages = mm.get_messages_to_company(company_id)
+            if is_streaming_requested(request):
+                return JSONStreamingResponse(mm.iter_messages_to_company(company_id))
+            messages = mm.get_messages_to_company(company_id, cursor=request.query_params.get("cursor"),
+                                                  limit=request.query_params.get("limit"))
             return Response(messages, status=status.HTTP_200_OK)
         except AttributeError:
             raise NotAuthenticated(detail=Error.NO_USER_OR_COMPANY_ID.msg)
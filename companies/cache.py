@@ -0,0 +1,133 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+from authentication.models import Company
+
+COMPANY_DETAIL_CACHE = getattr(settings, 'COMPANY_DETAIL_CACHE', {})
+
+logger = logging.getLogger('company_detail_cache')
+
+
+class CompanyDetailCache:
+    """
+    Read-through cache of rendered company detail payloads in the shared cache (Redis).
+
+    Payloads are keyed by company_id and the version of the company. The version counter is created when the
+    payload of an existing company is first loaded, is bumped after every committed save of the company,
+    django-reversion reverts included, and is dropped after its delete (see companies.signals), so payloads of
+    older versions are never read again and expire after TIMEOUT. Counters of companies that aren't read expire
+    after VERSION_TIMEOUT. The version is read before the company is loaded, so a payload is never stored under
+    a version newer than its data. Company counters change too often to be cached with the payload and are added
+    by the view. The version and the counters make the strong ETag of the detail response, so conditional
+    requests are answered without the database. If the cache is unavailable, there is no version and payloads
+    are loaded from the database every time.
+
+    Views of existing companies are counted in a Redis sorted set; warm_up() renders the most viewed companies
+    in advance.
+    """
+    key_prefix = 'company_detail'
+    views_key = 'company_detail:views'
+    timeout = COMPANY_DETAIL_CACHE.get('TIMEOUT', 3600)
+    version_timeout = COMPANY_DETAIL_CACHE.get('VERSION_TIMEOUT', 86400)
+    warm_up_limit = COMPANY_DETAIL_CACHE.get('WARM_UP_LIMIT', 1000)
+
+    @classmethod
+    def get_connection(cls):
+        return get_redis_connection('default')
+
+    @classmethod
+    def make_version_key(cls, company_id):
+        return f'{cls.key_prefix}:version:{company_id}'
+
+    @classmethod
+    def make_key(cls, company_id, version):
+        return f'{cls.key_prefix}:{company_id}:{version}'
+
+    @staticmethod
+    def make_etag(company_id, version, counters=None):
+        counts = ''.join(f'-{count}' for count in counters.values()) if counters else ''
+        return f'"{company_id}-{version}{counts}"'
+
+    @classmethod
+    def get_version(cls, company_id):
+        """Returns the current version of the company, or None if nothing is cached for it."""
+
+        return cache.get(cls.make_version_key(company_id))
+
+    @classmethod
+    def create_version(cls, company_id):
+        """Returns the current version of the company and whether it was created by this call."""
+
+        key = cls.make_version_key(company_id)
+        # new counters start at a time-based value, so a recreated counter can't repeat an old version
+        created = cache.add(key, time.time_ns(), timeout=cls.version_timeout)
+        return cache.get(key), created
+
+    @classmethod
+    def bump(cls, company_id):
+        try:
+            cache.incr(cls.make_version_key(company_id))
+        except ValueError:
+            # no counter means nothing was cached for the company
+            pass
+
+    @classmethod
+    def forget(cls, company_id):
+        cache.delete(cls.make_version_key(company_id))
+        try:
+            cls.get_connection().zrem(cls.views_key, company_id)
+        except RedisError as e:
+            logger.error(f"Company views can't be deleted: {e}")
+
+    @classmethod
+    def get(cls, company_id, version=None):
+        """
+        Returns the version and the detail payload of the company, loading it if it isn't cached under the
+        version. Raises Company.DoesNotExist.
+        """
+
+        created = False
+        if version is not None:
+            payload = cache.get(cls.make_key(company_id, version))
+            if payload is not None:
+                return version, payload
+        else:
+            version, created = cls.create_version(company_id)
+        try:
+            payload = Company.get_company(company_id=company_id).get_info(counters=False)
+        except Company.DoesNotExist:
+            # a missing company leaves no counter behind
+            if created:
+                cache.delete(cls.make_version_key(company_id))
+            raise
+        if version is not None:
+            cache.set(cls.make_key(company_id, version), payload, cls.timeout)
+        return version, payload
+
+    @classmethod
+    def record_view(cls, company_id):
+        try:
+            cls.get_connection().zincrby(cls.views_key, 1, company_id)
+        except RedisError as e:
+            logger.error(f"Company views can't be counted: {e}")
+
+    @classmethod
+    def get_most_viewed(cls, limit):
+        return [int(company_id) for company_id in cls.get_connection().zrevrange(cls.views_key, 0, limit - 1)]
+
+    @classmethod
+    def warm_up(cls, limit=None):
+        """Caches detail payloads of the limit most viewed companies. Returns the number of cached payloads."""
+
+        company_ids = cls.get_most_viewed(limit or cls.warm_up_limit)
+        versions = {company_id: cls.create_version(company_id)[0] for company_id in company_ids}
+        payloads = {cls.make_key(company.company_id, versions[company.company_id]): company.get_info(counters=False)
+                    for company in Company.objects.filter(company_id__in=company_ids)
+                    if versions[company.company_id] is not None}
+        cache.set_many(payloads, cls.timeout)
+        return len(payloads)
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from companies.cache import CompanyDetailCache
+
+
+class Command(BaseCommand):
+    help = "Caches detail payloads of the most viewed companies."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=CompanyDetailCache.warm_up_limit,
+                            help="number of most viewed companies to cache")
+
+    def handle(self, *args, **options):
+        cached = CompanyDetailCache.warm_up(options['limit'])
+        self.stdout.write(self.style.SUCCESS(f"Cached {cached} company details"))
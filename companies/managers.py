@@ -4,7 +4,9 @@ from bson import ObjectId
 from pydantic import BaseModel
 from pymongo import MongoClient
 
+from authentication.counters import CompanyCounters
 from forum.managers import MongoManager
+from forum.pagination import KeysetPaginator
 from forum.settings import DB
 
 from .schemas import Article, CompanyArticles
@@ -26,28 +28,23 @@ class ArticlesManager(MongoManager):
     types: Dict[str, BaseModel] = {
         ARTICLE: Article, COMPANY_ARTICLES: CompanyArticles}
     limit:int = LIMIT
+    # article ids are ObjectId strings, so they sort in the order the articles were added
+    paginator = KeysetPaginator(('-article_id',), page_size=LIMIT)
 
     @classmethod
-    def get_articles_for_company(cls, company_id:int, skip=0, **kwargs) -> list[dict[str, Any]]:
-        """Retrieves articles for the specific company. 
-           10 articles is returned, the latest ones first. 
+    def get_articles_for_company(cls, company_id:int, cursor=None, limit=None) -> dict[str, Any]:
+        """Retrieves a page of articles for the specific company, the latest ones first.
            Required parameters:
              - company_id: id of the company in question;
-             - skip: the number of articles we have to skip;
-                     this parameter is depending on paginating
-                     and is the result of this formula: LIMIT * (page - 1);
+           Optional parameters:
+             - cursor: the 'next' cursor of the previous page;
+             - limit: the number of articles on the page, LIMIT by default;
+           Returns {'results': articles, 'next': cursor of the next page or None}.
         """
-        query = {'company_id': company_id}
-        company_articles = cls.get_document(query, **kwargs)
-        if not company_articles:
-            return []
-        articles = company_articles.get('articles', [])
-        sorted_articles = articles[::-1]
-        skipped_articles = sorted_articles[skip:]
-        limited_articles = skipped_articles[0:LIMIT]
-        for article in limited_articles:
-            article['article_id'] = str(article['article_id'])
-        return limited_articles
+        pipeline = [{'$match': {'company_id': company_id}},
+                    {'$unwind': '$articles'},
+                    {'$replaceRoot': {'newRoot': '$articles'}}]
+        return cls.paginator.paginate_pipeline(cls.db, pipeline, cursor, limit)
 
     @classmethod
     def add_article(cls, article: dict) -> dict[str, Any]:
@@ -70,6 +67,7 @@ class ArticlesManager(MongoManager):
         update = {'$push': {'articles': v_model.model_dump()}}
         res = cls.update_document(query, update, projection={
                                   'articles': 1, '_id': 0})
+        CompanyCounters.add({company_id: {'articles': 1}})
         return cls.id_to_string(res['articles'][-1])
 
     @classmethod
@@ -108,4 +106,12 @@ class ArticlesManager(MongoManager):
         res = cls.delete_from_document(query, delete_part)
         if not res:
             return False
+        CompanyCounters.add({company_id: {'articles': -1}})
         return True
+
+    @classmethod
+    def count_by_company(cls, company_ids) -> dict[int, int]:
+        """Returns {company_id: number of articles} of the companies that have articles."""
+        pipeline = [{'$match': {'company_id': {'$in': list(company_ids)}}},
+                    {'$group': {'_id': '$company_id', 'count': {'$sum': {'$size': {'$ifNull': ['$articles', []]}}}}}]
+        return {document['_id']: document['count'] for document in cls.db.aggregate(pipeline)}
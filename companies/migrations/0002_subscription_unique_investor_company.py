@@ -0,0 +1,34 @@
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def remove_duplicate_subscriptions(apps, schema_editor):
+    # keeps the oldest subscription of every (investor, company) pair
+    Subscription = apps.get_model('companies', 'Subscription')
+    first_ids = (Subscription.objects.values('investor', 'company').annotate(first_id=Min('subscription_id'))
+                 .values('first_id'))
+    Subscription.objects.exclude(subscription_id__in=first_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0006_partition_userloginactivity'),
+        ('companies', '0001_initial'),
+    ]
+
+    operations = [
+        # the model has referenced CompanyAndUserRelation since subscriptions are made by relations
+        migrations.AlterField(
+            model_name='subscription',
+            name='investor',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE,
+                                    to='authentication.companyanduserrelation'),
+        ),
+        migrations.RunPython(remove_duplicate_subscriptions, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='subscription',
+            constraint=models.UniqueConstraint(fields=('investor', 'company'), name='unique_investor_company'),
+        ),
+    ]
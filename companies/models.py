@@ -1,5 +1,8 @@
-from django.db import models
+from django.db import connection, models
+from django.db.models import Count, Q
+from django.utils import timezone
 
+from authentication.counters import CompanyCounters
 from authentication.models import Company, CompanyAndUserRelation, CustomUser
 
 
@@ -9,7 +12,14 @@ class Subscription(models.Model):
     company = models.ForeignKey(Company, on_delete=models.CASCADE)
     get_email_newsletter = models.BooleanField(default=False)
     subscribed_at = models.DateTimeField(auto_now_add=True)
-    
+
+    INFO_FIELDS = ('subscription_id', 'subscribed_at', 'company_id', 'company__brand')
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=('investor', 'company'), name='unique_investor_company')]
+        # pages of an investor's subscriptions, newest first
+        indexes = [models.Index(fields=('investor', '-subscription_id'), name='subscription_investor_idx')]
+
     @classmethod
     def get_subscription(cls, *args, **kwargs):
         return cls.objects.get(**kwargs)
@@ -18,8 +28,126 @@ class Subscription(models.Model):
     def get_subscriptions(cls, *args, **kwargs):
         return cls.objects.filter(**kwargs)
 
+    @classmethod
+    def subscribe(cls, investor_id, company_id):
+        """
+        Subscribes the investor to the company with a single INSERT ... ON CONFLICT DO NOTHING on the unique
+        (investor, company) constraint, so repeated or concurrent requests never create duplicates.
+        Returns (subscription_id, created) or None if the company doesn't exist. Only an existing subscription
+        costs a second query to read its id.
+        """
+
+        table = cls._meta.db_table
+        while True:
+            with connection.cursor() as cursor:
+                cursor.execute(f"INSERT INTO {table} (investor_id, company_id, get_email_newsletter, subscribed_at) "
+                               f"SELECT %s, company_id, %s, %s FROM {Company._meta.db_table} WHERE company_id = %s "
+                               f"ON CONFLICT (investor_id, company_id) DO NOTHING RETURNING subscription_id",
+                               [investor_id, False, timezone.now(), company_id])
+                row = cursor.fetchone()
+            if row:
+                CompanyCounters.add_on_commit({company_id: {'followers': 1}})
+                return row[0], True
+            subscription_id = (cls.get_subscriptions(investor=investor_id, company=company_id)
+                               .values_list('subscription_id', flat=True).first())
+            if subscription_id is not None:
+                return subscription_id, False
+            if not Company.objects.filter(company_id=company_id).exists():
+                return None
+            # the conflicting subscription was deleted in the meantime
+
+    @classmethod
+    def unsubscribe(cls, investor_id, subscription_id):
+        """Deletes the investor's subscription with a single DELETE ... RETURNING. Returns its company_id or None."""
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {cls._meta.db_table} WHERE subscription_id = %s AND investor_id = %s "
+                           f"RETURNING company_id, get_email_newsletter", [subscription_id, investor_id])
+            row = cursor.fetchone()
+        if not row:
+            return None
+        CompanyCounters.add_on_commit(cls.count_deleted([row]))
+        return row[0]
+
+    @classmethod
+    def subscribe_to_companies(cls, investor_id, company_ids):
+        """
+        Subscribes the investor to the companies with a single INSERT ... ON CONFLICT DO NOTHING RETURNING, like
+        subscribe(), so only subscriptions created by this request are counted and notified even if a concurrent
+        request subscribes to the same companies. Only uncreated subscriptions cost a second query, which tells
+        existing subscriptions from missing companies.
+        Returns (subscribed, already_subscribed, not_found) lists of company ids.
+        """
+
+        if not company_ids:
+            return [], [], []
+        placeholders = ', '.join(['%s'] * len(company_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {cls._meta.db_table} (investor_id, company_id, get_email_newsletter, "
+                           f"subscribed_at) SELECT %s, company_id, %s, %s FROM {Company._meta.db_table} "
+                           f"WHERE company_id IN ({placeholders}) "
+                           f"ON CONFLICT (investor_id, company_id) DO NOTHING RETURNING company_id",
+                           [investor_id, False, timezone.now(), *company_ids])
+            created = {row[0] for row in cursor.fetchall()}
+        CompanyCounters.add_on_commit({company_id: {'followers': 1} for company_id in created})
+        rest = [company_id for company_id in company_ids if company_id not in created]
+        existing = set()
+        if rest:
+            existing = set(Company.objects.filter(company_id__in=rest).values_list('company_id', flat=True))
+        return ([company_id for company_id in company_ids if company_id in created],
+                [company_id for company_id in rest if company_id in existing],
+                [company_id for company_id in rest if company_id not in existing])
+
+    @classmethod
+    def unsubscribe_from_companies(cls, investor_id, company_ids):
+        """Deletes the investor's subscriptions to the companies with a single DELETE. Returns unsubscribed ids."""
+
+        if not company_ids:
+            return []
+        placeholders = ', '.join(['%s'] * len(company_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {cls._meta.db_table} WHERE investor_id = %s AND company_id IN "
+                           f"({placeholders}) RETURNING company_id, get_email_newsletter", [investor_id, *company_ids])
+            rows = cursor.fetchall()
+        CompanyCounters.add_on_commit(cls.count_deleted(rows))
+        deleted = {company_id for company_id, _ in rows}
+        return [company_id for company_id in company_ids if company_id in deleted]
+
+    @classmethod
+    def count_by_company(cls, company_ids):
+        """Returns {company_id: {'followers': n, 'newsletter_subscribers': m}} of the subscribed companies."""
+
+        rows = (cls.get_subscriptions(company__in=company_ids).values('company_id')
+                .annotate(followers=Count('subscription_id'),
+                          newsletter_subscribers=Count('subscription_id', filter=Q(get_email_newsletter=True))))
+        return {row.pop('company_id'): row for row in rows}
+
+    @staticmethod
+    def count_deleted(rows):
+        """Returns the counter changes of deleted (company_id, get_email_newsletter) subscription rows."""
+
+        changes = {}
+        for company_id, get_email_newsletter in rows:
+            deltas = changes.setdefault(company_id, {'followers': 0, 'newsletter_subscribers': 0})
+            deltas['followers'] -= 1
+            deltas['newsletter_subscribers'] -= bool(get_email_newsletter)
+        return changes
+
+    @classmethod
+    def get_subscriptions_info(cls, investor_id):
+        """Returns the investor's subscriptions as rows of INFO_FIELDS, joined with the company brand."""
+        return cls.get_subscriptions(investor=investor_id).values(*cls.INFO_FIELDS)
+
+    @staticmethod
+    def make_info(values):
+        """Builds subscription info from a dict with INFO_FIELDS (e.g. a row of get_subscriptions_info)."""
+        return {'subscription_id': values['subscription_id'],
+                'subscribed_at': values['subscribed_at'],
+                'company_name': values['company__brand'],
+                'company_id': values['company_id']}
+
     def get_info(self):
-        data = {'subscribed_at': self.subscribed_at,
-                'company_name': self.company.brand,
-                'company_id': self.company.company_id}
-        return data
+        return self.make_info({'subscription_id': self.subscription_id,
+                               'subscribed_at': self.subscribed_at,
+                               'company__brand': self.company.brand,
+                               'company_id': self.company_id})
@@ -13,7 +13,7 @@ class EditCompanyPermission(BasePermission):
         Return `True` if the requesting user has a relation to the company (obj), `False` otherwise.
         """  
         try:
-            relation = CompanyAndUserRelation.objects.get(user_id=request.user, company_id=obj.company_id)
+            relation = CompanyAndUserRelation.objects.get(user_id=request.user.user_id, company_id=obj.company_id)
             return True
         except CompanyAndUserRelation.DoesNotExist:
             return False
@@ -1,11 +1,16 @@
 import re
 
-from rest_framework.serializers import ModelSerializer
+from django.conf import settings
+from rest_framework.serializers import (IntegerField, ListField,
+                                        ModelSerializer, Serializer,
+                                        ValidationError)
 
 from validation.serializers import CustomValidationSerializer
 
 from .models import Company, Subscription
 
+SUBSCRIPTION_BATCH_SIZE = getattr(settings, 'SUBSCRIPTION_BATCH', {}).get('MAX_SIZE', 100)
+
 
 class CompaniesSerializer(CustomValidationSerializer, ModelSerializer):
     class Meta:
@@ -13,7 +18,29 @@ class CompaniesSerializer(CustomValidationSerializer, ModelSerializer):
         fields = '__all__'
 
 
+class CompanySummarySerializer(ModelSerializer):
+    """Read-only representation of companies in lists, without the large text fields."""
+    class Meta:
+        model = Company
+        fields = Company.SUMMARY_FIELDS
+        read_only_fields = Company.SUMMARY_FIELDS
+
+
 class SubscriptionSerializer(CustomValidationSerializer, ModelSerializer):
     class Meta:
         model = Subscription
         fields = ['investor', 'company', 'get_email_newsletter']
+
+
+class SubscriptionBatchSerializer(Serializer):
+    """Company ids to subscribe to and to unsubscribe from, up to MAX_SIZE each. Repeated ids are dropped."""
+    subscribe = ListField(child=IntegerField(min_value=1), max_length=SUBSCRIPTION_BATCH_SIZE, default=list)
+    unsubscribe = ListField(child=IntegerField(min_value=1), max_length=SUBSCRIPTION_BATCH_SIZE, default=list)
+
+    def validate(self, data):
+        data = {key: list(dict.fromkeys(company_ids)) for key, company_ids in data.items()}
+        if not data['subscribe'] and not data['unsubscribe']:
+            raise ValidationError("No company ids given")
+        if set(data['subscribe']) & set(data['unsubscribe']):
+            raise ValidationError("Can't subscribe to and unsubscribe from the same company")
+        return data
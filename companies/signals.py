@@ -0,0 +1,41 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from authentication.counters import CompanyCounters
+from authentication.models import Company
+
+from .cache import CompanyDetailCache
+from .models import Subscription
+
+
+@receiver(post_save, sender=Company)
+def bump_company_detail_version(sender, instance, **kwargs):
+    # bumped after commit, so a request can't cache the old row under the new version
+    company_id = instance.company_id
+    transaction.on_commit(lambda: CompanyDetailCache.bump(company_id))
+
+
+@receiver(post_delete, sender=Company)
+def forget_company_detail(sender, instance, **kwargs):
+    company_id = instance.company_id
+    transaction.on_commit(lambda: CompanyDetailCache.forget(company_id))
+
+
+@receiver(post_delete, sender=Company)
+def delete_company_counters(sender, instance, **kwargs):
+    company_id = instance.company_id
+    transaction.on_commit(lambda: CompanyCounters.delete(company_id))
+
+
+@receiver(post_save, sender=Subscription)
+def count_created_subscription(sender, instance, created, **kwargs):
+    # subscriptions saved through the ORM (admin, cascades); the Subscription classmethods count their own writes
+    if created:
+        deltas = {'followers': 1, 'newsletter_subscribers': int(instance.get_email_newsletter)}
+        CompanyCounters.add_on_commit({instance.company_id: deltas})
+
+
+@receiver(post_delete, sender=Subscription)
+def count_deleted_subscription(sender, instance, **kwargs):
+    CompanyCounters.add_on_commit(Subscription.count_deleted([(instance.company_id, instance.get_email_newsletter)]))
@@ -0,0 +1,28 @@
+from celery import shared_task
+from django.conf import settings
+
+from authentication.counters import CompanyCounters
+from authentication.models import Company
+
+from .managers import ArticlesManager as am
+from .models import Subscription
+
+RECONCILE_BATCH_SIZE = getattr(settings, 'COMPANY_COUNTERS', {}).get('RECONCILE_BATCH_SIZE', 1000)
+
+
+@shared_task
+def reconcile_company_counters(batch_size=RECONCILE_BATCH_SIZE):
+    """
+    Recounts followers, newsletter subscribers and articles of all companies from the subscriptions table and
+    the Articles collection, batch_size companies at a time, and replaces their counters in Redis.
+    """
+    last_id = 0
+    while company_ids := list(Company.objects.filter(company_id__gt=last_id).order_by('company_id')
+                              .values_list('company_id', flat=True)[:batch_size]):
+        counts = {company_id: dict.fromkeys(CompanyCounters.fields, 0) for company_id in company_ids}
+        for company_id, values in Subscription.count_by_company(company_ids).items():
+            counts[company_id].update(values)
+        for company_id, articles in am.count_by_company(company_ids).items():
+            counts[company_id]['articles'] = articles
+        CompanyCounters.replace(counts)
+        last_id = company_ids[-1]
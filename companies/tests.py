@@ -1,14 +1,47 @@
+import json
+import time
+from io import StringIO
+from unittest.mock import patch
+
+import fakeredis
+import reversion
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
 from rest_framework import reverse
 from rest_framework.test import APIClient, APITestCase
+from redis.exceptions import ConnectionError as RedisConnectionError
+from reversion.models import Revision, Version
 
+from authentication.counters import CompanyCounters
 from authentication.models import Company, CompanyAndUserRelation, CustomUser
 from forum.managers import TokenManager
+from forum.pagination import InvalidCursor
 from forum.settings import FRONTEND_URL
+from revision.deferred import DeferredRevisions, create_deferred_revision, deferred_revision
+
+from .cache import CompanyDetailCache
+from .managers import ArticlesManager as am
+from .models import Subscription
+from .tasks import reconcile_company_counters
+
+
+def use_fake_redis(test_case):
+    redis = fakeredis.FakeRedis()
+    for redis_class in (CompanyDetailCache, CompanyCounters, DeferredRevisions):
+        patcher = patch.object(redis_class, 'get_connection', return_value=redis)
+        patcher.start()
+        test_case.addCleanup(patcher.stop)
+    return redis
 
 
 class CompanyTestAuthenticatedUser(APITestCase):
 
     def setUp(self):
+        use_fake_redis(self)
         self.company_url = f'{FRONTEND_URL}/companies/'
         self.get_company_url = f'{self.company_url}get_company/'
         self.user = CustomUser.objects.create_user('test@mail.com', 'Test_password123456')
@@ -89,6 +122,467 @@ class CompanyTestAuthenticatedUser(APITestCase):
         self.assertEqual(response.status_code, 400)
 
 
+class CompanyPaginationTest(APITestCase):
+
+    def setUp(self):
+        use_fake_redis(self)
+        self.user = CustomUser.objects.create_user('paged@mail.com', 'Test_password123456')
+        self.access_token = str(TokenManager.generate_access_token_for_user(self.user))
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.access_token}')
+        self.companies = Company.objects.bulk_create(Company(brand=f'brand{i}', is_startup=i % 2 == 0)
+                                                     for i in range(7))
+
+    def _pages(self, url, **params):
+        pages, cursor = [], None
+        while True:
+            response = self.client.get(url, dict(params, **({'cursor': cursor} if cursor else {})))
+            self.assertEqual(response.status_code, 200)
+            pages.append(response.data['results'])
+            cursor = response.data['next']
+            if not cursor:
+                return pages
+
+    def test_companies_are_paginated(self):
+        pages = self._pages(f'{FRONTEND_URL}/companies/get_companies/', limit=3)
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual([company['brand'] for company in sum(pages, [])], [f'brand{i}' for i in range(7)])
+
+        pages = self._pages(f'{FRONTEND_URL}/companies/get_companies/', limit=3, company_type='startup')
+        self.assertEqual([company['brand'] for company in sum(pages, [])], ['brand0', 'brand2', 'brand4', 'brand6'])
+
+    def test_companies_are_streamed(self):
+        pages = self._pages(f'{FRONTEND_URL}/companies/get_companies/', limit=3)
+        with self.assertNumQueries(1):
+            response = self.client.get(f'{FRONTEND_URL}/companies/get_companies/', {'stream': 'true'})
+            self.assertTrue(response.streaming)
+            self.assertEqual(json.loads(b''.join(response.streaming_content)), sum(pages, []))
+
+    def test_lists_do_not_load_large_text_fields(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.companies[0].common_info = 'large text'
+            self.companies[0].save()
+        CompanyAndUserRelation.objects.create(user_id=self.user, company_id=self.companies[1])
+        company_token = TokenManager.generate_company_related_token(self.companies[1].company_id, self.access_token)
+        urls = [f'{FRONTEND_URL}/companies/get_companies/', f'{FRONTEND_URL}/companies/',
+                f'{FRONTEND_URL}/search/', f'{FRONTEND_URL}/companies/subscriptions/']
+        for url in urls:
+            if url.endswith('subscriptions/'):
+                self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {company_token}')
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+            self.assertNotIn('large text', str(response.data), url)
+            for query in queries:
+                self.assertNotIn('"common_info"', query['sql'], url)
+
+        response = self.client.get(f'{FRONTEND_URL}/companies/get_company/{self.companies[0].company_id}/')
+        self.assertEqual(response.data['common_info'], 'large text')
+
+    def test_tampered_cursor_is_rejected(self):
+        cursor = self.client.get(f'{FRONTEND_URL}/companies/get_companies/', {'limit': 3}).data['next']
+        response = self.client.get(f'{FRONTEND_URL}/companies/get_companies/', {'cursor': cursor[:-1] + 'x'})
+        self.assertEqual(response.status_code, InvalidCursor.status_code)
+
+    def test_articles_are_paginated_newest_first(self):
+        company_id = self.companies[0].company_id
+        am.db.delete_many({'company_id': company_id})
+        created = [am.add_article({'company_id': company_id, 'relation': 1, 'article_title': f'title{i}',
+                                   'article_text': 'text', 'article_tags': 'tags'})['article_id'] for i in range(12)]
+        pages = self._pages(f'{FRONTEND_URL}/companies/get_article/{company_id}/')
+        self.assertEqual([len(page) for page in pages], [am.limit, 12 - am.limit])
+        self.assertEqual([article['article_id'] for article in sum(pages, [])], created[::-1])
+
+
+class CompanyDetailCacheTest(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        use_fake_redis(self)
+        self.user = CustomUser.objects.create_user('detail@mail.com', 'Test_password123456')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {TokenManager.generate_access_token_for_user(self.user)}')
+        self.company = Company.objects.create(brand='Cached', common_info='info')
+        self.url = f'{FRONTEND_URL}/companies/get_company/{self.company.company_id}/'
+        # authenticate once, so the principal of the user is cached
+        self.client.get(self.url)
+
+    def test_detail_is_served_from_cache(self):
+        first = self.client.get(self.url)
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second['ETag'], first['ETag'])
+        self.assertTrue(second['ETag'].startswith('"'))
+
+    def test_conditional_get_returns_not_modified(self):
+        etag = self.client.get(self.url)['ETag']
+        cache.delete_many([CompanyDetailCache.make_key(self.company.company_id, CompanyDetailCache.get_version(
+            self.company.company_id))])
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_save_changes_version(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.company.common_info = 'updated'
+            self.company.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data['common_info'], 'updated')
+
+    def test_revert_changes_version(self):
+        with reversion.create_revision():
+            self.company.save()
+        etag = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.company.common_info = 'updated'
+            self.company.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            Version.objects.get_for_object(self.company).first().revert()
+        response = self.client.get(self.url)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data['common_info'], 'info')
+
+    def test_deleted_company_is_not_found(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.company.delete()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.assertIsNone(CompanyDetailCache.get_version(self.company.company_id))
+
+    def test_missing_company_leaves_nothing_cached(self):
+        missing_id = self.company.company_id + 1000
+        url = f'{FRONTEND_URL}/companies/get_company/{missing_id}/'
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH='*').status_code, 404)
+        self.assertIsNone(CompanyDetailCache.get_version(missing_id))
+        self.assertNotIn(missing_id, CompanyDetailCache.get_most_viewed(10))
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='*').status_code, 304)
+
+    def test_warm_up_caches_most_viewed_companies(self):
+        other = Company.objects.create(brand='Other')
+        self.client.get(f'{FRONTEND_URL}/companies/get_company/{other.company_id}/')
+        self.client.get(self.url)
+        cache.clear()
+        call_command('warm_company_cache', limit=1, stdout=StringIO())
+
+        def is_cached(company):
+            version = CompanyDetailCache.get_version(company.company_id)
+            return cache.get(CompanyDetailCache.make_key(company.company_id, version)) is not None
+
+        self.assertTrue(is_cached(self.company))
+        self.assertFalse(is_cached(other))
+
+
+class SubscriptionTest(APITestCase):
+
+    def setUp(self):
+        use_fake_redis(self)
+        self.user = CustomUser.objects.create_user('investor@mail.com', 'Test_password123456')
+        self.investor = Company.objects.create(brand='Investor', is_startup=False)
+        self.relation = CompanyAndUserRelation.objects.create(user_id=self.user, company_id=self.investor)
+        self.startup = Company.objects.create(brand='Startup', is_startup=True)
+        self.access_token = str(TokenManager.generate_access_token_for_user(self.user))
+        company_token = TokenManager.generate_company_related_token(self.investor.company_id, self.access_token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {company_token}')
+        self.url = f'{FRONTEND_URL}/companies/subscribe/{self.startup.company_id}/'
+
+    @patch('notifications.decorators.send_subscribe_notification')
+    @patch('notifications.decorators.create_notification')
+    def test_subscribe_is_idempotent(self, create_notification, send_subscribe_notification):
+        created = self.client.post(self.url)
+        repeated = self.client.post(self.url)
+        self.assertEqual(created.status_code, 201)
+        self.assertEqual(repeated.status_code, 200)
+        self.assertEqual(created.data['subscription_id'], repeated.data['subscription_id'])
+        self.assertEqual(created.data['company_id'], repeated.data['company_id'])
+        self.assertEqual(Subscription.get_subscriptions(investor=self.relation).count(), 1)
+        create_notification.assert_called_once()
+
+    def test_subscribe_to_nonexistent_company(self):
+        response = self.client.post(f'{FRONTEND_URL}/companies/subscribe/{self.startup.company_id + 100}/')
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Subscription.objects.exists())
+
+    def test_subscription_is_unique(self):
+        Subscription.objects.create(investor=self.relation, company=self.startup)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Subscription.objects.create(investor=self.relation, company=self.startup)
+
+    def test_unsubscribe(self):
+        subscription_id, _ = Subscription.subscribe(self.relation.relation_id, self.startup.company_id)
+        url = f'{FRONTEND_URL}/companies/unsubscribe/{subscription_id}/'
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['company_id'], self.startup.company_id)
+        self.assertEqual(self.client.delete(url).status_code, 404)
+
+    def test_unsubscribe_only_own_subscription(self):
+        other = CompanyAndUserRelation.objects.create(
+            user_id=CustomUser.objects.create_user('other@mail.com', 'Test_password123456'), company_id=self.investor)
+        subscription_id, _ = Subscription.subscribe(other.relation_id, self.startup.company_id)
+        response = self.client.delete(f'{FRONTEND_URL}/companies/unsubscribe/{subscription_id}/')
+        self.assertEqual(response.status_code, 404)
+        self.assertTrue(Subscription.objects.filter(subscription_id=subscription_id).exists())
+
+
+    def test_subscription_list_queries_do_not_grow(self):
+        url = f'{FRONTEND_URL}/companies/subscriptions/'
+        startups = Company.objects.bulk_create(Company(brand=f'startup{i}', is_startup=True) for i in range(30))
+        Subscription.subscribe(self.relation.relation_id, self.startup.company_id)
+        self.client.get(url)
+        counts = []
+        for count in (1, 31):
+            Subscription.subscribe_to_companies(self.relation.relation_id,
+                                                [startup.company_id for startup in startups[:count - 1]])
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, {'limit': 100})
+            self.assertEqual(len(response.data['results']), count)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        latest = response.data['results'][0]
+        self.assertEqual(set(latest), {'subscription_id', 'subscribed_at', 'company_name', 'company_id'})
+        self.assertEqual((latest['company_name'], latest['company_id']), ('startup29', startups[29].company_id))
+
+    def _batch(self, **data):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(f'{FRONTEND_URL}/companies/subscriptions/batch/', data, format='json')
+
+    @patch('companies.views.create_subscription_notifications')
+    def test_batch_subscribe_and_unsubscribe(self, create_subscription_notifications):
+        startups = Company.objects.bulk_create(Company(brand=f'startup{i}', is_startup=True) for i in range(3))
+        subscribed_id, _ = Subscription.subscribe(self.relation.relation_id, self.startup.company_id)
+        Subscription.subscribe(self.relation.relation_id, startups[2].company_id)
+        missing_id = startups[2].company_id + 100
+
+        response = self._batch(subscribe=[startups[0].company_id, startups[1].company_id, startups[0].company_id,
+                                          self.startup.company_id, missing_id],
+                               unsubscribe=[startups[2].company_id, missing_id + 1])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'subscribed': [startups[0].company_id, startups[1].company_id],
+                                         'already_subscribed': [self.startup.company_id],
+                                         'not_found': [missing_id],
+                                         'unsubscribed': [startups[2].company_id],
+                                         'not_subscribed': [missing_id + 1]})
+        self.assertEqual(sorted(Subscription.get_subscriptions(investor=self.relation).values_list('company_id',
+                                                                                                   flat=True)),
+                         sorted([self.startup.company_id, startups[0].company_id, startups[1].company_id]))
+        self.assertTrue(Subscription.objects.filter(subscription_id=subscribed_id).exists())
+        create_subscription_notifications.delay.assert_called_once_with(
+            self.relation.relation_id, [startups[0].company_id, startups[1].company_id])
+
+    @patch('companies.views.create_subscription_notifications')
+    def test_batch_queries_do_not_grow_with_batch_size(self, create_subscription_notifications):
+        startups = Company.objects.bulk_create(Company(brand=f'startup{i}', is_startup=True) for i in range(20))
+        ids = [startup.company_id for startup in startups]
+        self._batch(subscribe=ids[:1])
+        counts = []
+        for chunk in (ids[1:2], ids[2:]):
+            with CaptureQueriesContext(connection) as queries:
+                response = self._batch(subscribe=chunk, unsubscribe=ids[:1])
+            self.assertEqual(response.status_code, 200)
+            counts.append(len(queries))
+            Subscription.subscribe(self.relation.relation_id, ids[0])
+        self.assertEqual(counts[0], counts[1])
+
+    def test_batch_validation(self):
+        self.assertEqual(self._batch().status_code, 400)
+        self.assertEqual(self._batch(subscribe=[1], unsubscribe=[1]).status_code, 400)
+        self.assertEqual(self._batch(subscribe=list(range(1, 102))).status_code, 400)
+        self.assertEqual(self._batch(subscribe=['x']).status_code, 400)
+
+
+class CompanyCountersTest(APITestCase):
+
+    def setUp(self):
+        self.redis = use_fake_redis(self)
+        cache.clear()
+        self.user = CustomUser.objects.create_user('counted@mail.com', 'Test_password123456')
+        self.investor = Company.objects.create(brand='Investor', is_startup=False)
+        self.relation = CompanyAndUserRelation.objects.create(user_id=self.user, company_id=self.investor)
+        self.startup = Company.objects.create(brand='Startup', is_startup=True)
+        self.company_id = self.startup.company_id
+        am.db.delete_many({'company_id': self.company_id})
+
+    def _counters(self):
+        return CompanyCounters.get(self.company_id)
+
+    def test_subscriptions_are_counted_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            subscription_id, _ = Subscription.subscribe(self.relation.relation_id, self.company_id)
+            Subscription.subscribe(self.relation.relation_id, self.company_id)
+            self.assertEqual(self._counters()['followers'], 0)
+        self.assertEqual(self._counters()['followers'], 1)
+
+        other = CompanyAndUserRelation.objects.create(
+            user_id=CustomUser.objects.create_user('other@mail.com', 'Test_password123456'), company_id=self.investor)
+        with self.captureOnCommitCallbacks(execute=True):
+            Subscription.objects.create(investor=other, company=self.startup, get_email_newsletter=True)
+        self.assertEqual(self._counters(), {'followers': 2, 'newsletter_subscribers': 1, 'articles': 0})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Subscription.unsubscribe(self.relation.relation_id, subscription_id)
+            other.delete()
+        self.assertEqual(self._counters(), {'followers': 0, 'newsletter_subscribers': 0, 'articles': 0})
+
+    def test_rolled_back_subscription_is_not_counted(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(IntegrityError), transaction.atomic():
+                Subscription.subscribe_to_companies(self.relation.relation_id, [self.company_id])
+                raise IntegrityError
+        self.assertEqual(self._counters()['followers'], 0)
+
+    def test_articles_are_counted(self):
+        articles = [am.add_article({'company_id': self.company_id, 'relation': 1, 'article_title': f'title{i}',
+                                    'article_text': 'text', 'article_tags': 'tags'}) for i in range(3)]
+        am.delete_article(self.company_id, articles[0]['article_id'])
+        am.delete_article(self.company_id, articles[0]['article_id'])
+        self.assertEqual(self._counters()['articles'], 2)
+
+    def test_counters_are_sharded(self):
+        CompanyCounters.add({self.company_id: {'followers': 1}})
+        with patch('authentication.counters.random.randrange', side_effect=range(CompanyCounters.shards)):
+            for _ in range(CompanyCounters.shards):
+                CompanyCounters.add({self.company_id: {'followers': 1}})
+        self.assertEqual(len(self.redis.keys(f'{CompanyCounters.key_prefix}:{self.company_id}:*')),
+                         CompanyCounters.shards)
+        self.assertEqual(self._counters()['followers'], CompanyCounters.shards + 1)
+
+    def test_reconcile_fixes_counters(self):
+        Subscription.subscribe(self.relation.relation_id, self.company_id)
+        am.add_article({'company_id': self.company_id, 'relation': 1, 'article_title': 'title',
+                        'article_text': 'text', 'article_tags': 'tags'})
+        CompanyCounters.add({self.company_id: {'followers': 5, 'newsletter_subscribers': 2}})
+        CompanyCounters.add({self.investor.company_id: {'articles': 3}})
+
+        reconcile_company_counters(batch_size=1)
+
+        self.assertEqual(self._counters(), {'followers': 1, 'newsletter_subscribers': 0, 'articles': 1})
+        self.assertEqual(CompanyCounters.get(self.investor.company_id),
+                         {'followers': 0, 'newsletter_subscribers': 0, 'articles': 0})
+
+    def test_detail_shows_current_counters(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {TokenManager.generate_access_token_for_user(self.user)}')
+        url = f'{FRONTEND_URL}/companies/get_company/{self.company_id}/'
+        first = self.client.get(url)
+        self.assertEqual(first.data['counters'], {'followers': 0, 'newsletter_subscribers': 0, 'articles': 0})
+        self.assertEqual(self.startup.get_info()['counters'], first.data['counters'])
+
+        CompanyCounters.add({self.company_id: {'followers': 1}})
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['counters']['followers'], 1)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+
+
+class DeferredRevisionTest(APITestCase):
+
+    def setUp(self):
+        self.redis = use_fake_redis(self)
+        self.user = CustomUser.objects.create_user('revised@mail.com', 'Test_password123456')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {TokenManager.generate_access_token_for_user(self.user)}')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.company_id = self.client.post(f'{FRONTEND_URL}/companies/', {'brand': 'v0'},
+                                               format='json').data['company_id']
+        self.company = Company.objects.get(company_id=self.company_id)
+        CompanyAndUserRelation.objects.create(company_id=self.company, user_id=self.user)
+        self.url = f'{FRONTEND_URL}/companies/{self.company_id}/'
+
+    def _update(self, brand):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(self.url, {'brand': brand}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def _history(self):
+        return [version.field_dict['brand'] for version in Version.objects.get_for_object(self.company)]
+
+    def test_versions_are_written_by_flush(self):
+        self._update('v1')
+        self._update('v2')
+        self.assertFalse(Version.objects.exists())
+        self.assertEqual(self.redis.llen(DeferredRevisions.key), 3)
+
+        self.assertEqual(DeferredRevisions.flush(), 3)
+        self.assertEqual(self._history(), ['v2', 'v1', 'v0'])
+        self.assertEqual(Revision.objects.filter(user=self.user).count(), 3)
+        response = self.client.get(f'{self.url}instance_logs/')
+        self.assertEqual([log['instance']['brand'] for log in response.data], ['v1', 'v0'])
+        self.assertEqual(response.data[0]['updated_by'], self.user.email)
+
+    def test_outdated_record_is_dropped(self):
+        self._update('v1')
+        self._update('v2')
+        queued = self.redis.lrange(DeferredRevisions.key, 0, -1)
+        self.redis.delete(DeferredRevisions.key)
+        # the v1 record is pushed after v2 was written
+        self.redis.rpush(DeferredRevisions.key, *queued[:1], queued[2])
+        DeferredRevisions.flush()
+        self.redis.rpush(DeferredRevisions.key, queued[1])
+        self.assertEqual(DeferredRevisions.flush(), 0)
+        self.assertEqual(self._history(), ['v2', 'v0'])
+
+    def test_replayed_batch_is_not_written_twice(self):
+        self._update('v1')
+        queued = self.redis.lrange(DeferredRevisions.key, 0, -1)
+        DeferredRevisions.flush()
+        # the flush died after the versions were committed, before their sequence numbers were stored
+        self.redis.rpush(DeferredRevisions.processing_key, *queued)
+        self.redis.delete(DeferredRevisions.written_key, DeferredRevisions.written_at_key)
+
+        self.assertEqual(DeferredRevisions.flush(), 0)
+        self.assertEqual(self._history(), ['v1', 'v0'])
+        self.assertEqual(Revision.objects.count(), 2)
+
+    def test_written_sequence_numbers_expire(self):
+        self._update('v1')
+        DeferredRevisions.flush()
+        self.assertEqual(self.redis.hlen(DeferredRevisions.written_key), 1)
+        with patch('revision.deferred.time.time', return_value=time.time() + DeferredRevisions.max_lag + 1):
+            DeferredRevisions.flush()
+        self.assertEqual(self.redis.hlen(DeferredRevisions.written_key), 0)
+        self.assertEqual(self.redis.zcard(DeferredRevisions.written_at_key), 0)
+
+    def test_error_response_rolls_back_request(self):
+        @create_deferred_revision(request_creates_revision=lambda request: True)
+        def view(request):
+            self.company.brand = 'partial'
+            self.company.save()
+            return HttpResponse(status=400)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(view(RequestFactory().patch(self.url)).status_code, 400)
+        self.assertEqual(Company.objects.get(company_id=self.company_id).brand, 'v0')
+        self.assertEqual(self.redis.llen(DeferredRevisions.key), 1)
+
+    def test_bad_record_is_moved_to_dead_letters(self):
+        self._update('v1')
+        bad = dict(json.loads(self.redis.lindex(DeferredRevisions.key, -1)), content_type_id=0, seq=10 ** 9)
+        self.redis.rpush(DeferredRevisions.key, json.dumps(bad))
+        self._update('v2')
+
+        self.assertEqual(DeferredRevisions.flush(), 3)
+        self.assertEqual(self._history(), ['v2', 'v1', 'v0'])
+        self.assertEqual([json.loads(record) for record in self.redis.lrange(DeferredRevisions.dead_key, 0, -1)],
+                         [bad])
+        self.assertEqual(self.redis.llen(DeferredRevisions.processing_key), 0)
+
+    def test_rolled_back_revision_is_not_queued(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(ValueError), deferred_revision():
+                self.company.brand = 'rolled back'
+                self.company.save()
+                raise ValueError
+        self.assertEqual(self.redis.llen(DeferredRevisions.key), 1)
+
+    def test_revisions_are_written_without_redis(self):
+        DeferredRevisions.flush()
+        with patch.object(self.redis, 'rpush', side_effect=RedisConnectionError):
+            self._update('v1')
+        self.assertEqual(self._history(), ['v1', 'v0'])
+
+
 class CompanyTestUnauthenticatedUser(APITestCase):
 
     def test_negative_unauthenticated_user(self):
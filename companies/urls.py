@@ -12,8 +12,9 @@ urlpatterns = [
     path('subscribe/<int:pk>/', views.SubscriptionCreateAPIView.as_view(), name='subscription-create'),
     path('unsubscribe/<int:subscription_id>/', views.UnsubscribeAPIView.as_view(), name='unsubscribe'),
     path('subscriptions/', views.SubscriptionListView.as_view(), name='subscriptionsList'),
+    path('subscriptions/batch/', views.SubscriptionBatchView.as_view(), name='subscriptions-batch'),
     path('create_article/', views.CreateArticle.as_view(), name='create_article'),
-    path('get_article/<int:pk>/<int:page>/', views.RetrieveArticles.as_view(), name='get_article'),
+    path('get_article/<int:pk>/', views.RetrieveArticles.as_view(), name='get_article'),
     path('delete_article/<str:art_id>/', views.DeleteArticle.as_view(), name='delete_article'),
     path('update_article/<str:art_id>/', views.UpdateArticle.as_view(), name='update_article'),
 ]
@@ -1,22 +1,32 @@
+from django.conf import settings
+from django.db import transaction
+from django.utils.http import parse_etags
 from django_filters.rest_framework import DjangoFilterBackend
 from pydantic import ValidationError as PydanticValidationError
 from rest_framework import status, viewsets
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from authentication.counters import CompanyCounters
 from authentication.models import Company
 from authentication.permissions import (IsAuthenticated, IsFounder, IsInvestor,
                                         IsRelatedToCompany, IsStartup)
 from forum.errors import Error as er
+from forum.pagination import KeysetPaginator
+from forum.streaming import JSONStreamingResponse, is_streaming_requested
 from notifications.decorators import create_notification_from_view
 from notifications.manager import SUBSCRIPTION, UPDATE
+from notifications.tasks import create_subscription_notifications
 from revision.views import CustomRevisionMixin
 
-from .managers import LIMIT
+from .cache import CompanyDetailCache
 from .managers import ArticlesManager as am
 from .models import Subscription
 from .permissions import EditCompanyPermission
-from .serializers import CompaniesSerializer, SubscriptionSerializer
+from .serializers import (CompaniesSerializer, CompanySummarySerializer,
+                          SubscriptionBatchSerializer)
+
+STREAM_CHUNK_SIZE = getattr(settings, 'STREAMING_RESPONSE', {}).get('CHUNK_SIZE', 2000)
 
 
 class CompaniesViewSet(CustomRevisionMixin, viewsets.ModelViewSet):
@@ -24,92 +34,141 @@ class CompaniesViewSet(CustomRevisionMixin, viewsets.ModelViewSet):
     serializer_class = CompaniesSerializer
     permission_classes = (EditCompanyPermission, IsAuthenticated)
 
+    def get_queryset(self):
+        if self.action == 'list':
+            return Company.get_companies_summary()
+        return super().get_queryset()
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return CompanySummarySerializer
+        return super().get_serializer_class()
+
 
 class CompanyRetrieveView(APIView):
+    """
+    Company detail served from the CompanyDetailCache with the current company counters. Responses carry a strong
+    ETag of the company version and counters; a request with a matching If-None-Match gets 304 Not Modified
+    without a database query.
+    """
     permission_classes = (IsAuthenticated,)
 
     def get(self, request, pk=None):
         if not pk:
             return er.NO_CREDENTIALS.response()
+        version = CompanyDetailCache.get_version(pk)
+        counters = CompanyCounters.get(pk)
+        if_none_match = set(parse_etags(request.headers.get('If-None-Match', '')))
+        # a version exists only for companies that were loaded, so a matching ETag needs no database query
+        etag = CompanyDetailCache.make_etag(pk, version, counters) if version is not None else None
+        if etag in if_none_match:
+            CompanyDetailCache.record_view(pk)
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
         try:
-            company = Company.get_company(company_id=pk)
-            return Response(company.get_info(), status=status.HTTP_200_OK)
+            version, payload = CompanyDetailCache.get(pk, version)
         except Company.DoesNotExist:
             return er.NO_COMPANY_FOUND.response()
+        CompanyDetailCache.record_view(pk)
+        headers = {'ETag': CompanyDetailCache.make_etag(pk, version, counters)} if version is not None else None
+        # '*' matches only once the company is known to exist
+        if '*' in if_none_match:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return Response(dict(payload, counters=counters), status=status.HTTP_200_OK, headers=headers)
 
 
 class CompaniesRetrieveView(APIView):
+    """
+    Lists companies info page by page. With ?stream=true all companies are sent as a single JSON array,
+    streamed from a server-side cursor.
+    """
     permission_classes = (IsAuthenticated,)
 
     def get(self, request):
         company_type = request.query_params.get('company_type')
-        if not company_type:
-            companies = Company.get_all_companies_info()
-        else:
-            companies = Company.get_all_companies_info(company_type)
-
+        if is_streaming_requested(request):
+            return JSONStreamingResponse(Company.iter_all_companies_info(company_type, chunk_size=STREAM_CHUNK_SIZE))
+        companies = Company.get_all_companies_info(company_type, cursor=request.query_params.get('cursor'),
+                                                   limit=request.query_params.get('limit'))
         return Response(companies, status=status.HTTP_200_OK)
 
 
 class SubscriptionCreateAPIView(APIView):
+    """
+    Subscribes the investor to the company. Idempotent: a repeated request returns the same subscription with
+    200 instead of 201, and only a newly created subscription notifies the company.
+    """
     permission_classes = (IsAuthenticated, IsRelatedToCompany, IsInvestor)
 
     @create_notification_from_view(type=SUBSCRIPTION)
     def post(self, request, pk=None):
         if not pk:
             return er.NO_COMPANY_ID.response()
-        profile_id = request.user.relation_id
-        company_id = pk
-        try:
-            check_sub = Subscription.get_subscription(
-                investor=profile_id, company=company_id)
-            msg = f"You're already subscribed to {check_sub.company.brand}."
-            return Response({'message': msg}, status=status.HTTP_302_FOUND)
-        except Subscription.DoesNotExist:
-            data = {'investor': profile_id,
-                    'company': company_id}
-            serializer = SubscriptionSerializer(data=data)
-            if serializer.is_valid():
-                res = serializer.save()
-                msg = f"You're successfully subscribed to {res.company.brand}"
-                return Response({'message': msg, 'subscription_id': res.subscription_id, 'company_id': company_id},
-                                status=status.HTTP_201_CREATED)
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        result = Subscription.subscribe(request.user.relation_id, pk)
+        if result is None:
+            return er.NO_COMPANY_FOUND.response()
+        subscription_id, created = result
+        msg = "You're successfully subscribed" if created else "You're already subscribed"
+        return Response({'message': msg, 'subscription_id': subscription_id, 'company_id': pk},
+                        status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
 
 
 class UnsubscribeAPIView(APIView):
     permission_classes = (IsAuthenticated, IsRelatedToCompany, IsInvestor)
 
     def delete(self, request, subscription_id):
-        try:
-            subscription = Subscription.get_subscription(
-                subscription_id=subscription_id)
-        except Subscription.DoesNotExist:
+        company_id = Subscription.unsubscribe(request.user.relation_id, subscription_id)
+        if company_id is None:
             return er.SUBSCRIPTION_NOT_FOUND.response()
-        company_id = subscription.company.company_id
-        subscription.delete()
         return Response({'message': 'Successfully unsubscribed', 'company_id': company_id}, status=status.HTTP_200_OK)
 
 
+class SubscriptionBatchView(APIView):
+    """
+    Subscribes the investor to and unsubscribes from up to SUBSCRIPTION_BATCH['MAX_SIZE'] companies at once:
+    {"subscribe": [company ids], "unsubscribe": [company ids]}. New subscriptions of the whole batch are
+    notified by a single background task.
+    """
+    permission_classes = (IsAuthenticated, IsRelatedToCompany, IsInvestor)
+
+    def post(self, request):
+        serializer = SubscriptionBatchSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        investor_id = request.user.relation_id
+        with transaction.atomic():
+            subscribed, already_subscribed, not_found = Subscription.subscribe_to_companies(
+                investor_id, serializer.validated_data['subscribe'])
+            unsubscribed = Subscription.unsubscribe_from_companies(investor_id,
+                                                                   serializer.validated_data['unsubscribe'])
+        if subscribed:
+            transaction.on_commit(lambda: create_subscription_notifications.delay(investor_id, subscribed))
+        not_subscribed = [company_id for company_id in serializer.validated_data['unsubscribe']
+                          if company_id not in unsubscribed]
+        return Response({'subscribed': subscribed, 'already_subscribed': already_subscribed, 'not_found': not_found,
+                         'unsubscribed': unsubscribed, 'not_subscribed': not_subscribed},
+                        status=status.HTTP_200_OK)
+
+
 class SubscriptionListView(APIView):
+    """Lists the investor's subscriptions newest first, each page read by a single query joined with companies."""
     permission_classes = (IsAuthenticated, IsRelatedToCompany)
+    paginator = KeysetPaginator(('-subscription_id',))
 
     def get(self, request):
-        profile_id = request.user.relation_id
-        subs = Subscription.get_subscriptions(investor=profile_id)
-        if not subs:
-            return Response({'message': "You have no subsriptions yet!"}, status=status.HTTP_200_OK)
-        data = [sub.get_info() for sub in subs]
-        return Response({'subscriptions': data}, status=status.HTTP_200_OK)
+        subs = Subscription.get_subscriptions_info(request.user.relation_id)
+        page = self.paginator.paginate_queryset(subs, request.query_params.get('cursor'),
+                                                request.query_params.get('limit'))
+        page['results'] = [Subscription.make_info(values) for values in page['results']]
+        return Response(page, status=status.HTTP_200_OK)
 
 
 class RetrieveArticles(APIView):
     # do we need to block access to the articles for an unauthorized viewers?
-    def get(self, request, pk=None, page=None):
-        if not pk or not page:
-            return Response({'error': "No company id or page was provided"}, status=status.HTTP_400_BAD_REQUEST)
-        skip = LIMIT * (page - 1)
-        articles = am.get_articles_for_company(pk, skip=skip, projection=['articles'])
+    def get(self, request, pk=None):
+        if not pk:
+            return Response({'error': "No company id was provided"}, status=status.HTTP_400_BAD_REQUEST)
+        articles = am.get_articles_for_company(pk, cursor=request.query_params.get('cursor'),
+                                               limit=request.query_params.get('limit'))
         return Response(articles, status=status.HTTP_200_OK)
 
 
@@ -1,5 +1,7 @@
+import gc
 import os
 
+import zxcvbn  # pylint: disable=unused-import
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.security.websocket import AllowedHostsOriginValidator
 from django.core.asgi import get_asgi_application
@@ -16,3 +18,6 @@ application = ProtocolTypeRouter({
         JWTAuthMiddleware(URLRouter(routing.websocket_urlpatterns))
     )
 })
+
+# see forum.wsgi
+gc.freeze()
@@ -101,3 +101,11 @@ class Error:
         msg = "Company ID required"
         status = status.HTTP_400_BAD_REQUEST
 
+    class HASHING_SERVICE_UNAVAILABLE(BaseError):
+        msg = "Server is busy, try again later"
+        status = status.HTTP_503_SERVICE_UNAVAILABLE
+
+    class PASSWORD_STRENGTH_UNAVAILABLE(BaseError):
+        msg = "Password strength can't be checked now, try again later"
+        status = status.HTTP_503_SERVICE_UNAVAILABLE
+
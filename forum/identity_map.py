@@ -0,0 +1,87 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+_current = ContextVar('identity_map', default=None)
+
+
+class IdentityMap:
+    """
+    Request-scoped map of model instances loaded by the get_user/get_company/get_relation classmethods.
+
+    Within a request a repeated lookup with the same arguments, or by the primary key of an already loaded
+    instance, returns the same instance without a query. Saved and deleted models drop their instances through
+    post_save/post_delete signals (see authentication.signals); bulk updates bypass signals and aren't seen.
+    Outside of a request (celery tasks, shell) lookups always go to the database.
+    """
+
+    def __init__(self):
+        self.instances = {}
+        self.saved_queries = 0
+
+    @classmethod
+    def current(cls):
+        return _current.get()
+
+    @staticmethod
+    def make_key(model, lookup):
+        pk_name = model._meta.pk.name
+        return model, tuple(sorted((pk_name if name == 'pk' else name, value) for name, value in lookup.items()))
+
+    @classmethod
+    def get(cls, model, **lookup):
+        """Returns model.objects.get(**lookup), served from the map of the current request when possible."""
+
+        identity_map = cls.current()
+        if identity_map is None:
+            return model.objects.get(**lookup)
+        try:
+            key = cls.make_key(model, lookup)
+            instance = identity_map.instances.get(key)
+        except TypeError:
+            # unhashable lookup values
+            return model.objects.get(**lookup)
+        if instance is not None:
+            identity_map.saved_queries += 1
+            return instance
+        instance = model.objects.get(**lookup)
+        identity_map.instances[key] = instance
+        identity_map.instances[cls.make_key(model, {'pk': instance.pk})] = instance
+        return instance
+
+    @classmethod
+    def discard(cls, model):
+        """Drops all instances of the model from the map of the current request."""
+
+        identity_map = cls.current()
+        if identity_map is not None:
+            identity_map.instances = {key: instance for key, instance in identity_map.instances.items()
+                                      if key[0] is not model}
+
+
+@contextmanager
+def identity_map():
+    """Activates a new identity map for the enclosed block and yields it."""
+
+    token = _current.set(IdentityMap())
+    try:
+        yield _current.get()
+    finally:
+        _current.reset(token)
+
+
+class IdentityMapMiddleware:
+    """Gives every request its own identity map. In DEBUG, the number of saved queries is sent in a header."""
+
+    header = 'X-Identity-Map-Saved-Queries'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with identity_map() as current:
+            response = self.get_response(request)
+        if settings.DEBUG:
+            response[self.header] = current.saved_queries
+        return response
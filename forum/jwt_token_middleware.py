@@ -1,49 +1,70 @@
+import hashlib
 import logging
+import time
 
 from channels.auth import AuthMiddlewareStack
 from channels.db import database_sync_to_async
 from django.conf import settings
-from django.db import close_old_connections
+from jwt import InvalidTokenError
 from jwt import decode as jwt_decode
-from rest_framework import status
-from rest_framework.response import Response
 
+from authentication.cache import LRUCache
 from authentication.models import CustomUser
 
+WEBSOCKET_AUTH_CACHE = getattr(settings, 'WEBSOCKET_AUTH_CACHE', {})
+
+logger = logging.getLogger('websocket_jwt_error')
+
 
 class JWTAuthMiddleware:
-    """ Checking JWT token for the user"""
+    """
+    Checking JWT token for the user.
+    Handshakes with a missing, malformed or invalid token are closed with close_code before any database work.
+    Users of verified tokens are cached for a short time, so reconnect storms don't reach the database.
+    """
+    close_code = 4401
+    users = LRUCache(maxsize=WEBSOCKET_AUTH_CACHE.get('MAXSIZE', 10000), ttl=WEBSOCKET_AUTH_CACHE.get('TTL', 30))
 
     def __init__(self, app):
         self.app = app
 
     async def __call__(self, scope, receive, send):
-        close_old_connections()
         try:
-            headers = dict(scope['headers'])
-            token_header = headers.get(b'authorization', b'').decode("utf-8")
-            if not token_header.startswith("Bearer "):
-                raise ValueError(f"Invalid Authorization header format {token_header}")
-            jwt_token = token_header.split("Bearer ")[-1]
-            if jwt_token:
-                jwt_payload = self.get_payload(jwt_token)
-                user_credentials = self.get_user_credentials(jwt_payload)
-                user = await self.get_logged_in_user(user_credentials)
-                scope['user'] = user
-            else:
-                logger = logging.getLogger('websocket_jwt_error')
-                logger.error("Troubles with provided jwt token")
-                return Response({'error': "Troubles with provided jwt token"}, status=status.HTTP_400_BAD_REQUEST)
-        except Exception as e:
-            logger = logging.getLogger('websocket_jwt_error')
+            jwt_token = self.get_token(scope)
+            jwt_payload = self.get_payload(jwt_token)
+            user_id = self.get_user_credentials(jwt_payload)
+        except (ValueError, InvalidTokenError) as e:
             logger.error(e)
-            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
-        return await self.app(scope, receive, send)
+            return await self.reject(receive, send)
+
+        user = await self.get_logged_in_user(jwt_token, jwt_payload, user_id)
+        if user is None:
+            logger.error(f"Wrong user id {user_id}")
+            return await self.reject(receive, send)
+        return await self.app(dict(scope, user=user), receive, send)
+
+    async def reject(self, receive, send):
+        """Consumes the handshake and closes the socket without accepting it."""
+
+        message = await receive()
+        if message['type'] == 'websocket.connect':
+            await send({'type': 'websocket.close', 'code': self.close_code})
+
+    def get_token(self, scope):
+        headers = dict(scope['headers'])
+        token_header = headers.get(b'authorization', b'').decode("utf-8")
+        if not token_header.startswith("Bearer "):
+            raise ValueError(f"Invalid Authorization header format {token_header}")
+        jwt_token = token_header.split("Bearer ")[-1]
+        if not jwt_token:
+            raise ValueError("Troubles with provided jwt token")
+        return jwt_token
 
     def get_payload(self, jwt_token):
         payload = jwt_decode(
             jwt_token, settings.SECRET_KEY, algorithms=["HS256"])
-
+        if payload.get('token_type') != 'access':
+            raise ValueError("Only access tokens are accepted")
         return payload
 
     def get_user_credentials(self, payload):
@@ -56,8 +77,15 @@ class JWTAuthMiddleware:
             raise ValueError("user_id is missing in JWT payload")
         return user_id
 
-    async def get_logged_in_user(self, user_id):
-        user = await self.get_user(user_id)
+    async def get_logged_in_user(self, jwt_token, payload, user_id):
+        key = hashlib.sha256(jwt_token.encode()).hexdigest()
+        user = self.users.get(key)
+        if user is None:
+            user = await self.get_user(user_id)
+            if user is not None:
+                # a cached user must not outlive its token
+                ttl = min(self.users.ttl, max(payload.get('exp', 0) - time.time(), 0))
+                self.users.set(key, user, ttl=ttl)
         return user
 
     @database_sync_to_async
@@ -65,7 +93,7 @@ class JWTAuthMiddleware:
         try:
             return CustomUser.objects.get(user_id=user_id)
         except CustomUser.DoesNotExist:
-            return Response({'error': "Wrong user id"}, status=status.HTTP_400_BAD_REQUEST)
+            return None
 
 
 def JWTAuthMiddlewareStack(app):
@@ -6,9 +6,12 @@ from pydantic import BaseModel, ValidationError
 from pymongo.errors import PyMongoError
 from rest_framework_simplejwt.exceptions import (AuthenticationFailed,
                                                  TokenError)
-from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+from rest_framework_simplejwt.tokens import AccessToken
 
+from authentication.cache import VerifiedTokenCache
 from authentication.models import CustomUser
+from authentication.principals import COMPANY_CLAIMS_CLAIM
+from authentication.revocation import FilteredRefreshToken
 
 from .errors import Error
 from .settings import EMAIL_HOST, EMAIL_HOST_USER
@@ -24,10 +27,10 @@ class TokenManager:
         return access_token
 
     @classmethod
-    def generate_refresh_token_for_user(cls, user: CustomUser) -> RefreshToken:
+    def generate_refresh_token_for_user(cls, user: CustomUser) -> FilteredRefreshToken:
         """Generates token for user"""
 
-        refresh_token = RefreshToken.for_user(user)
+        refresh_token = FilteredRefreshToken.for_user(user)
         return refresh_token
 
     @classmethod
@@ -37,8 +40,13 @@ class TokenManager:
         return str(decoded_token)
 
     @classmethod
-    def generate_company_related_token(cls, company_id: int, token=None):
-        return cls.generate_token_with_payload({'company_id': company_id}, token)
+    def generate_company_related_token(cls, company_id: int, token=None, claims=None):
+        """Generates token bound to the company. Optional company claims are embedded into the token as is."""
+
+        payload = {'company_id': company_id}
+        if claims is not None:
+            payload[COMPANY_CLAIMS_CLAIM] = claims
+        return cls.generate_token_with_payload(payload, token)
 
     @classmethod
     def get_access_payload(cls, token: str) -> dict:
@@ -56,20 +64,20 @@ class TokenManager:
 
     @classmethod
     def __get_decoded_access_token(cls, token) -> AccessToken:
-        """Returns decoded token as Dict"""
+        """Returns decoded token as Dict. Verified tokens are taken from the VerifiedTokenCache."""
 
         try:
-            decoded_token = AccessToken(token)
+            decoded_token = VerifiedTokenCache.get_token(token, AccessToken)
         except TokenError:
             raise AuthenticationFailed(detail=Error.INVALID_TOKEN.msg)
         return decoded_token
 
     @classmethod
-    def __get_decoded_refresh_token(cls, token) -> tuple[RefreshToken, AccessToken]:
+    def __get_decoded_refresh_token(cls, token) -> tuple[FilteredRefreshToken, AccessToken]:
         """Returns tuple with decoded tokens as Dict"""
 
         try:
-            decoded_token = RefreshToken(token)
+            decoded_token = FilteredRefreshToken(token)
             decoded_access_token = decoded_token.access_token
         except TokenError:
             raise AuthenticationFailed(detail=Error.INVALID_TOKEN.msg)
@@ -132,6 +140,19 @@ class MongoManager:
         documents = cls.db.find(query, **kwargs).sort(*sort_options)
         return cls.to_list(documents)
 
+    @classmethod
+    def iter_documents(cls, query, batch_size=1000, **kwargs):
+        """Yields the documents matching the query, fetching them from the server in batches of batch_size."""
+        for document in cls.db.find(query, **kwargs).batch_size(batch_size):
+            yield cls.id_to_string(document)
+
+    @classmethod
+    def paginate(cls, query, paginator, cursor=None, limit=None, **kwargs):
+        """Retrieves a page of the documents matching the query, see forum.pagination.KeysetPaginator."""
+        page = paginator.paginate_collection(cls.db, query, cursor, limit, **kwargs)
+        page['results'] = cls.to_list(page['results'])
+        return page
+
     @classmethod
     def create_document(cls, data, key) -> str | None:
         """Creates document. Key is needed to use proper model for validation."""
@@ -0,0 +1,176 @@
+from datetime import date, datetime
+
+from bson import ObjectId
+from django.conf import settings
+from django.core import signing
+from django.db.models import Q
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+
+PAGINATION = getattr(settings, 'PAGINATION', {})
+
+
+class InvalidCursor(APIException):
+    status_code = status.HTTP_400_BAD_REQUEST
+    default_detail = "Cursor is invalid"
+    default_code = 'invalid_cursor'
+
+
+class KeysetPaginator:
+    """
+    Keyset (seek) pagination of Django querysets and MongoDB collections and aggregation pipelines.
+
+    Rows are sorted by `ordering` (field names, '-' for descending), which has to end with a unique field, so the
+    order is total. A page is selected by a condition on the sort key of the last row of the previous page rather
+    than by an offset, so with an index on the ordering every page costs as much as the first one.
+    The cursor is that sort key together with the ordering, signed with SECRET_KEY: clients can't forge it, and
+    a cursor of another ordering is rejected. Sort fields must not be null and must be present in the rows.
+
+    Pages are returned as {'results': rows, 'next': cursor of the next page or None}.
+    """
+    salt = 'forum.pagination'
+    page_size = PAGINATION.get('PAGE_SIZE', 20)
+    max_page_size = PAGINATION.get('MAX_PAGE_SIZE', 100)
+
+    def __init__(self, ordering, page_size=None, max_page_size=None):
+        self.ordering = list(ordering)
+        self.fields = [(name.lstrip('-'), name.startswith('-')) for name in self.ordering]
+        if page_size is not None:
+            self.page_size = page_size
+        if max_page_size is not None:
+            self.max_page_size = max_page_size
+
+    def get_limit(self, limit=None):
+        """Returns the page size for the requested limit; invalid limits fall back to the default page size."""
+
+        try:
+            limit = int(limit)
+        except (TypeError, ValueError):
+            return self.page_size
+        return min(max(limit, 1), self.max_page_size)
+
+    @staticmethod
+    def _dump(value):
+        if isinstance(value, ObjectId):
+            return {'$oid': str(value)}
+        if isinstance(value, datetime):
+            return {'$datetime': value.isoformat()}
+        if isinstance(value, date):
+            return {'$date': value.isoformat()}
+        return value
+
+    @staticmethod
+    def _load(value):
+        if isinstance(value, dict):
+            if '$oid' in value:
+                return ObjectId(value['$oid'])
+            if '$datetime' in value:
+                return datetime.fromisoformat(value['$datetime'])
+            if '$date' in value:
+                return date.fromisoformat(value['$date'])
+        return value
+
+    @staticmethod
+    def get_value(row, name):
+        if not isinstance(row, dict):
+            return getattr(row, name)
+        for part in name.split('.'):
+            row = row[part]
+        return row
+
+    def make_cursor(self, row):
+        """Returns the cursor of the page that follows the row (a model instance or a dict)."""
+
+        values = [self._dump(self.get_value(row, name)) for name, _ in self.fields]
+        return signing.dumps({'ordering': self.ordering, 'values': values}, salt=self.salt, compress=True)
+
+    def read_cursor(self, cursor):
+        """Returns the sort key stored in the cursor. Raises InvalidCursor for a tampered or foreign cursor."""
+
+        try:
+            data = signing.loads(cursor, salt=self.salt)
+            if data['ordering'] != self.ordering or len(data['values']) != len(self.fields):
+                raise InvalidCursor()
+            return [self._load(value) for value in data['values']]
+        except (signing.BadSignature, KeyError, TypeError, ValueError):
+            raise InvalidCursor()
+
+    def get_page(self, rows, limit):
+        """Makes a page of up to limit + 1 fetched rows; the extra row only tells that there is a next page."""
+
+        next_cursor = self.make_cursor(rows[limit - 1]) if len(rows) > limit else None
+        return {'results': rows[:limit], 'next': next_cursor}
+
+    def get_condition(self, values):
+        """Returns the Q of rows that follow the sort key: a > x or (a = x and (b > y or (b = y and ...)))."""
+
+        condition = None
+        for (name, descending), value in reversed(list(zip(self.fields, values))):
+            following = Q(**{f"{name}__{'lt' if descending else 'gt'}": value})
+            condition = following if condition is None else following | Q(**{name: value}) & condition
+        return condition
+
+    def get_mongo_condition(self, values):
+        """Returns the MongoDB filter of documents that follow the sort key."""
+
+        condition = None
+        for (name, descending), value in reversed(list(zip(self.fields, values))):
+            following = {name: {'$lt' if descending else '$gt': value}}
+            condition = following if condition is None else {'$or': [following, {'$and': [{name: value}, condition]}]}
+        return condition
+
+    def get_mongo_sort(self):
+        return [(name, -1 if descending else 1) for name, descending in self.fields]
+
+    def paginate_queryset(self, queryset, cursor=None, limit=None):
+        limit = self.get_limit(limit)
+        queryset = queryset.order_by(*self.ordering)
+        if cursor:
+            queryset = queryset.filter(self.get_condition(self.read_cursor(cursor)))
+        return self.get_page(list(queryset[:limit + 1]), limit)
+
+    def paginate_collection(self, collection, query, cursor=None, limit=None, **kwargs):
+        """Pages documents of the collection matching the query. kwargs are passed to find (e.g. projection)."""
+
+        limit = self.get_limit(limit)
+        if cursor:
+            query = {'$and': [query, self.get_mongo_condition(self.read_cursor(cursor))]}
+        documents = collection.find(query, **kwargs).sort(self.get_mongo_sort()).limit(limit + 1)
+        return self.get_page(list(documents), limit)
+
+    def paginate_pipeline(self, collection, pipeline, cursor=None, limit=None):
+        """Pages documents produced by the aggregation pipeline."""
+
+        limit = self.get_limit(limit)
+        stages = list(pipeline)
+        if cursor:
+            stages.append({'$match': self.get_mongo_condition(self.read_cursor(cursor))})
+        stages += [{'$sort': dict(self.get_mongo_sort())}, {'$limit': limit + 1}]
+        return self.get_page(list(collection.aggregate(stages)), limit)
+
+
+class KeysetPagination(BasePagination):
+    """
+    KeysetPaginator for generic views, configured by the cursor and limit query parameters.
+    The ordering is taken from the queryset (e.g. set by OrderingFilter) and completed with the primary key;
+    querysets without ordering are sorted by `ordering`.
+    """
+    ordering = ('pk',)
+
+    def get_ordering(self, queryset):
+        ordering = [name for name in queryset.query.order_by if isinstance(name, str)] or list(self.ordering)
+        pk_name = queryset.model._meta.pk.name
+        if not {name.lstrip('-') for name in ordering} & {'pk', pk_name}:
+            ordering.append(pk_name)
+        return ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        paginator = KeysetPaginator(self.get_ordering(queryset))
+        self.page = paginator.paginate_queryset(queryset, request.query_params.get('cursor'),
+                                                request.query_params.get('limit'))
+        return self.page['results']
+
+    def get_paginated_response(self, data):
+        return Response({'results': data, 'next': self.page['next']})
@@ -14,6 +14,7 @@ from datetime import timedelta
 from pathlib import Path
 
 import pymongo
+from celery.schedules import crontab
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -46,6 +47,7 @@ INSTALLED_APPS = [
     'rest_framework',
     'rest_framework_swagger',
     'reversion',
+    'revision',
     'authentication',
     'companies',
     'chats',
@@ -72,6 +74,10 @@ SIMPLE_JWT = {
     "USER_ID_FIELD": 'user_id',
     "USER_ID_CLAIM": 'user_id',
     "COMPANY_ID_CLAIM": 'company_id',
+    # company-bound tokens carry relation_id, position, company type and relation version under this claim
+    "COMPANY_CLAIMS_CLAIM": 'company',
+    "EMBED_COMPANY_CLAIMS": False,
+    "TOKEN_REFRESH_SERIALIZER": "authentication.serializers.FilteredTokenRefreshSerializer",
     "TOKEN_USER_CLASS": 'authentication.CustomUser'
 }
 
@@ -120,6 +126,7 @@ MIDDLEWARE = [
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
+    'forum.identity_map.IdentityMapMiddleware',
     # 'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
@@ -164,6 +171,135 @@ DATABASES = {
 
 }
 
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': REDIS_URL,
+        'OPTIONS': {
+            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            # cache outages must degrade to database lookups instead of failing requests
+            'IGNORE_EXCEPTIONS': True,
+        },
+    },
+}
+
+# TIMEOUT - lifetime of a principal in the shared cache, seconds;
+# LOCAL_TTL - lifetime of a principal in the per-process LRU, seconds;
+# LOCAL_MAXSIZE - number of principals kept in the per-process LRU
+PRINCIPAL_CACHE = {
+    'TIMEOUT': 300,
+    'LOCAL_TTL': 5,
+    'LOCAL_MAXSIZE': 1024,
+}
+
+# short-lived cache of users resolved from websocket handshake tokens
+WEBSOCKET_AUTH_CACHE = {
+    'TTL': 30,
+    'MAXSIZE': 10000,
+}
+
+# keyset pagination of list endpoints: default and maximum number of rows per page
+PAGINATION = {
+    'PAGE_SIZE': 20,
+    'MAX_PAGE_SIZE': 100,
+}
+
+# rendered company details: lifetime of a cached payload (seconds) and number of companies warmed up
+COMPANY_DETAIL_CACHE = {
+    'TIMEOUT': 3600,
+    'VERSION_TIMEOUT': 86400,
+    'WARM_UP_LIMIT': 1000,
+}
+
+# follower, newsletter subscriber and article counters of companies: Redis shards per company, and companies
+# recounted per batch by the reconciliation that runs every RECONCILE_INTERVAL seconds
+COMPANY_COUNTERS = {
+    'SHARDS': 8,
+    'RECONCILE_BATCH_SIZE': 1000,
+    'RECONCILE_INTERVAL': 15 * 60,
+}
+
+# revisions of CompaniesViewSet writes are queued after commit and written by a background writer,
+# BATCH_SIZE at a time, as soon as a batch is queued or every FLUSH_INTERVAL seconds; records queued
+# for up to MAX_LAG seconds are still recognized as outdated
+DEFERRED_REVISIONS = {
+    'ENABLED': True,
+    'BATCH_SIZE': 500,
+    'FLUSH_INTERVAL': 10,
+    'LOCK_TIMEOUT': 60,
+    'MAX_LAG': 3600,
+}
+
+# batch subscribe/unsubscribe: maximum number of company ids per list
+SUBSCRIPTION_BATCH = {
+    'MAX_SIZE': 100,
+}
+
+# ?stream=true responses: rows fetched from the database cursor per round trip and bytes written per chunk
+STREAMING_RESPONSE = {
+    'CHUNK_SIZE': 2000,
+    'BUFFER_SIZE': 64 * 1024,
+}
+
+# per-process cache of verified access tokens; entries never outlive the token, TTL caps it further (seconds)
+VERIFIED_TOKEN_CACHE = {
+    'TTL': 300,
+    'MAXSIZE': 10000,
+}
+
+# Bloom filter of revoked refresh tokens, sized for CAPACITY tokens at ERROR_RATE false positives
+REVOCATION_FILTER = {
+    'CAPACITY': 10_000_000,
+    'ERROR_RATE': 0.001,
+    'BATCH_SIZE': 10_000,
+}
+
+# process pool for password hashing; WORKERS = 0 hashes inline on the request worker
+PASSWORD_HASHING = {
+    'WORKERS': int(os.environ.get('PASSWORD_HASHING_WORKERS', 2)),
+    'MAX_PENDING': 32,
+    'TIMEOUT': 10,
+}
+
+# zxcvbn password strength evaluation: input cap (characters), time budget (seconds) and score cache
+PASSWORD_STRENGTH = {
+    'MAX_LENGTH': 24,
+    'TIME_BUDGET': 0.25,
+    'WORKERS': 2,
+    'CACHE_MAXSIZE': 4096,
+    'CACHE_TTL': 3600,
+}
+
+# buffered UserLoginActivity writer: queued events are written in batches of BATCH_SIZE
+# or every FLUSH_INTERVAL seconds; monthly partitions are created PARTITIONS_AHEAD months in advance
+# and dropped after RETENTION_MONTHS
+LOGIN_ACTIVITY = {
+    'BATCH_SIZE': 500,
+    'FLUSH_INTERVAL': 10,
+    'LOCK_TIMEOUT': 60,
+    'PARTITIONS_AHEAD': 2,
+    'RETENTION_MONTHS': 12,
+}
+
+# sliding-window limits of authentication attempts per client IP, per email and per (IP, email) pair;
+# WINDOW is in seconds
+AUTH_THROTTLE = {
+    'login': {
+        'WINDOW': 900,
+        'IP_LIMIT': 100,
+        'EMAIL_LIMIT': 10,
+        'PAIR_LIMIT': 5,
+    },
+    'password_recovery': {
+        'WINDOW': 3600,
+        'IP_LIMIT': 20,
+        'EMAIL_LIMIT': 3,
+        'PAIR_LIMIT': 3,
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -215,6 +351,8 @@ EMAIL_HOST_USER = os.environ.get("EMAIL_HOST_USER")
 EMAIL_HOST_PASSWORD = os.environ.get("EMAIL_HOST_PASSWORD")
 
 CORS_ALLOW_ALL_ORIGINS = True
+# lets browser clients read ETags of cached company details
+CORS_EXPOSE_HEADERS = ['ETag']
 
 # for docker use "hosts": [('redis', 6379)], for local machine "hosts": [('localhost', 6379)]
 CHANNEL_LAYERS = {
@@ -264,3 +402,34 @@ LOGGING = {
 }
 
 CELERY_BROKER_URL = os.environ.get("REDIS_URL")
+
+CELERY_BEAT_SCHEDULE = {
+    'sync-revocation-filter': {
+        'task': 'authentication.tasks.sync_revocation_filter',
+        'schedule': timedelta(minutes=5),
+    },
+    'purge-expired-tokens': {
+        'task': 'authentication.tasks.purge_expired_tokens',
+        'schedule': crontab(hour=3, minute=0),
+    },
+    'flush-login-activity': {
+        'task': 'authentication.tasks.flush_login_activity',
+        'schedule': timedelta(seconds=LOGIN_ACTIVITY['FLUSH_INTERVAL']),
+    },
+    'reconcile-company-counters': {
+        'task': 'companies.tasks.reconcile_company_counters',
+        'schedule': timedelta(seconds=COMPANY_COUNTERS['RECONCILE_INTERVAL']),
+    },
+    'flush-deferred-revisions': {
+        'task': 'revision.tasks.flush_deferred_revisions',
+        'schedule': timedelta(seconds=DEFERRED_REVISIONS['FLUSH_INTERVAL']),
+    },
+    'reconcile-notification-counters': {
+        'task': 'notifications.tasks.reconcile_notification_counters',
+        'schedule': timedelta(hours=1),
+    },
+    'maintain-login-activity-partitions': {
+        'task': 'authentication.tasks.maintain_login_activity_partitions',
+        'schedule': crontab(hour=2, minute=30),
+    },
+}
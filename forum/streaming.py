@@ -0,0 +1,50 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+STREAMING_RESPONSE = getattr(settings, 'STREAMING_RESPONSE', {})
+
+
+def is_streaming_requested(request):
+    return request.query_params.get('stream', '').lower() in ('1', 'true', 'yes')
+
+
+class JSONStreamingResponse(StreamingHttpResponse):
+    """
+    Renders an iterable of JSON-serializable items as a JSON array while the items are produced.
+    The opening bracket is sent at once, then items are written in chunks of about BUFFER_SIZE bytes, so memory
+    use is bounded by the chunk and the source iterator (e.g. a server-side database cursor), not the result size.
+    Since the status is sent first, an error in the middle of the stream shows up as a truncated array.
+    Under ASGI, Django would read a sync iterator to the end before sending anything, so the chunks are pulled
+    one at a time through sync_to_async, in the thread of the view and its database connection.
+    """
+    buffer_size = STREAMING_RESPONSE.get('BUFFER_SIZE', 64 * 1024)
+
+    def __init__(self, items, encoder=DjangoJSONEncoder, **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(self.iter_json_array(items, encoder), **kwargs)
+
+    async def __aiter__(self):
+        iterator = iter(self.streaming_content)
+        end = object()
+        while (chunk := await sync_to_async(next)(iterator, end)) is not end:
+            yield chunk
+
+    def iter_json_array(self, items, encoder):
+        yield b'['
+        separator = b''
+        chunk = []
+        size = 0
+        for item in items:
+            element = separator + json.dumps(item, cls=encoder).encode()
+            separator = b','
+            chunk.append(element)
+            size += len(element)
+            if size >= self.buffer_size:
+                yield b''.join(chunk)
+                chunk = []
+                size = 0
+        yield b''.join(chunk) + b']'
@@ -0,0 +1,233 @@
+import json
+import warnings
+from datetime import datetime
+from unittest.mock import patch
+
+from asgiref.sync import async_to_sync
+from channels.generic.websocket import AsyncWebsocketConsumer
+from channels.testing import WebsocketCommunicator
+from django.http import HttpResponse
+from django.db import connection
+from django.test import RequestFactory, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+
+from authentication.models import Company, CompanyAndUserRelation, CustomUser
+from forum.identity_map import IdentityMapMiddleware, identity_map
+from forum.pagination import InvalidCursor, KeysetPaginator
+from forum.settings import DB
+from forum.streaming import JSONStreamingResponse
+from forum.jwt_token_middleware import JWTAuthMiddleware
+from forum.managers import TokenManager
+
+
+class AcceptingConsumer(AsyncWebsocketConsumer):
+    async def connect(self):
+        await self.accept()
+
+
+class JWTAuthMiddlewareTest(TransactionTestCase):
+    """
+    Handshake tests for the websocket authentication middleware.
+    test_reconnect_storm_loads_user_once doubles as a handshake throughput check: it opens HANDSHAKES
+    connections with the same token and expects a single database lookup.
+    """
+    HANDSHAKES = 200
+    available_apps = ['django.contrib.auth', 'django.contrib.contenttypes', 'authentication']
+
+    def setUp(self):
+        JWTAuthMiddleware.users.clear()
+        self.application = JWTAuthMiddleware(AcceptingConsumer.as_asgi())
+        self.user = CustomUser.objects.create_user(email='socket@gmail.com', password='password123')
+        self.access_token = str(TokenManager.generate_access_token_for_user(self.user))
+
+    async def _connect(self, headers):
+        communicator = WebsocketCommunicator(self.application, '/ws/chat/room/', headers=headers)
+        connected, code = await communicator.connect()
+        if connected:
+            await communicator.disconnect()
+        return connected, code
+
+    async def test_missing_header_is_rejected_without_queries(self):
+        with patch.object(JWTAuthMiddleware, 'get_user') as get_user:
+            connected, code = await self._connect([])
+        self.assertFalse(connected)
+        self.assertEqual(code, JWTAuthMiddleware.close_code)
+        get_user.assert_not_called()
+
+    async def test_invalid_token_is_rejected_without_queries(self):
+        with patch.object(JWTAuthMiddleware, 'get_user') as get_user:
+            connected, code = await self._connect([(b'authorization', b'Bearer invalid.token.value')])
+        self.assertFalse(connected)
+        self.assertEqual(code, JWTAuthMiddleware.close_code)
+        get_user.assert_not_called()
+
+    async def test_valid_token_is_accepted(self):
+        connected, _ = await self._connect([(b'authorization', f'Bearer {self.access_token}'.encode())])
+        self.assertTrue(connected)
+
+    async def test_reconnect_storm_loads_user_once(self):
+        headers = [(b'authorization', f'Bearer {self.access_token}'.encode())]
+        with patch.object(JWTAuthMiddleware, 'get_user', wraps=self.application.get_user) as get_user:
+            for _ in range(self.HANDSHAKES):
+                connected, _ = await self._connect(headers)
+                self.assertTrue(connected)
+        self.assertEqual(get_user.call_count, 1)
+
+
+class IdentityMapTest(APITestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='mapped@gmail.com', password='password123')
+        self.company = Company.objects.create(brand='Mapped')
+        self.relation = CompanyAndUserRelation.objects.create(user_id=self.user, company_id=self.company)
+
+    def test_repeated_lookups_are_served_from_memory(self):
+        with identity_map() as current:
+            with self.assertNumQueries(3):
+                user = CustomUser.get_user(email='mapped@gmail.com')
+                self.assertIs(CustomUser.get_user(user_id=self.user.user_id), user)
+                self.assertIs(CustomUser.get_user(pk=self.user.pk), user)
+                company = Company.get_company(company_id=self.company.company_id)
+                self.assertIs(Company.get_company(pk=self.company.pk), company)
+                relation = CompanyAndUserRelation.get_relation(relation_id=self.relation.relation_id)
+                self.assertIs(CompanyAndUserRelation.get_relation(relation_id=self.relation.relation_id), relation)
+        self.assertEqual(current.saved_queries, 4)
+
+    def test_saved_instance_is_reloaded(self):
+        with identity_map():
+            company = Company.get_company(company_id=self.company.company_id)
+            Company.objects.filter(pk=self.company.pk).update(brand='Renamed')
+            company.save(update_fields=['tags'])
+            with self.assertNumQueries(1):
+                self.assertEqual(Company.get_company(company_id=self.company.company_id).brand, 'Renamed')
+
+    def test_missing_instance_is_not_stored(self):
+        with identity_map():
+            for _ in range(2):
+                with self.assertNumQueries(1), self.assertRaises(Company.DoesNotExist):
+                    Company.get_company(company_id=0)
+
+    def test_lookups_outside_of_request_are_not_cached(self):
+        with self.assertNumQueries(2):
+            Company.get_company(company_id=self.company.company_id)
+            Company.get_company(company_id=self.company.company_id)
+
+    @override_settings(DEBUG=True)
+    def test_middleware_reports_saved_queries(self):
+        def view(request):
+            for _ in range(3):
+                Company.get_company(company_id=self.company.company_id)
+            return HttpResponse()
+
+        response = IdentityMapMiddleware(view)(RequestFactory().get('/'))
+        self.assertEqual(response[IdentityMapMiddleware.header], '2')
+
+
+class KeysetPaginatorTest(APITestCase):
+
+    def setUp(self):
+        # brands repeat, so the primary key has to break the ties
+        self.companies = Company.objects.bulk_create(Company(brand=f'brand{i % 3}') for i in range(10))
+        self.collection = DB['PaginationTest']
+        self.collection.drop()
+        self.addCleanup(self.collection.drop)
+        self.collection.insert_many([{'brand': f'brand{i % 3}', 'position': i} for i in range(10)])
+
+    def _pages(self, paginate, limit):
+        pages, cursor = [], None
+        while True:
+            page = paginate(cursor=cursor, limit=limit)
+            pages.append(page['results'])
+            cursor = page['next']
+            if not cursor:
+                return pages
+
+    def test_queryset_pages_follow_ordering(self):
+        paginator = KeysetPaginator(('-brand', 'company_id'))
+        pages = self._pages(lambda **kwargs: paginator.paginate_queryset(Company.objects.all(), **kwargs), 4)
+        expected = list(Company.objects.order_by('-brand', 'company_id'))
+        self.assertEqual([len(page) for page in pages], [4, 4, 2])
+        self.assertEqual(sum(pages, []), expected)
+
+    def test_collection_pages_follow_ordering(self):
+        paginator = KeysetPaginator(('brand', '-_id'))
+        pages = self._pages(lambda **kwargs: paginator.paginate_collection(self.collection, {}, **kwargs), 3)
+        positions = [document['position'] for document in sum(pages, [])]
+        self.assertEqual(positions, sorted(range(10), key=lambda i: (i % 3, -i)))
+
+    def test_pipeline_pages_follow_ordering(self):
+        paginator = KeysetPaginator(('-position',))
+        pipeline = [{'$match': {'brand': 'brand0'}}]
+        pages = self._pages(lambda **kwargs: paginator.paginate_pipeline(self.collection, pipeline, **kwargs), 2)
+        self.assertEqual([[document['position'] for document in page] for page in pages], [[9, 6], [3, 0]])
+
+    def test_deep_page_is_a_seek(self):
+        paginator = KeysetPaginator(('company_id',))
+        cursor = paginator.make_cursor(self.companies[-3])
+        with CaptureQueriesContext(connection) as queries:
+            page = paginator.paginate_queryset(Company.objects.all(), cursor=cursor, limit=5)
+        self.assertEqual(page['results'], self.companies[-2:])
+        self.assertIsNone(page['next'])
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('OFFSET', queries[0]['sql'].upper())
+
+    def test_invalid_cursors_are_rejected(self):
+        paginator = KeysetPaginator(('company_id',))
+        cursor = paginator.make_cursor(self.companies[0])
+        for invalid in ('nope', cursor[:-2], cursor + 'x'):
+            with self.assertRaises(InvalidCursor):
+                paginator.paginate_queryset(Company.objects.all(), cursor=invalid)
+        with self.assertRaises(InvalidCursor):
+            KeysetPaginator(('-company_id',)).paginate_queryset(Company.objects.all(), cursor=cursor)
+
+    def test_page_size_is_bounded(self):
+        paginator = KeysetPaginator(('company_id',), page_size=3, max_page_size=5)
+        self.assertEqual(paginator.get_limit(), 3)
+        self.assertEqual(paginator.get_limit('abc'), 3)
+        self.assertEqual(paginator.get_limit('0'), 1)
+        self.assertEqual(paginator.get_limit(1000), 5)
+
+
+class JSONStreamingResponseTest(APITestCase):
+
+    def test_first_byte_is_sent_before_items_are_produced(self):
+        def items():
+            raise AssertionError("items were read before the first byte")
+            yield
+
+        response = JSONStreamingResponse(items())
+        self.assertEqual(next(iter(response.streaming_content)), b'[')
+
+    def test_items_are_written_in_bounded_chunks(self):
+        items = [{'position': i, 'created_at': datetime(2024, 1, 1)} for i in range(1000)]
+        with patch.object(JSONStreamingResponse, 'buffer_size', 1024):
+            chunks = list(JSONStreamingResponse(iter(items)).streaming_content)
+        self.assertGreater(len(chunks), 10)
+        self.assertTrue(all(len(chunk) < 2048 for chunk in chunks))
+        self.assertEqual(json.loads(b''.join(chunks)),
+                         [{'position': i, 'created_at': '2024-01-01T00:00:00'} for i in range(1000)])
+
+    def test_empty_result(self):
+        self.assertEqual(b''.join(JSONStreamingResponse(iter([])).streaming_content), b'[]')
+
+    def test_asgi_streams_while_items_are_produced(self):
+        produced = []
+
+        def items():
+            for i in range(1000):
+                produced.append(i)
+                yield {'position': i}
+
+        async def read(response):
+            chunks = []
+            async for chunk in response:
+                chunks.append((chunk, len(produced)))
+            return chunks
+
+        with patch.object(JSONStreamingResponse, 'buffer_size', 1024), warnings.catch_warnings():
+            warnings.simplefilter('error')
+            chunks = async_to_sync(read)(JSONStreamingResponse(items()))
+        self.assertEqual(chunks[0], (b'[', 0))
+        self.assertLess(chunks[1][1], 1000)
+        self.assertEqual(json.loads(b''.join(chunk for chunk, _ in chunks)), [{'position': i} for i in range(1000)])
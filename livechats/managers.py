@@ -6,6 +6,7 @@ from bson import ObjectId
 from pydantic import BaseModel
 
 from forum.managers import MongoManager
+from forum.pagination import KeysetPaginator
 from forum.settings import DB
 
 
@@ -28,6 +29,7 @@ class Conversation(BaseModel):
 
 class LiveChatManager(MongoManager):
     db = DB['conversations']
+    paginator = KeysetPaginator(('-_id',))
 
     @classmethod
     def create_conversation(cls, new_conversation):
@@ -49,16 +51,14 @@ class LiveChatManager(MongoManager):
         return None
 
     @classmethod
-    def get_users_conversations(cls, participant):
+    def get_users_conversations(cls, participant, cursor=None, limit=None):
+        """Returns a page of the user's conversations, the latest ones first."""
         query = {
             "$or": [
                 {"initiator_id": participant.user_id},
                 {"receiver_id": participant.user_id},
             ]}
-        conversations = cls.db.find(query, {"messages": 0})
-        conversation_list = cls.to_list(conversations)
-        conversation_list = conversation_list[::-1]
-        return conversation_list
+        return cls.paginate(query, cls.paginator, cursor, limit, projection={"messages": 0})
 
     @classmethod
     def get_conversation_by_id(cls, conversation_id):
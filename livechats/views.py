@@ -68,7 +68,8 @@ class ConversationsList(APIView):
 
     def get(self, request):
         current_user = request.user
-        conversations_list = lm.get_users_conversations(current_user)
+        conversations_list = lm.get_users_conversations(current_user, cursor=request.query_params.get('cursor'),
+                                                        limit=request.query_params.get('limit'))
         return Response(conversations_list, status=status.HTTP_200_OK)
 
 
@@ -1,11 +1,12 @@
 from functools import wraps
 
+from rest_framework import status
+
 from authentication.models import CompanyAndUserRelation
 from companies.models import Subscription
 
 from .manager import MESSAGE, SUBSCRIPTION, UPDATE
 from .manager import NotificationManager as nm
-from .manager import NotificationNotFound
 from .tasks import (create_notification, send_article_notification,
                     send_message_notification, send_subscribe_notification)
 
@@ -44,9 +45,12 @@ def extract_data_for_message(request, response):
 def extract_data_for_subscription(request, response):
     data = {}
     data['type'] = SUBSCRIPTION
+    # repeated subscriptions return the existing one with 200 and don't notify again
+    if response.status_code != status.HTTP_201_CREATED:
+        return None, response
     try:
-        data['event_id'] = response.data.pop('subscription_id')
-        company_id = response.data.pop('company_id')
+        data['event_id'] = response.data['subscription_id']
+        company_id = response.data['company_id']
     except KeyError:
         return None, response
     concerned_users = CompanyAndUserRelation.get_relations(company_id=company_id)
@@ -62,7 +66,7 @@ def extract_data_for_update(request, response):
     data['type'] = UPDATE
     data['event_id'] = response.data['document_was_created']['article_id']
     company_id = response.data.pop('company_id')
-    concerned_users = Subscription.get_subscriptions(company_id=company_id)
+    concerned_users = Subscription.get_subscriptions(company_id=company_id).select_related('investor__user_id')
     users_with_newsletter = concerned_users.exclude(get_email_newsletter=False)
     if users_with_newsletter:
         users_with_newsletter_emails = [subscription.investor.user_id.email for subscription in users_with_newsletter]
@@ -83,7 +87,9 @@ STRATEGIES = {
 
 def extract_notifications_for_user(related=False):
     """
-       Decorator that pulls out the notifications for user and adds them to response data.
+       Decorator that adds the notification summary of the user to response data.
+       The summary is read from the unread counter without loading the notifications; they are listed
+       page by page by the get_notification endpoint, starting from the returned cursor.
 
        Required parameters:
            - boolean parameter 'related' which indicates if user is 
@@ -93,7 +99,8 @@ def extract_notifications_for_user(related=False):
              if no ID is passed in response, takes it from request.user;
       
        Response:
-           - adds 'notifications' to response: list with notifications or else message.
+           - adds 'notifications' to response: {'unread': number of unread notifications,
+                                                'cursor': cursor of the first page}.
            - if user or relation ID is passed in response, pops it away;
     """
 
@@ -108,12 +115,8 @@ def extract_notifications_for_user(related=False):
             user_id, response = get_user_id(request, response, related)
             if not user_id:
                 return response
-            try:
-                user_id = add_prefix_to_id(user_id, related)
-                notifications = nm.extract_notifications_for_user(user_id)
-                response.data['notifications'] = notifications
-            except NotificationNotFound as e:
-                response.data['notifications'] = str(e)
+            user_id = add_prefix_to_id(user_id, related)
+            response.data['notifications'] = nm.get_summary(user_id)
             return response
 
         return wrapper
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from notifications.manager import NotificationManager
+
+
+class Command(BaseCommand):
+    help = "Recounts unread notifications of all users; run once to backfill the counters of existing notifications."
+
+    def handle(self, *args, **options):
+        users = NotificationManager.reconcile_unread_counts()
+        self.stdout.write(self.style.SUCCESS(f"Reconciled unread counters of {users} users"))
@@ -1,16 +1,20 @@
-from datetime import datetime, timedelta
+import smtplib
+from collections import Counter
+from datetime import datetime, timedelta, timezone
 from typing import Dict, List
 
 import pymongo
 from bson import ObjectId
-from django.core.mail import EmailMessage, EmailMultiAlternatives
+from django.core.mail import EmailMessage, EmailMultiAlternatives, get_connection
 from django.template.loader import render_to_string
+from django.urls import reverse
 from pydantic import BaseModel, Field, ValidationError
 
-from authentication.models import Company, CustomUser
+from authentication.models import Company, CompanyAndUserRelation, CustomUser
 from companies.models import Subscription
 from forum.managers import MongoManager
-from forum.settings import DB, EMAIL_HOST_USER
+from forum.pagination import KeysetPaginator
+from forum.settings import DB, EMAIL_HOST_USER, FRONTEND_URL
 
 UPDATE = 'update'
 MESSAGE = 'message'
@@ -76,13 +80,19 @@ class NotificationManager(MongoManager):
     NotificationManager is responsible for database interactions, including data validating  
     and serializing, errors handling and retrieved data formatting. To register your model 
     in manager you have to include it in types collection, with type as a key and model
-    as a value
+    as a value.
+    Unread notifications are counted per user in the counters collection ({_id: user id, unread: n}),
+    so the count is read with a single lookup instead of scanning the user's notifications. Drift of the counters
+    is corrected by the periodic reconciliation (see notifications.tasks).
     """
 
     db = DB['Notification']
+    counters = DB['NotificationCounter']
     types = {UPDATE: UpdateNotification,
              MESSAGE: MessageNotification,
              SUBSCRIPTION: SubscriptionNotification}
+    paginator = KeysetPaginator(('-_id',))
+    _indexes_created = False
 
     @classmethod
     def get_notification_by_query(cls, query, **kwargs):
@@ -122,7 +132,12 @@ class NotificationManager(MongoManager):
         date = datetime.now() - timedelta(days=30)
         date = date.strftime("%Y-%m-%d %H:%M:%S")
         query = {"created_at": {"$lt": date}}
+        unread = Counter()
+        for notification in cls.db.find(query, projection=['concerned_users', 'viewed_by']):
+            viewed = {viewed['user_id'] for viewed in notification.get('viewed_by', [])}
+            unread.update(u_id for u_id in notification['concerned_users'] if u_id not in viewed)
         res = cls.delete_documents(query)
+        cls.change_unread_count({u_id: -count for u_id, count in unread.items()}, None)
         return res
 
     @classmethod
@@ -134,11 +149,14 @@ class NotificationManager(MongoManager):
         """
         type_ = data.pop('type')
         event_id = data['event_id']
-        query = {'event_id': event_id}
+        # event ids are only unique within a type (e.g. an update and a subscription can share one)
+        query = {'type': type_, 'event_id': event_id}
         if cls.check_if_exist(query):
             raise AlreadyExist(
                 f"Notification for {type_} with EVENT_ID {event_id} already exists.")
         res = cls.create_document(data, type_)
+        if res:
+            cls.change_unread_count(data['concerned_users'], 1)
         return res
 
     @classmethod
@@ -154,6 +172,32 @@ class NotificationManager(MongoManager):
                 continue
         return res
 
+    @classmethod
+    def create_subscription_notifications(cls, investor_id, company_ids):
+        """
+        Creates notifications of the investor's new subscriptions to the companies, one per subscription,
+        concerning all users related to the subscribed company. Subscriptions that are already notified are
+        skipped. Returns the emails of the users concerned by the created notifications.
+        """
+
+        subscriptions = (Subscription.get_subscriptions(investor=investor_id, company__in=company_ids)
+                         .values_list('subscription_id', 'company_id'))
+        relations = (CompanyAndUserRelation.get_relations(company_id__in=company_ids)
+                     .values_list('company_id', 'relation_id', 'user_id__email'))
+        concerned_users, company_emails = {}, {}
+        for company_id, relation_id, email in relations:
+            concerned_users.setdefault(company_id, []).append(f'rel_{relation_id}')
+            company_emails.setdefault(company_id, set()).add(email)
+        emails = set()
+        for subscription_id, company_id in subscriptions:
+            try:
+                cls.create_notification({'type': SUBSCRIPTION, 'event_id': subscription_id,
+                                         'concerned_users': concerned_users.get(company_id, [])})
+            except AlreadyExist:
+                continue
+            emails |= company_emails.get(company_id, set())
+        return sorted(emails)
+
     @classmethod
     def extract_notifications_for_user(cls, u_id):
         """Extracting all the notifications that are regarded to user."""
@@ -162,6 +206,68 @@ class NotificationManager(MongoManager):
         err_msg = f"There is no notifications for the user."
         return cls.get_notifications_by_query(query, err=err_msg)
 
+    @classmethod
+    def ensure_indexes(cls):
+        if not cls._indexes_created:
+            cls.db.create_index([('concerned_users', pymongo.ASCENDING), ('_id', pymongo.DESCENDING)])
+            cls._indexes_created = True
+
+    @classmethod
+    def get_page(cls, u_id, cursor=None, limit=None):
+        """
+        Returns a page of the user's notifications, newest first, with the cursor of the next page (None on the
+        last page), see forum.pagination.KeysetPaginator.
+        """
+        cls.ensure_indexes()
+        return cls.paginate({'concerned_users': u_id}, cls.paginator, cursor, limit,
+                            projection=['event_id', 'type', 'created_at'])
+
+    @classmethod
+    def get_unread_count(cls, u_id):
+        counter = cls.counters.find_one({'_id': u_id})
+        return max(counter['unread'], 0) if counter else 0
+
+    @classmethod
+    def get_summary(cls, u_id):
+        """
+        Returns the unread count of the user and the cursor of the first page of get_page, which holds
+        the notifications created up to now (ObjectIds have second resolution, so up to a second later).
+        """
+        cursor = cls.paginator.make_cursor({'_id': ObjectId.from_datetime(datetime.now(timezone.utc)
+                                                                           + timedelta(seconds=1))})
+        return {'unread': cls.get_unread_count(u_id), 'cursor': cursor}
+
+    @classmethod
+    def change_unread_count(cls, u_ids, delta):
+        """Adds delta to the unread counters of the users (given as an iterable or a {user id: delta} dict)."""
+
+        deltas = u_ids if isinstance(u_ids, dict) else {u_id: delta for u_id in u_ids}
+        if deltas:
+            cls.counters.bulk_write([pymongo.UpdateOne({'_id': u_id}, {'$inc': {'unread': value}}, upsert=True)
+                                     for u_id, value in deltas.items()], ordered=False)
+
+    @classmethod
+    def reconcile_unread_counts(cls, batch_size=1000):
+        """
+        Recounts the unread notifications of all users from concerned_users and viewed_by and replaces their
+        counters (also the backfill of the counters of notifications created before they existed).
+        Returns the number of users with unread notifications.
+        """
+        unread = Counter({row['_id']: row['count'] for row in cls.db.aggregate([
+            {'$unwind': '$concerned_users'}, {'$group': {'_id': '$concerned_users', 'count': {'$sum': 1}}}])})
+        # users get a viewed_by entry only for notifications that concern them
+        unread.subtract({row['_id']: row['count'] for row in cls.db.aggregate([
+            {'$unwind': '$viewed_by'}, {'$group': {'_id': '$viewed_by.user_id', 'count': {'$sum': 1}}}])})
+        unread = {u_id: count for u_id, count in unread.items() if count > 0}
+        stale = [counter['_id'] for counter in cls.counters.find({'unread': {'$ne': 0}}, projection=['_id'])
+                 if counter['_id'] not in unread]
+        updates = [pymongo.UpdateOne({'_id': u_id}, {'$set': {'unread': count}}, upsert=True)
+                   for u_id, count in unread.items()]
+        updates += [pymongo.UpdateOne({'_id': u_id}, {'$set': {'unread': 0}}) for u_id in stale]
+        for start in range(0, len(updates), batch_size):
+            cls.counters.bulk_write(updates[start:start + batch_size], ordered=False)
+        return len(unread)
+
     @classmethod
     def extract_notifications_by_type(cls, type):
         """Extracting all notifications of given type."""
@@ -175,21 +281,19 @@ class NotificationManager(MongoManager):
         """
         This method stores user id in viewed_by field along with the time of viewing.
         """
-        query = {'$and': [{'_id': ObjectId(nf_id)}, {'concerned_users': u_id}]}
-        notification = cls.get_notification_by_query(query)
-        if any(viewed['user_id'] == u_id for viewed in notification.get('viewed_by', [])):
-            raise AlreadyViewed(
-                f"User with ID {u_id} already has viewed this notification")
+        query = {'_id': ObjectId(nf_id), 'concerned_users': u_id}
         try:
             viewed = Viewed.model_validate({'user_id': u_id})
         except ValidationError as e:
             raise InvalidData(str(e)) from e
+        # the not-viewed condition is part of the update, so concurrent views are counted once
         update = {'$push': {'viewed_by': viewed.model_dump()}}
-        notification = cls.update_document(
-            query, update, return_document=pymongo.ReturnDocument.AFTER)
+        notification = cls.update_document({**query, 'viewed_by.user_id': {'$ne': u_id}}, update)
         if not notification:
-            raise NotificationNotFound(
-                "Notification not found, perhaps due the connection error.")
+            cls.get_notification_by_query(query)
+            raise AlreadyViewed(
+                f"User with ID {u_id} already has viewed this notification")
+        cls.change_unread_count([u_id], -1)
         return notification
 
 
@@ -200,26 +304,56 @@ class EmailManager:
        Methods:
            - _email_sender(data: Dict): Sends a basic email.
            - _email_alternative_sender(data: Dict): Sends an HTML email with alternative content.
+           - _send_messages(messages: List): Sends messages over the shared connection of the process.
            - _data_formatter(email_subject: str, email_body: str, email: str): Formats email data.
-           - _email_subscription_filter(company): Filters email subscriptions based on company receiver.
+           - close_connection(): Closes the shared connection.
 
        Note:
            This class utilizes Django's EmailMessage and EmailMultiAlternatives classes for sending emails.
-           It also interacts with the Subscription model to filter email subscriptions based on company.
+           The SMTP connection is opened once per (worker) process and reused for all messages; a connection
+           dropped by the server is reopened once.
    """
+    _connection = None
 
-    @staticmethod
-    def _email_sender(data: Dict):
-        email = EmailMessage(subject=data['email_subject'], body=data['email_body'], from_email=data['from_email'],
-                             to=(data['to_email'],))
-        email.send()
+    @classmethod
+    def _get_connection(cls):
+        if EmailManager._connection is None:
+            EmailManager._connection = get_connection()
+            EmailManager._connection.open()
+        return EmailManager._connection
+
+    @classmethod
+    def close_connection(cls):
+        connection, EmailManager._connection = EmailManager._connection, None
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    @classmethod
+    def _send_messages(cls, messages: List):
+        try:
+            return cls._get_connection().send_messages(messages)
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            cls.close_connection()
+            return cls._get_connection().send_messages(messages)
 
     @staticmethod
-    def _email_alternative_sender(data: Dict):
+    def _build_message(data: Dict):
+        return EmailMessage(subject=data['email_subject'], body=data['email_body'], from_email=data['from_email'],
+                            to=(data['to_email'],))
+
+    @classmethod
+    def _email_sender(cls, data: Dict):
+        cls._send_messages([cls._build_message(data)])
+
+    @classmethod
+    def _email_alternative_sender(cls, data: Dict):
         email_message = EmailMultiAlternatives(subject=data['email_subject'], body=data['email_body'],
                                                from_email=data['from_email'], to=(data['to_email'],))
         email_message.content_subtype = "html"
-        email_message.send()
+        cls._send_messages([email_message])
 
     @staticmethod
     def _data_formatter(email_subject: str, email_body: str, email: str):
@@ -234,25 +368,43 @@ class EmailManager:
 class EmailAuthenticationManager(EmailManager):
     """
         EmailAuthenticationManager extends EmailManager for authentication-related email notifications.
+        Methods take ids and tokens only: users are loaded and templates are rendered by the worker.
 
         Methods:
-            - send_password_reset_notification(email, reset_link): Sends a password reset notification email.
-            - send_password_update_notification(user): Sends a password update notification email.
+            - send_verification_email(user_id, domain, access_token): Sends an email verification link.
+            - send_password_reset_notification(user_id, access_token): Sends a password reset notification email.
+            - send_password_update_notification(user_id): Sends a password update notification email.
     """
 
+    @staticmethod
+    def _get_user(user_id):
+        try:
+            return CustomUser.get_user(user_id=user_id)
+        except CustomUser.DoesNotExist:
+            raise NotExist('User is not exist with this id')
+
+    @classmethod
+    def send_verification_email(cls, user_id, domain, access_token):
+        user = cls._get_user(user_id)
+        verification_link = f"http://{domain}{reverse('email_verify', args=(access_token,))}"
+        email_body = render_to_string('email_verification.txt', {'user': user, 'verification_link': verification_link})
+        data = cls._data_formatter(email_subject='Email verification', email_body=email_body, email=user.email)
+        cls._email_sender(data)
+
     @classmethod
-    def send_password_reset_notification(cls, email, reset_link):
+    def send_password_reset_notification(cls, user_id, access_token):
+        user = cls._get_user(user_id)
         email_subject = 'Password Reset'
+        reset_link = f"{FRONTEND_URL}/auth/password-reset/{access_token}/"
         html_content = render_to_string('password_reset_email.html', {'reset_link': reset_link})
-        data = cls._data_formatter(email_subject, html_content, email)
+        data = cls._data_formatter(email_subject, html_content, user.email)
         cls._email_alternative_sender(data)
 
     @classmethod
-    def send_password_update_notification(cls, user):
-        email_subject = 'Password update'
-        email_body = (f'Dear {user.first_name} {user.surname}.'
-                      ' This is automatically generated email, your password was successfully changed')
-        data = cls._data_formatter(email_subject=email_subject, email_body=email_body, email=user.email)
+    def send_password_update_notification(cls, user_id):
+        user = cls._get_user(user_id)
+        email_body = render_to_string('password_update_email.txt', {'user': user})
+        data = cls._data_formatter(email_subject='Password update', email_body=email_body, email=user.email)
         cls._email_sender(data)
 
 
@@ -270,9 +422,8 @@ class EmailNotificationManager(EmailManager):
     def send_subscribe_notification(cls, emails_to_send: list[str]):
         email_subject = 'You have a new subscriber'
         email_body = 'Dear user, we would like to inform you about a new subscriber'
-        for email in emails_to_send:
-            data = cls._data_formatter(email_subject=email_subject, email_body=email_body, email=email)
-            cls._email_sender(data)
+        cls._send_messages([cls._build_message(cls._data_formatter(email_subject, email_body, email))
+                            for email in emails_to_send])
 
     @classmethod
     def send_message_notification(cls, user_email: str):
@@ -290,6 +441,5 @@ class EmailNotificationManager(EmailManager):
 
         email_subject = f'{company.brand} has a new article!'
         email_body = f'Dear user, we would like to inform you about a new article from {company.brand}!'
-        for email in emails_to_send:
-            data = cls._data_formatter(email_subject=email_subject, email_body=email_body, email=email)
-            cls._email_sender(data)
+        cls._send_messages([cls._build_message(cls._data_formatter(email_subject, email_body, email))
+                            for email in emails_to_send])
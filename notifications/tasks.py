@@ -1,17 +1,28 @@
 from celery import shared_task
+from celery.signals import worker_process_shutdown
 
-from .manager import EmailAuthenticationManager, EmailNotificationManager
+from .manager import EmailAuthenticationManager, EmailManager, EmailNotificationManager
 from .manager import NotificationManager as nm
 
 
+@worker_process_shutdown.connect
+def close_email_connection(**kwargs):
+    EmailManager.close_connection()
+
+
+@shared_task
+def send_verification_email(user_id, domain, access_token):
+    EmailAuthenticationManager.send_verification_email(user_id, domain, access_token)
+
+
 @shared_task
-def send_password_update_notification(user):
-    EmailAuthenticationManager.send_password_update_notification(user)
+def send_password_update_notification(user_id):
+    EmailAuthenticationManager.send_password_update_notification(user_id)
 
 
 @shared_task
-def send_password_reset_notification(email, reset_link):
-    EmailAuthenticationManager.send_password_reset_notification(email, reset_link)
+def send_password_reset_notification(user_id, access_token):
+    EmailAuthenticationManager.send_password_reset_notification(user_id, access_token)
 
 @shared_task
 def send_article_notification(company_id, emails_to_send):
@@ -30,3 +41,15 @@ def send_message_notification(user_email):
 @shared_task
 def create_notification(data):
     nm.create_notification(data)
+
+
+@shared_task
+def create_subscription_notifications(investor_id, company_ids):
+    emails = nm.create_subscription_notifications(investor_id, company_ids)
+    if emails:
+        EmailNotificationManager.send_subscribe_notification(emails)
+
+
+@shared_task
+def reconcile_notification_counters():
+    nm.reconcile_unread_counts()
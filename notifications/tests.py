@@ -1,3 +1,147 @@
-from django.test import TestCase
+from unittest.mock import patch
 
-# Create your tests here.
+from rest_framework import status
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase
+
+from authentication.models import Company, CompanyAndUserRelation, CustomUser
+from companies.models import Subscription
+from forum.settings import DB
+
+from .manager import MESSAGE, SUBSCRIPTION, AlreadyViewed
+from .manager import NotificationManager as nm
+from .tasks import create_subscription_notifications, reconcile_notification_counters
+
+
+def use_test_collections(test_case):
+    """Gives the test its own notification collections, so notifications in the configured database are kept."""
+
+    for attribute in ('db', 'counters'):
+        collection = DB[f'test_{getattr(nm, attribute).name}']
+        collection.drop()
+        test_case.addCleanup(collection.drop)
+        patcher = patch.object(nm, attribute, collection)
+        patcher.start()
+        test_case.addCleanup(patcher.stop)
+
+
+class NotificationSummaryTest(APITestCase):
+
+    def setUp(self):
+        use_test_collections(self)
+        self.user = CustomUser.objects.create_user(email='notified@gmail.com', password='password123')
+        self.user_key = f'u_{self.user.user_id}'
+
+    def _notify(self, count, concerned_users=None):
+        start = nm.db.count_documents({})
+        return [nm.create_notification({'type': SUBSCRIPTION, 'event_id': start + i,
+                                        'concerned_users': concerned_users or [self.user_key]})
+                for i in range(count)]
+
+    def _login(self):
+        with patch('authentication.throttling.SlidingWindowThrottle.allow_request', return_value=True):
+            return self.client.post(reverse('login'), {'email': 'notified@gmail.com', 'password': 'password123'},
+                                    format='json')
+
+    def test_login_returns_summary_without_loading_notifications(self):
+        self._notify(3)
+        with patch.object(nm.db, 'find') as find, patch.object(nm.db, 'count_documents') as count_documents:
+            response = self._login()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['notifications']['unread'], 3)
+        self.assertIn('cursor', response.data['notifications'])
+        find.assert_not_called()
+        count_documents.assert_not_called()
+
+    def test_notifications_are_paginated_from_login_cursor(self):
+        created = self._notify(5)
+        cursor = self._login().data['notifications']['cursor']
+
+        pages = []
+        while cursor:
+            response = self.client.get(reverse('get_notification'),
+                                       {'user_id': self.user_key, 'cursor': cursor, 'limit': 2})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            pages.append([notification['_id'] for notification in response.data['results']])
+            cursor = response.data['next']
+
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        self.assertEqual(sum(pages, []), created[::-1])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('get_notification'), {'user_id': self.user_key, 'cursor': 'nope'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_invalid_limit_falls_back_to_page_size(self):
+        self._notify(nm.paginator.page_size + 1)
+        response = self.client.get(reverse('get_notification'), {'user_id': self.user_key, 'limit': 'many'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), nm.paginator.page_size)
+
+    def test_concurrent_views_are_counted_once(self):
+        notification_id = self._notify(1, [7])[0]
+        nm.store_viewed_user(notification_id, 7)
+        with patch.object(nm, 'get_notification_by_query', return_value={'_id': notification_id}), \
+                self.assertRaises(AlreadyViewed):
+            # the other request read the notification before this view was stored
+            nm.store_viewed_user(notification_id, 7)
+        self.assertEqual(nm.counters.find_one({'_id': 7})['unread'], 0)
+        self.assertEqual(len(nm.db.find_one({})['viewed_by']), 1)
+
+    def test_reconcile_backfills_counters(self):
+        self._notify(3, [7, 8])
+        viewed = nm.db.find_one({})['_id']
+        nm.store_viewed_user(viewed, 7)
+        nm.counters.delete_many({})
+        nm.counters.insert_one({'_id': 9, 'unread': 4})
+
+        reconcile_notification_counters()
+        self.assertEqual([nm.get_unread_count(u_id) for u_id in (7, 8, 9)], [2, 3, 0])
+
+    def test_viewed_and_deleted_notifications_leave_unread_count(self):
+        viewed, unviewed = self._notify(2, concerned_users=[7, 8])
+        nm.store_viewed_user(viewed, 7)
+        self.assertEqual(nm.get_unread_count(7), 1)
+        self.assertEqual(nm.get_unread_count(8), 2)
+
+        nm.db.update_many({}, {'$set': {'created_at': '2000-01-01 00:00:00'}})
+        nm.delete_old_notifications()
+        self.assertEqual(nm.get_unread_count(7), 0)
+        self.assertEqual(nm.get_unread_count(8), 0)
+
+
+class SubscriptionNotificationsTest(APITestCase):
+
+    def setUp(self):
+        use_test_collections(self)
+        investor = Company.objects.create(brand='Investor')
+        self.investor_id = CompanyAndUserRelation.objects.create(
+            user_id=CustomUser.objects.create_user(email='investor@gmail.com', password='password123'),
+            company_id=investor).relation_id
+        self.startups = Company.objects.bulk_create(Company(brand=f'startup{i}', is_startup=True) for i in range(2))
+        self.founders = [CompanyAndUserRelation.objects.create(
+            user_id=CustomUser.objects.create_user(email=f'founder{i}@gmail.com', password='password123'),
+            company_id=startup) for i, startup in enumerate(self.startups)]
+        self.company_ids = [startup.company_id for startup in self.startups]
+        Subscription.subscribe_to_companies(self.investor_id, self.company_ids)
+
+    @patch('notifications.tasks.EmailNotificationManager.send_subscribe_notification')
+    def test_batch_is_notified_once_per_subscription(self, send_subscribe_notification):
+        create_subscription_notifications(self.investor_id, self.company_ids)
+        create_subscription_notifications(self.investor_id, self.company_ids)
+
+        self.assertEqual(nm.db.count_documents({'type': SUBSCRIPTION}), 2)
+        for founder in self.founders:
+            self.assertEqual(nm.get_unread_count(f'rel_{founder.relation_id}'), 1)
+        send_subscribe_notification.assert_called_once_with(['founder0@gmail.com', 'founder1@gmail.com'])
+
+    @patch('notifications.tasks.EmailNotificationManager.send_subscribe_notification')
+    def test_event_ids_of_other_types_do_not_block_notifications(self, send_subscribe_notification):
+        subscription_ids = Subscription.get_subscriptions(investor=self.investor_id).values_list('subscription_id',
+                                                                                                 flat=True)
+        nm.db.insert_many([{'type': MESSAGE, 'event_id': subscription_id, 'concerned_users': ['u_1']}
+                           for subscription_id in subscription_ids])
+        create_subscription_notifications(self.investor_id, self.company_ids)
+
+        self.assertEqual(nm.db.count_documents({'type': SUBSCRIPTION}), 2)
@@ -35,14 +35,22 @@ class CreateNotifications(APIView):
 
 
 class GetNotifications(APIView):
+    """
+        Lists notifications of the user page by page, newest first.
+
+        Request:
+            - Method: GET
+            - URL: /notifications/get_notification/?user_id=<id>&cursor=<cursor>&limit=<limit>
+            - cursor: the cursor returned at login or the 'next' cursor of the previous page (optional)
+        Response:
+            - 200 OK: {'results': list of notifications, 'next': cursor of the next page or None}
+            - 400 Bad Request: Invalid cursor
+    """
     def get(self, request):
         id = request.query_params.get('user_id')
         if not id:
             return er.NO_USER_ID.response()
-        try:
-            res = nm.extract_notifications_for_user(id)
-        except NotificationNotFound as e:
-            return Response({"error": str(e)})
+        res = nm.get_page(id, cursor=request.query_params.get('cursor'), limit=request.query_params.get('limit'))
         return Response(res)
 
 
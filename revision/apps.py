@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class RevisionConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'revision'
+
+    def ready(self):
+        from . import deferred  # pylint: disable=unused-import
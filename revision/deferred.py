@@ -0,0 +1,290 @@
+import json
+import logging
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from datetime import datetime
+from functools import wraps
+from uuid import uuid4
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core import serializers
+from django.db import InterfaceError, OperationalError, transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.encoding import force_str
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+from reversion.models import Revision, Version
+from reversion.revisions import _get_options, is_registered
+
+from .models import DeferredRevisionToken
+
+DEFERRED_REVISIONS = getattr(settings, 'DEFERRED_REVISIONS', {})
+
+logger = logging.getLogger('deferred_revisions')
+
+_current = ContextVar('deferred_revision', default=None)
+
+
+class DeferredRevision:
+    """Change records of the models registered with django-reversion that are saved within a deferred revision."""
+
+    def __init__(self):
+        self.token = uuid4().hex
+        self.user_id = None
+        self.records = {}
+
+    @classmethod
+    def current(cls):
+        return _current.get()
+
+    @classmethod
+    def set_user_id(cls, user_id):
+        revision = cls.current()
+        if revision is not None:
+            revision.user_id = user_id
+
+    def add(self, instance, using):
+        """Records the state of the saved instance; a later save of the same object in the revision replaces it."""
+
+        model = instance.__class__
+        options = _get_options(model)
+        content_types = ContentType.objects.db_manager(using)
+        content_type = content_types.get_for_model(model, for_concrete_model=options.for_concrete_model)
+        object_id = force_str(instance.pk)
+        self.records[(content_type.pk, object_id)] = {
+            'revision': self.token,
+            'seq': DeferredRevisions.next_seq(),
+            'date_created': timezone.now().isoformat(),
+            'content_type_id': content_type.pk,
+            'object_id': object_id,
+            'db': using,
+            'format': options.format,
+            'serialized_data': serializers.serialize(options.format, (instance,), fields=options.fields,
+                                                     use_natural_foreign_keys=options.use_natural_foreign_keys),
+            'object_repr': force_str(instance),
+        }
+
+
+@receiver(post_save)
+def add_to_deferred_revision(sender, instance, using, **kwargs):
+    revision = DeferredRevision.current()
+    if revision is not None and is_registered(sender):
+        revision.add(instance, using)
+
+
+@contextmanager
+def deferred_revision(atomic=True):
+    """
+    Captures saves of registered models in the enclosed block instead of a django-reversion revision and queues
+    their change records after commit. Nothing is queued if the block raises or its transaction is rolled back.
+    """
+    revision = DeferredRevision()
+    token = _current.set(revision)
+    try:
+        with transaction.atomic() if atomic else nullcontext():
+            yield revision
+            if revision.records and not (transaction.get_connection().in_atomic_block and transaction.get_rollback()):
+                records = [{**record, 'user_id': revision.user_id} for record in revision.records.values()]
+                transaction.on_commit(lambda: DeferredRevisions.push(records))
+    finally:
+        _current.reset(token)
+
+
+def create_deferred_revision(atomic=True, request_creates_revision=None):
+    """
+    View decorator that wraps requests that create revisions in a deferred revision. A response with an error
+    status (>= 400) rolls the request transaction back, and nothing is queued.
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def do_deferred_revision_view(request, *args, **kwargs):
+            if request_creates_revision(request):
+                with deferred_revision(atomic=atomic) as revision:
+                    response = func(request, *args, **kwargs)
+                    if response.status_code >= 400:
+                        if atomic:
+                            transaction.set_rollback(True)
+                        revision.records.clear()
+                    return response
+            return func(request, *args, **kwargs)
+        return do_deferred_revision_view
+    return decorator
+
+
+class DeferredRevisions:
+    """
+    Background writer of deferred revisions.
+
+    Change records are appended to a Redis list after commit and materialized as reversion Revision and Version
+    rows by flush(), in bulk, either as soon as BATCH_SIZE records are queued or on the celery beat interval.
+    Every record carries a sequence number taken from a Redis counter while the saved row is still locked by its
+    transaction, so the records of one object are numbered in commit order. Versions are inserted in that order,
+    which keeps the history of an object (ordered by Version id) in commit order; a record that arrives after
+    a newer one of its object was written is dropped as outdated. The written sequence numbers are kept for
+    MAX_LAG seconds; a record queued for longer than that after a newer one of its object was written is no longer
+    recognized as outdated. Like LoginActivityBuffer, a batch moves to the processing list first, so a batch left
+    over by a crashed flush is written by the next one. Every Revision is stored with the token of its deferred
+    revision, so the versions of a replayed batch that were already written are skipped. Records of a batch that
+    fails for other reasons than a lost database connection are written one by one, and the failing ones are moved
+    to the dead letter list, so a bad record can't stall the queue.
+    If Redis is unavailable, records are written at once.
+    """
+    key = 'deferred_revisions:queue'
+    processing_key = 'deferred_revisions:processing'
+    dead_key = 'deferred_revisions:dead'
+    seq_key = 'deferred_revisions:seq'
+    written_key = 'deferred_revisions:written'
+    written_at_key = 'deferred_revisions:written_at'
+    lock_key = 'deferred_revisions:flush'
+    batch_size = DEFERRED_REVISIONS.get('BATCH_SIZE', 500)
+    lock_timeout = DEFERRED_REVISIONS.get('LOCK_TIMEOUT', 60)
+    max_lag = DEFERRED_REVISIONS.get('MAX_LAG', 3600)
+
+    @classmethod
+    def get_connection(cls):
+        return get_redis_connection('default')
+
+    @classmethod
+    def next_seq(cls):
+        try:
+            return cls.get_connection().incr(cls.seq_key)
+        except RedisError as e:
+            logger.error(f"Deferred revision can't be numbered: {e}")
+            return None
+
+    @classmethod
+    def push(cls, records):
+        try:
+            queued = cls.get_connection().rpush(cls.key, *[json.dumps(record) for record in records])
+        except RedisError as e:
+            logger.error(f"Deferred revisions queue is unavailable: {e}")
+            # without Redis the outdated records can't be told apart, so they are written as they are
+            cls.write([dict(record, seq=None) for record in records])
+            return
+        if queued // cls.batch_size > (queued - len(records)) // cls.batch_size:
+            from .tasks import flush_deferred_revisions
+            flush_deferred_revisions.delay()
+
+    @staticmethod
+    def make_object_key(record):
+        return f"{record['content_type_id']}:{record['object_id']}"
+
+    @classmethod
+    def write(cls, records):
+        """Creates Revision and Version rows of the records. Returns the number of created versions."""
+
+        connection = None if any(record['seq'] is None for record in records) else cls.get_connection()
+        if connection is not None:
+            object_keys = list(dict.fromkeys(map(cls.make_object_key, records)))
+            written = dict(zip(object_keys, connection.hmget(cls.written_key, object_keys)))
+            records = [record for record in records
+                       if written[cls.make_object_key(record)] is None
+                       or record['seq'] > int(written[cls.make_object_key(record)])]
+        records = sorted(records, key=lambda record: (record['seq'] is None, record['seq'] or 0))
+        marks = {cls.make_object_key(record): record['seq'] for record in records}
+
+        # like reversion, only objects that still exist get versions
+        object_ids = {}
+        for record in records:
+            object_ids.setdefault((record['content_type_id'], record['db']), set()).add(record['object_id'])
+        existing = set()
+        for (content_type_id, db), ids in object_ids.items():
+            model = ContentType.objects.get_for_id(content_type_id).model_class()
+            existing |= {(content_type_id, force_str(pk))
+                         for pk in model._base_manager.using(db).filter(pk__in=ids).values_list('pk', flat=True)}
+        records = [record for record in records if (record['content_type_id'], record['object_id']) in existing]
+
+        if records:
+            with transaction.atomic():
+                # versions of a replayed batch that were written before the crash of its flush are skipped
+                revision_ids = dict(DeferredRevisionToken.objects.filter(
+                    token__in={record['revision'] for record in records}).values_list('token', 'revision_id'))
+                written_versions = set(Version.objects.filter(revision_id__in=revision_ids.values())
+                                       .values_list('revision_id', 'content_type_id', 'object_id'))
+                records = [record for record in records
+                           if (revision_ids.get(record['revision']), record['content_type_id'], record['object_id'])
+                           not in written_versions]
+                revisions = {}
+                for record in records:
+                    if record['revision'] not in revision_ids and record['revision'] not in revisions:
+                        revisions[record['revision']] = Revision(
+                            date_created=datetime.fromisoformat(record['date_created']),
+                            user_id=record['user_id'], comment='')
+                Revision.objects.bulk_create(revisions.values())
+                DeferredRevisionToken.objects.bulk_create(DeferredRevisionToken(revision=revision, token=token)
+                                                          for token, revision in revisions.items())
+                revision_ids.update((token, revision.pk) for token, revision in revisions.items())
+                Version.objects.bulk_create(
+                    Version(revision_id=revision_ids[record['revision']], content_type_id=record['content_type_id'],
+                            object_id=record['object_id'], db=record['db'], format=record['format'],
+                            serialized_data=record['serialized_data'], object_repr=record['object_repr'])
+                    for record in records)
+        if connection is not None and marks:
+            pipe = connection.pipeline()
+            pipe.hset(cls.written_key, mapping=marks)
+            pipe.zadd(cls.written_at_key, dict.fromkeys(marks, time.time()))
+            pipe.execute()
+        return len(records)
+
+    @classmethod
+    def write_batch(cls, connection, batch):
+        """Writes the queued records of the batch, moving the records that can't be written to the dead letters."""
+
+        try:
+            return cls.write([json.loads(record) for record in batch])
+        except (OperationalError, InterfaceError):
+            raise
+        except Exception as e:
+            logger.error(f"Deferred revisions batch can't be written, writing its records one by one: {e}")
+        written = 0
+        for record in batch:
+            try:
+                written += cls.write([json.loads(record)])
+            except (OperationalError, InterfaceError):
+                raise
+            except Exception as e:
+                logger.error(f"Deferred revision record is moved to {cls.dead_key}: {e}")
+                connection.rpush(cls.dead_key, record)
+        return written
+
+    @classmethod
+    def prune_written(cls, connection):
+        """Forgets the sequence numbers of objects that weren't written for MAX_LAG seconds."""
+
+        object_keys = connection.zrangebyscore(cls.written_at_key, '-inf', time.time() - cls.max_lag)
+        if object_keys:
+            pipe = connection.pipeline()
+            pipe.hdel(cls.written_key, *object_keys)
+            pipe.zrem(cls.written_at_key, *object_keys)
+            pipe.execute()
+
+    @classmethod
+    def flush(cls):
+        """Writes all queued records. Returns the number of written versions (None if another flush is running)."""
+
+        connection = cls.get_connection()
+        lock = connection.lock(cls.lock_key, timeout=cls.lock_timeout)
+        if not lock.acquire(blocking=False):
+            return None
+        written = 0
+        try:
+            records = connection.lrange(cls.processing_key, 0, -1)
+            while True:
+                if records:
+                    written += cls.write_batch(connection, records)
+                    connection.delete(cls.processing_key)
+                    lock.extend(cls.lock_timeout, replace_ttl=True)
+                pipe = connection.pipeline(transaction=False)
+                for _ in range(cls.batch_size):
+                    pipe.lmove(cls.key, cls.processing_key, 'LEFT', 'RIGHT')
+                records = [record for record in pipe.execute() if record is not None]
+                if not records:
+                    cls.prune_written(connection)
+                    return written
+        finally:
+            lock.release()
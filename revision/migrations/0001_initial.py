@@ -0,0 +1,23 @@
+# Generated by Django 5.0.3 on 2026-10-18 08:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('reversion', '0002_add_index_on_version_for_content_type_and_db'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeferredRevisionToken',
+            fields=[
+                ('revision', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='reversion.revision')),
+                ('token', models.CharField(max_length=32, unique=True)),
+            ],
+        ),
+    ]
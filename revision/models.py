@@ -0,0 +1,8 @@
+from django.db import models
+from reversion.models import Revision
+
+
+class DeferredRevisionToken(models.Model):
+    """Token of the deferred revision a reversion Revision was written from (see revision.deferred)."""
+    revision = models.OneToOneField(Revision, on_delete=models.CASCADE, primary_key=True)
+    token = models.CharField(max_length=32, unique=True)
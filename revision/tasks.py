@@ -0,0 +1,8 @@
+from celery import shared_task
+
+from .deferred import DeferredRevisions
+
+
+@shared_task
+def flush_deferred_revisions():
+    DeferredRevisions.flush()
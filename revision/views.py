@@ -2,14 +2,42 @@ from rest_framework import status
 from rest_framework.decorators import action
 from rest_framework.exceptions import APIException
 from rest_framework.response import Response
+from reversion import is_active, set_user
 from reversion.errors import RegistrationError
 from reversion.models import Version
 from reversion.views import RevisionMixin
 
+from authentication.principals import TokenPrincipal
+
+from .deferred import DEFERRED_REVISIONS, DeferredRevision, create_deferred_revision
 from .serializers import RevisionSerializer
 
 
 class CustomRevisionMixin(RevisionMixin):
+    """
+    RevisionMixin with an optional deferred mode (DEFERRED_REVISIONS['ENABLED']): instead of writing Revision and
+    Version rows in the request transaction, saved objects are queued after commit and written by the background
+    writer (see revision.deferred). Their history then shows up after the next flush.
+    """
+    revision_deferred = DEFERRED_REVISIONS.get('ENABLED', False)
+
+    def __init__(self, *args, **kwargs):
+        if not self.revision_deferred:
+            super().__init__(*args, **kwargs)
+            return
+        super(RevisionMixin, self).__init__(*args, **kwargs)
+        self.dispatch = create_deferred_revision(
+            atomic=self.revision_atomic,
+            request_creates_revision=self.revision_request_creates_revision
+        )(self.dispatch)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if self.revision_deferred:
+            DeferredRevision.set_user_id(getattr(request.user, 'user_id', None))
+        # revisions reference CustomUser rows, so a token principal is resolved to the full user
+        elif is_active() and isinstance(request.user, TokenPrincipal):
+            set_user(request.user.get_user())
 
     def get_versions(self):
         instance = self.get_object()
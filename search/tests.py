@@ -30,8 +30,8 @@ class TestCompanyFilter(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
         # Check if the response contains only the company with the specified brand
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['brand'], "Kyivbud")
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['brand'], "Kyivbud")
 
     def test_get_companies_filtered_by_address(self):
         """
@@ -44,5 +44,5 @@ class TestCompanyFilter(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
         # Check if the response contains only the company with the specified address
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['address'], "Dnipro")
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['address'], "Dnipro")
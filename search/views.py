@@ -4,7 +4,8 @@ from rest_framework.generics import ListAPIView
 
 from authentication.models import Company
 from companies.filters import CompanyFilter
-from companies.serializers import CompaniesSerializer
+from companies.serializers import CompanySummarySerializer
+from forum.pagination import KeysetPagination
 
 
 class SearchCompanyView(ListAPIView):
@@ -15,17 +16,19 @@ class SearchCompanyView(ListAPIView):
        Filters can be applied to fields like brand.
 
        Attributes:
-           queryset (QuerySet): The queryset containing all companies.
-           serializer_class (Serializer): The serializer class for serializing company data.
+           queryset (QuerySet): The queryset containing all companies, without the large text fields.
+           serializer_class (Serializer): The serializer class for serializing company summaries.
            filter_backends (list): The filter backends used for filtering companies.
            filterset_class (FilterSet): The filterset class used for defining filters.
            ordering_fields (list): The fields by which companies can be ordered.
+           pagination_class: Cursor pagination, see forum.pagination.KeysetPagination.
        """
-    queryset = Company.objects.all()
-    serializer_class = CompaniesSerializer
+    queryset = Company.get_companies_summary()
+    serializer_class = CompanySummarySerializer
     filter_backends = [
         django_filters.rest_framework.DjangoFilterBackend,
         filters.OrderingFilter,
     ]
     filterset_class = CompanyFilter
     ordering_fields = ["brand"]
+    pagination_class = KeysetPagination
@@ -1,9 +1,75 @@
+import hashlib
+import hmac
+import logging
 import re
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from string import punctuation
 
 import zxcvbn
+from django.conf import settings
 from rest_framework import serializers
-from rest_framework.exceptions import ValidationError
+from rest_framework.exceptions import APIException, ValidationError
+
+from authentication.cache import LRUCache
+from forum.errors import Error
+
+PASSWORD_STRENGTH = getattr(settings, 'PASSWORD_STRENGTH', {})
+
+logger = logging.getLogger('password_strength')
+
+
+class PasswordStrengthUnavailable(APIException):
+    status_code = Error.PASSWORD_STRENGTH_UNAVAILABLE.status
+    default_detail = Error.PASSWORD_STRENGTH_UNAVAILABLE.msg
+    default_code = 'password_strength_unavailable'
+
+
+class PasswordStrength:
+    """
+    zxcvbn score of a candidate password, evaluated within a time budget.
+    Only the first MAX_LENGTH characters are evaluated: the rest can only add to the strength.
+    An evaluation exceeding TIME_BUDGET seconds, waiting for a free worker included, raises
+    PasswordStrengthUnavailable (503), so a busy server never reports a strong password as weak; the thread
+    finishes in the background and caches its score for the retry.
+    Scores are cached in the process by an HMAC of the candidate and the user inputs, so raw passwords are never
+    kept in memory.
+    """
+    max_length = PASSWORD_STRENGTH.get('MAX_LENGTH', 24)
+    time_budget = PASSWORD_STRENGTH.get('TIME_BUDGET', 0.25)
+    scores = LRUCache(maxsize=PASSWORD_STRENGTH.get('CACHE_MAXSIZE', 4096), ttl=PASSWORD_STRENGTH.get('CACHE_TTL'))
+    executor = ThreadPoolExecutor(max_workers=PASSWORD_STRENGTH.get('WORKERS', 2),
+                                  thread_name_prefix='password_strength')
+
+    @classmethod
+    def make_key(cls, password, user_inputs):
+        message = '\0'.join([password, *(str(value or '') for value in user_inputs)])
+        return hmac.new(settings.SECRET_KEY.encode(), message.encode(), hashlib.sha256).hexdigest()
+
+    @classmethod
+    def evaluate(cls, password, user_inputs):
+        return zxcvbn.zxcvbn(password[:cls.max_length], user_inputs=user_inputs)['score']
+
+    @classmethod
+    def get_score(cls, password, user_inputs=()) -> int:
+        user_inputs = [value for value in user_inputs if value]
+        key = cls.make_key(password, user_inputs)
+        score = cls.scores.get(key)
+        if score is None:
+            future = cls.executor.submit(cls.evaluate, password, user_inputs)
+            try:
+                score = future.result(timeout=cls.time_budget)
+            except FutureTimeoutError:
+                logger.warning("Password strength evaluation exceeded its time budget")
+                future.add_done_callback(lambda done: cls.cache_score(key, done))
+                raise PasswordStrengthUnavailable()
+            cls.scores.set(key, score)
+        return score
+
+    @classmethod
+    def cache_score(cls, key, future):
+        if future.exception() is None:
+            cls.scores.set(key, future.result())
 
 
 class CustomValidationSerializer(serializers.Serializer):
@@ -13,17 +79,21 @@ class CustomValidationSerializer(serializers.Serializer):
             raise serializers.ValidationError("EDRPOU must be an 8-digit number")
         return value
 
-    @staticmethod
-    def validate_contact_email(email_to_validate: str):
-        pattern = r'([A-Za-z0-9]+[.-_])*[A-Za-z0-9]+@[A-Za-z0-9-]+(\.[A-Z|a-z]{2,})+'
-        if not re.match(pattern, email_to_validate):
+    # possessive quantifiers never give back what they matched, so both patterns run in linear time
+    email_pattern = re.compile(r'[A-Za-z0-9]++(?:[._-][A-Za-z0-9]++)*+@[A-Za-z0-9-]++(?:\.[A-Za-z]{2,}+)++')
+    email_max_length = 254
+    phone_pattern = re.compile(r'\+?[0-9]{7,13}+')
+
+    @classmethod
+    def validate_contact_email(cls, email_to_validate: str):
+        if (not isinstance(email_to_validate, str) or len(email_to_validate) > cls.email_max_length
+                or not cls.email_pattern.fullmatch(email_to_validate)):
             raise ValidationError("Email is invalid")
         return email_to_validate
 
-    @staticmethod
-    def validate_contact_phone(phone_number_to_validate: str):
-        pattern = r'^\+?[\d]{7,13}$'
-        if not re.match(pattern, phone_number_to_validate):
+    @classmethod
+    def validate_contact_phone(cls, phone_number_to_validate: str):
+        if not isinstance(phone_number_to_validate, str) or not cls.phone_pattern.fullmatch(phone_number_to_validate):
             raise ValidationError("Phone number is invalid")
         return phone_number_to_validate
 
@@ -37,8 +107,7 @@ class CustomValidationSerializer(serializers.Serializer):
                 or not any(symbol in punctuation for symbol in password_to_validate)):
             raise ValidationError(
                 "Password should include at least one uppercase latter, one lowercase letter, one digit and one symbol")
-        complexity = zxcvbn.zxcvbn(password_to_validate, user_inputs=[email, first_name, surname])
-        if complexity["score"] <= 2:
+        if PasswordStrength.get_score(password_to_validate, user_inputs=[email, first_name, surname]) <= 2:
             raise ValidationError("Password is weak, please enter another one")
 
         return password_to_validate